@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""This module contains the active tiles of the full-grid thermal model.
+
+Once the air far from the colony has relaxed to the ambient temperature, its
+cells no longer change, yet the uniform grid still updates them every epoch.
+ActiveTiles splits the grid into square tiles and only updates the active
+ones, so a sparse colony on a large map costs about as much as the tiles
+around it.
+"""
+# Standard library
+from __future__ import annotations
+# Packages
+import numpy as np
+# Custom
+from swarm_state import SwarmState
+import thermal
+
+# Material code of the padding cells around the environment, the largest
+# uint8 so it matches no material of thermal
+OUTSIDE = 255
+
+
+class ActiveTiles:
+    """Explicit full-grid model that skips the tiles at rest.
+
+    A tile is active while a penguin covers a cell of it or of a neighbouring
+    tile, and while its cells changed by more than ``tolerance`` in the last
+    epoch. A resting tile accrues the change it skips every epoch: the last
+    change it made, plus the change the heat flowing in from active
+    neighbours would make. It wakes once the accrued change, or the change
+    from its neighbours in one epoch, exceeds ``tolerance``. The largest
+    accrued change estimates the error against the uniform grid.
+
+    The fields of the grid persist between epochs. Only the cells covered
+    by the penguins are refilled and restamped, so no epoch at rest visits
+    every cell.
+
+    Parameters
+    ----------
+    env_size : tuple[int]
+        Size of the environment (rows, cols).
+    tile : int
+        Side of each tile in cells.
+    tolerance : float
+        Change of a cell in degrees C below which a tile rests.
+    grid_size : float
+        Size of each cell in m.
+    air_conductivity : float
+        Thermal conductivity of air.
+    ambient_temp : float
+        Ambient air temperature.
+    initial_temp : float
+        Initial air temperature.
+    dtype : type
+        Floating point type of the fields, the map is float64.
+    """
+    def __init__(
+        self,
+        env_size: tuple[int],
+        tile: int,
+        tolerance: float,
+        grid_size: float,
+        air_conductivity: float,
+        ambient_temp: float,
+        initial_temp: float,
+        dtype: type = float,
+    ):
+        self._env_size = tuple(env_size)
+        self._tile = tile
+        self._tolerance = tolerance
+        self._grid_size = grid_size
+        self._air_conductivity = air_conductivity
+        self._ambient_temp = ambient_temp
+        self._tiles = (-(-self._env_size[0] // tile),
+                       -(-self._env_size[1] // tile))
+        # Whole tiles plus a one cell halo around the environment. The cells
+        # outside the environment conduct nothing and never change
+        shape = (self._tiles[0] * tile + 2, self._tiles[1] * tile + 2)
+        self._map = np.full(shape=shape, fill_value=initial_temp, dtype=float)
+        self._fields = thermal.air_fields(shape, grid_size, air_conductivity,
+                                          dtype)
+        outside = np.ones(shape=shape, dtype=bool)
+        outside[1:self._env_size[0] + 1, 1:self._env_size[1] + 1] = False
+        self._fields.material[outside] = OUTSIDE
+        self._fields.half_res[outside] = np.inf
+        # Flat indices of the cells stamped by the last epoch
+        self._stamped = np.zeros(shape=0, dtype=int)
+        self._active = np.ones(shape=self._tiles, dtype=bool)
+        # Largest change of each tile in the last epoch it was updated
+        self._rate = np.zeros(shape=self._tiles, dtype=float)
+        # Change accrued by each resting tile since it was last updated
+        self._drift = np.zeros(shape=self._tiles, dtype=float)
+        self._max_drift = 0.0
+        self._updates = 0
+        self._epochs = 0
+
+    @property
+    def thermal_map(self) -> np.ndarray:
+        """np.ndarray[float]: Temperature of each cell, a view"""
+        return self._map[1:self._env_size[0] + 1, 1:self._env_size[1] + 1]
+
+    @property
+    def error_estimate(self) -> float:
+        """float: Largest change skipped by a resting tile in degrees C"""
+        return self._max_drift
+
+    @property
+    def update_fraction(self) -> float:
+        """float: Portion of the tile updates run so far"""
+        return self._updates / max(self._epochs * self._active.size, 1)
+
+    def _dilate(self, mask: np.ndarray) -> np.ndarray:
+        """Grow a tile mask by one tile, diagonals included."""
+        grown = mask.copy()
+        grown[1:] |= mask[:-1]
+        grown[:-1] |= mask[1:]
+        wide = grown.copy()
+        wide[:, 1:] |= grown[:, :-1]
+        wide[:, :-1] |= grown[:, 1:]
+        return wide
+
+    def step(self, state: SwarmState, time_step_size: float) -> int:
+        """Rasterize the swarm, advance the active tiles and gather.
+
+        Agents whose core temperature leaves the safe range are killed, see
+        thermal.gather_body_temps.
+
+        Parameters
+        ----------
+        state : SwarmState
+            Swarm to advance.
+        time_step_size : float
+            Time step in s.
+
+        Returns
+        -------
+        int
+            Number of tiles updated.
+        """
+        tile = self._tile
+        fields = self._fields
+        # Cells vacated by a penguin are refilled with ambient air
+        thermal.clear_cells(fields, self._stamped, self._grid_size,
+                            self._air_conductivity)
+        stamped = thermal.stamp_agents(fields, state, self._map,
+                                       self._grid_size, (-1, -1))
+        self._map.flat[np.setdiff1d(self._stamped,
+                                    stamped)] = self._ambient_temp
+        self._stamped = stamped
+        pinned = np.zeros(shape=self._tiles, dtype=bool)
+        rows, cols = np.unravel_index(stamped, self._map.shape)
+        pinned[(rows - 1) // tile, (cols - 1) // tile] = True
+        pinned = self._dilate(pinned)
+        active = self._active | pinned
+
+        index = np.flatnonzero(active)
+        tile_rows, tile_cols = np.divmod(index, self._tiles[1])
+        span = np.arange(tile + 2)
+        block = ((tile_rows[:, None] * tile + span)[:, :, None],
+                 (tile_cols[:, None] * tile + span)[:, None, :])
+        inner = (block[0][:, 1:-1], block[1][:, :, 1:-1])
+        temps = self._map[block]
+        heat, halo_flow = thermal.block_heat_exchange(
+            temps,
+            thermal.GridFields(fields.material[block], None,
+                               fields.half_res[block],
+                               fields.insulation_res[block], None,
+                               fields.source[inner]),
+            self._grid_size,
+            self._ambient_temp,
+            self._air_conductivity,
+        )
+        change = (heat / fields.heat_capacity[inner]) * time_step_size
+        self._map[inner] = temps[:, 1:-1, 1:-1] + change
+        self._rate.flat[index] = np.abs(change).max(axis=(1, 2),
+                                                    initial=0.0)
+
+        # Change the heat flowing out of the active tiles makes next door
+        capacity = fields.heat_capacity[block]
+        incoming = np.zeros(shape=self._tiles, dtype=float)
+        sides = (
+            (-1, 0, capacity[:, 0, 1:-1]),
+            (1, 0, capacity[:, -1, 1:-1]),
+            (0, -1, capacity[:, 1:-1, 0]),
+            (0, 1, capacity[:, 1:-1, -1]),
+        )
+        for flow, (d_row, d_col, side_capacity) in zip(halo_flow, sides):
+            neighbor_rows = tile_rows + d_row
+            neighbor_cols = tile_cols + d_col
+            inside = ((neighbor_rows >= 0) & (neighbor_rows < self._tiles[0])
+                      & (neighbor_cols >= 0)
+                      & (neighbor_cols < self._tiles[1]))
+            np.maximum.at(
+                incoming,
+                (neighbor_rows[inside], neighbor_cols[inside]),
+                np.abs(flow[inside] / side_capacity[inside]).max(
+                    axis=1, initial=0.0) * time_step_size,
+            )
+        resting = ~active
+        self._drift[resting] += self._rate[resting] + incoming[resting]
+        self._drift[active] = 0.0
+        self._max_drift = max(self._max_drift, float(self._drift.max()))
+        self._active = (pinned | (self._rate > self._tolerance)
+                        | (self._drift > self._tolerance)
+                        | (incoming > self._tolerance))
+        self._updates += len(index)
+        self._epochs += 1
+        thermal.gather_body_temps(state, self._map, (-1, -1))
+        return len(index)
+
+    def snapshot(self) -> dict:
+        """Copy the map, the fields and the tile states for a checkpoint."""
+        return {
+            "map": self._map.copy(),
+            "material": self._fields.material.copy(),
+            "agent_id": self._fields.agent_id.copy(),
+            "half_res": self._fields.half_res.copy(),
+            "insulation_res": self._fields.insulation_res.copy(),
+            "heat_capacity": self._fields.heat_capacity.copy(),
+            "source": self._fields.source.copy(),
+            "stamped": self._stamped.copy(),
+            "active": self._active.copy(),
+            "rate": self._rate.copy(),
+            "drift": self._drift.copy(),
+            "counters": np.array([self._max_drift, self._updates,
+                                  self._epochs]),
+        }
+
+    def restore(self, arrays: dict) -> None:
+        """Replace the map, the fields and the tile states with a snapshot.
+
+        The thermal_map view stays valid.
+        """
+        self._map[...] = arrays["map"]
+        for name in ("material", "agent_id", "half_res", "insulation_res",
+                     "heat_capacity", "source"):
+            getattr(self._fields, name)[...] = arrays[name]
+        self._stamped = arrays["stamped"].astype(int)
+        self._active = arrays["active"].astype(bool)
+        self._rate = arrays["rate"].astype(float)
+        self._drift = arrays["drift"].astype(float)
+        max_drift, updates, epochs = arrays["counters"]
+        self._max_drift = float(max_drift)
+        self._updates = int(updates)
+        self._epochs = int(epochs)
@@ -8,6 +8,8 @@ from abc import ABC, abstractmethod, abstractproperty
 # Packages
 import numpy as np
 import colorsys
+# Custom
+from swarm_state import SwarmState
 
 
 class Agent(ABC):
@@ -26,8 +28,8 @@ class Agent(ABC):
 
     Notes
     -----
-    This is preliminary. It can change based on future needs, as long as
-    dependencies are also changed.
+    An agent is a thin view onto one row of a SwarmState. A new agent owns a
+    single-row state until an Environment adopts it into the shared one.
     """
 
     def __init__(
@@ -49,25 +51,65 @@ class Agent(ABC):
         movement_speed: int,
         metabolism: float,
     ):
-        self._row = row
-        self._col = col
-        self._body_radius = body_radius
-        self._sense_radius = sense_radius
-        self._body_temp = np.full(shape=(2*body_radius-1, 2*body_radius-1),
-                                  fill_value=body_temp, dtype=float)
-        self._low_death_threshold = low_death_threshold
-        self._high_death_threshold = high_death_threshold
-        self._low_move_threshold = low_move_threshold
-        self._high_move_threshold = high_move_threshold
-        self._internal_conductivity = internal_conductivity
-        self._external_conductivity = external_conductivity
-        self._insulation_thickness = insulation_thickness
-        self._density = density
-        self._movement_speed = movement_speed
-        self._metabolism = metabolism
-        self._alive = True
+        self._state = None
+        self._index = None
+        state = SwarmState()
+        state.append(
+            row=row,
+            col=col,
+            body_temp=body_temp,
+            body_radius=body_radius,
+            sense_radius=sense_radius,
+            low_death_threshold=low_death_threshold,
+            high_death_threshold=high_death_threshold,
+            low_move_threshold=low_move_threshold,
+            high_move_threshold=high_move_threshold,
+            internal_conductivity=internal_conductivity,
+            external_conductivity=external_conductivity,
+            insulation_thickness=insulation_thickness,
+            density=density,
+            movement_policy=movement_policy,
+            movement_speed=movement_speed,
+            metabolism=metabolism,
+        )
+        self.bind(state, 0)
         self._color = None
-        self._movement_policy = movement_policy
+
+    def bind(self, state: SwarmState, index: int) -> None:
+        """Point this agent at a row of a SwarmState.
+
+        Parameters
+        ----------
+        state : SwarmState
+            Container holding the agent data.
+        index : int
+            Row of the agent in ``state``.
+        """
+        self._state = state
+        self._index = index
+
+    @classmethod
+    def view(cls, state: SwarmState, index: int) -> Agent:
+        """Create an agent bound to an existing row of a SwarmState.
+
+        Unlike the constructor, no row is appended, so this is how agents
+        are recreated for a restored SwarmState.
+        """
+        agent = cls.__new__(cls)
+        agent._color = None
+        agent.bind(state, index)
+        return agent
+
+    @property
+    def state(self) -> SwarmState:
+        """SwarmState: Container holding this agent's data."""
+        return self._state
+
+    @property
+    def index(self) -> int:
+        """int: Row of this agent in its SwarmState."""
+        return self._index
+
     @abstractmethod
     def get_move(self, neighbors: list[Agent],
                  thermal_points: dict[str, float]) -> np.ndarray[int]:
@@ -85,29 +127,31 @@ class Agent(ABC):
     @property
     def body_radius(self) -> int:
         """int: Radius of the agent body."""
-        return self._body_radius
+        return int(self._state.body_radius[self._index])
 
     @body_radius.setter
     def body_radius(self, body_radius: int):
-        self._body_radius = abs(int(body_radius))
+        body_radius = abs(int(body_radius))
+        self._state.reserve_radius(body_radius)
+        self._state.body_radius[self._index] = body_radius
 
     @property
     def sense_radius(self) -> int:
         """int: Radius of the agent sensing other agents."""
-        return self._sense_radius
+        return int(self._state.sense_radius[self._index])
 
     @sense_radius.setter
     def sense_radius(self, sense_radius: float):
-        self._sense_radius = abs(int(sense_radius))
+        self._state.sense_radius[self._index] = abs(int(sense_radius))
 
     @property
     def alive(self) -> bool:
         """bool: Whether or not the penguin is alive."""
-        return self._alive
+        return bool(self._state.alive[self._index])
 
     @alive.setter
     def alive(self, alive: bool) -> None:
-        self._alive = alive
+        self._state.alive[self._index] = alive
 
     def kill(self) -> None:
         """Kill the current agent."""
@@ -117,34 +161,32 @@ class Agent(ABC):
     def body_temp(self) -> np.ndarray[float]:
         """float: Internal body temperature of the agent.
 
-        The setter checks the temperature thresholds and the agent dies if the
-        set temp is outside of the range.
+        The getter returns a view into the SwarmState. The setter checks the
+        temperature thresholds and the agent dies if the set temp is outside
+        of the range.
         """
-        return self._body_temp
+        return self._state.body_slice(self._index)
 
     @body_temp.setter
     def body_temp(self, body_temp: np.ndarray[float]) -> None:
-        self._body_temp = body_temp
-        if (self.core_temp > self._high_death_threshold
-                or self.core_temp < self._low_death_threshold):
+        self._state.body_slice(self._index)[...] = body_temp
+        if (self.core_temp > self.high_death_threshold
+                or self.core_temp < self.low_death_threshold):
             self.kill()
 
     @property
     def position(self) -> np.ndarray[int]:
         """np.ndarray[int]: Current coordinates of the agent (x, y)"""
-        return np.array((self._row, self._col), dtype=int)
+        return self._state.positions[self._index].copy()
 
     @position.setter
     def position(self, position: np.ndarray[int]) -> None:
-        self._row = int(position[0])
-        self._col = int(position[1])
+        self._state.positions[self._index] = (int(position[0]),
+                                              int(position[1]))
 
     def is_collision(self, agent: Agent) -> bool:
         """Check if there is a collision between a given agent"""
-        diffs = list()
-        diffs.append(abs(self.position[0] - agent.position[0]))
-        diffs.append(abs(self.position[1] - agent.position[1]))
-        diff = sum(diffs)
+        diff = np.abs(self.position - agent.position).sum()
         min_diff = self.body_radius + agent.body_radius - 1
         return diff < min_diff
 
@@ -153,12 +195,68 @@ class Agent(ABC):
         """np.ndarray[float] : Color to display the agent"""
         self._color = np.array(colorsys.hsv_to_rgb(
             0.5 - 0.5 *
-            (self.core_temp - self._low_death_threshold) /
-            (self._high_death_threshold - self._low_death_threshold),
+            (self.core_temp - self.low_death_threshold) /
+            (self.high_death_threshold - self.low_death_threshold),
             1.0, 0.5
         ))
         return self._color
 
     @property
     def core_temp(self) -> float:
-        return self._body_temp[self._body_radius-1][self._body_radius-1]
+        """float: Temperature of the core cell of the agent."""
+        return float(self._state.core_temp[self._index])
+
+    @property
+    def low_death_threshold(self) -> float:
+        """float: Core temperature below which the agent dies."""
+        return float(self._state.low_death_threshold[self._index])
+
+    @property
+    def high_death_threshold(self) -> float:
+        """float: Core temperature above which the agent dies."""
+        return float(self._state.high_death_threshold[self._index])
+
+    @property
+    def low_move_threshold(self) -> float:
+        """float: Core temperature below which the agent seeks heat."""
+        return float(self._state.low_move_threshold[self._index])
+
+    @property
+    def high_move_threshold(self) -> float:
+        """float: Core temperature above which the agent avoids heat."""
+        return float(self._state.high_move_threshold[self._index])
+
+    @property
+    def internal_conductivity(self) -> float:
+        """float: Thermal conductivity within the agent."""
+        return float(self._state.internal_conductivity[self._index])
+
+    @property
+    def external_conductivity(self) -> float:
+        """float: Thermal conductivity of the agent insulation."""
+        return float(self._state.external_conductivity[self._index])
+
+    @property
+    def insulation_thickness(self) -> float:
+        """float: Thickness of the agent insulation."""
+        return float(self._state.insulation_thickness[self._index])
+
+    @property
+    def density(self) -> float:
+        """float: Density of the agent body."""
+        return float(self._state.density[self._index])
+
+    @property
+    def movement_policy(self) -> str:
+        """str: Name of the movement policy."""
+        return self._state.movement_policy[self._index]
+
+    @property
+    def movement_speed(self) -> int:
+        """int: Number of tiles the agent can move per epoch."""
+        return int(self._state.movement_speed[self._index])
+
+    @property
+    def metabolism(self) -> float:
+        """float: Rate of heat generation."""
+        return float(self._state.metabolism[self._index])
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""This module contains the compute backends of the hot kernels.
+
+A backend is a set of kernels with the signatures and results of the NumPy
+reference kernels:
+
+- ``pair_heat_flow``, the pairwise heat term of the simple thermal model,
+  see thermal.population_heat_flow
+- ``apply_operator``, the cell stencil of the grid thermal model, see
+  thermal.apply_operator
+- ``sense_filter``, the distance test of the neighbour scan, see
+  spatial.sense_filter
+- ``greedy_step``, the step loop of a move, see policy.greedy_step
+
+The backend is selected by name with the ``backend`` option. "numpy" is the
+default, "numba" compiles loop versions of the kernels and needs the numba
+package, see numba_kernels. Every backend must pass equivalence_errors.
+"""
+# Standard library
+from __future__ import annotations
+from typing import Callable, NamedTuple
+import functools
+import importlib
+import logging
+# Packages
+import numpy as np
+# Custom
+import policy
+import spatial
+import thermal
+
+LOG = logging.getLogger("penguin_swarm.backend")
+
+# Names of the backends, each but numpy is provided by <name>_kernels
+BACKENDS = ("numpy", "numba")
+
+
+class Backend(NamedTuple):
+    """Kernel set of a compute backend.
+
+    Attributes
+    ----------
+    name : str
+        One of BACKENDS.
+    pair_heat_flow : Callable
+        Same as thermal.population_heat_flow.
+    apply_operator : Callable
+        Same as thermal.apply_operator.
+    sense_filter : Callable
+        Same as spatial.sense_filter.
+    greedy_step : Callable
+        Same as policy.greedy_step.
+    """
+    name: str
+    pair_heat_flow: Callable
+    apply_operator: Callable
+    sense_filter: Callable
+    greedy_step: Callable
+
+
+NUMPY_BACKEND = Backend(
+    "numpy",
+    thermal.population_heat_flow,
+    thermal.apply_operator,
+    spatial.sense_filter,
+    policy.greedy_step,
+)
+
+
+@functools.lru_cache(maxsize=None)
+def load_backend(name: str = "numpy") -> Backend:
+    """Get the kernel set of a backend.
+
+    Parameters
+    ----------
+    name : str
+        One of BACKENDS.
+
+    Returns
+    -------
+    Backend
+        Kernels of the backend, the numpy kernels if its package is not
+        installed.
+    """
+    if name == "numpy":
+        return NUMPY_BACKEND
+    try:
+        module = importlib.import_module(f"{name}_kernels")
+    except ImportError as error:
+        LOG.warning(f"The {name} backend is not available ({error}), using "
+                    "the numpy backend")
+        return NUMPY_BACKEND
+    return module.BACKEND
+
+
+def _random_kernel_inputs(rng: np.random.Generator) -> dict:
+    """Draw the inputs of every kernel for equivalence_errors."""
+    count = 64
+    rows = rng.integers(0, 200, size=(3, count))
+    cols = rng.integers(0, 200, size=(3, count))
+    radius = rng.integers(1, 4, size=(3, count))
+    shape = (37, 53)
+    operator = thermal.GridOperator(
+        rng.uniform(0.0, 2.0, size=(shape[0] - 1, shape[1])),
+        rng.uniform(0.0, 2.0, size=(shape[0], shape[1] - 1)),
+        rng.uniform(0.0, 1.0, size=shape) * (rng.random(size=shape) < 0.5),
+        rng.normal(0.0, 50.0, size=shape),
+    )
+    found = rng.permutation(500)[:300]
+    start = rng.integers(-50, 50, size=(200, 2))
+    return {
+        "pair_heat_flow": (
+            (rows, cols, radius, rng.normal(30.0, 10.0, size=(3, count)),
+             rng.uniform(0.1, 1.0, size=(3, count)), 40.0, 0.1),
+            {
+                "chunk_size": 24
+            },
+        ),
+        "apply_operator": ((operator, rng.normal(0.0, 20.0, size=shape)),
+                           dict()),
+        "sense_filter": (
+            (found, rng.integers(0, 100, size=500),
+             rng.integers(0, 100, size=500), rng.integers(1, 40, size=500),
+             rng.random(size=500) < 0.8, 50, 50, int(found[0])),
+            dict(),
+        ),
+        "greedy_step": ((start, start + rng.integers(-9, 10, size=(200, 2)),
+                         rng.integers(0, 8, size=200)), dict()),
+    }
+
+
+def equivalence_errors(backend: Backend,
+                       tolerance: float = 1E-9,
+                       seed: int = 0) -> list[str]:
+    """Compare every kernel of a backend with the NumPy reference.
+
+    Parameters
+    ----------
+    backend : Backend
+        Kernels to check.
+    tolerance : float
+        Largest relative difference of a floating point result. Integer
+        results must match exactly.
+    seed : int
+        Seed of the random inputs.
+
+    Returns
+    -------
+    list[str]
+        Description of every kernel that differs, empty if all match.
+    """
+    errors = list()
+    inputs = _random_kernel_inputs(np.random.default_rng(seed))
+    for kernel, (args, kwargs) in inputs.items():
+        expected = getattr(NUMPY_BACKEND, kernel)(*args, **kwargs)
+        actual = np.asarray(getattr(backend, kernel)(*args, **kwargs))
+        if actual.shape != expected.shape:
+            errors.append(f"{kernel} returned the shape {actual.shape} "
+                          f"instead of {expected.shape}")
+        elif np.issubdtype(expected.dtype, np.floating):
+            scale = np.abs(expected).max(initial=0.0)
+            difference = np.abs(actual - expected).max(initial=0.0)
+            if not difference <= tolerance * scale:
+                errors.append(f"{kernel} is off by {difference:.3g}, "
+                              f"{difference / scale:.3g} relative")
+        elif not np.array_equal(actual, expected):
+            errors.append(f"{kernel} returned other values")
+    return errors
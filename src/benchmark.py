@@ -0,0 +1,640 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module benchmarks the simulator over a grid of scenarios.
+
+A scenario sets the colony size, the environment size, the thermal model,
+the movement policy and whether a GIF is made. Every other option comes
+from the template config. Each scenario runs with profiling on in a fresh
+worker process, so its peak RSS is its own, and reports epochs per second,
+peak RSS and the time of each phase per epoch.
+
+The results are saved as JSON with a description of the machine, so runs
+can be compared over time with ``--compare``. Before the benchmarks, a few
+small seeded scenarios are checked against the survival and temperature
+curves in GOLDEN_FILE, so an optimization cannot silently change the
+simulation. ``--golden update`` rewrites the file after an intended change.
+``--backend`` runs everything on another compute backend, whose kernels are
+first checked against the NumPy ones, see backend.equivalence_errors.
+``--precision float32`` runs the grid model on float32 fields, its golden
+curves must stay within PRECISION_TOLERANCE of the float64 ones.
+"""
+# Standard library
+import argparse
+import concurrent.futures
+import datetime
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import pathlib
+import platform
+import resource
+import shutil
+import subprocess
+import time
+# Packages
+import coloredlogs
+import numpy as np
+# Custom
+import backend as backends
+import config_gen
+import main as simulator
+
+###############################################################################
+# Constant definitions
+###############################################################################
+
+LOG = logging.getLogger("penguin_swarm.benchmark")
+
+# Output directory of the benchmarks, relative to the project root
+BENCH_DIR = simulator.PROJ_DIR.joinpath("img", "bench")
+# Reference curves of the golden scenarios
+GOLDEN_FILE = simulator.SRC_DIR.joinpath("bench", "golden.json")
+
+# Scenario grids, each a dict of the values of every scenario parameter
+SUITES = {
+    "quick": {
+        "count": (32, 128),
+        "env_size": (128, ),
+        "thermal_model": ("simple", "grid"),
+        "movement_policy": ("average", "closest"),
+        "make_gif": (False, True),
+    },
+    "full": {
+        "count": (32, 100, 1000, 10000),
+        "env_size": (128, 512, 2048),
+        "thermal_model": ("simple", "grid"),
+        "movement_policy": ("average", "closest"),
+        "make_gif": (False, True),
+    },
+}
+
+# Seeded scenarios whose curves must match GOLDEN_FILE
+GOLDEN_SCENARIOS = tuple(
+    {
+        "count": 32,
+        "env_size": 128,
+        "thermal_model": thermal_model,
+        "movement_policy": movement_policy,
+        "make_gif": False,
+    } for thermal_model, movement_policy in itertools.product(
+        ("simple", "grid"), ("average", "closest")))
+# Template options replaced in the golden scenarios, so the penguins move,
+# cool down and die within GOLDEN_EPOCHS
+GOLDEN_OVERRIDES = {
+    "env": {
+        "time_step_size": "600",
+        "thermal_integrator": "implicit",
+    },
+}
+GOLDEN_EPOCHS = 40
+GOLDEN_SEED = 7
+# Largest relative difference of a golden curve value of a float32 run
+PRECISION_TOLERANCE = 1E-6
+
+###############################################################################
+# Function definitions
+###############################################################################
+
+
+def parse_args(arg_list: list[str] = None):
+    """Parse the arguments
+
+    Parameters
+    ----------
+    arg_list : list[str]
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the penguin swarm simulator",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "--suite",
+        help="Scenario grid, the options below replace one of its axes",
+        choices=tuple(SUITES),
+        default="quick",
+    )
+    parser.add_argument(
+        "--counts",
+        help="Penguin counts",
+        type=int,
+        nargs="+",
+    )
+    parser.add_argument(
+        "--env_sizes",
+        help="Environment sides in cells, the environment is square",
+        type=int,
+        nargs="+",
+    )
+    parser.add_argument(
+        "--thermal_models",
+        help="Thermal models",
+        choices=("simple", "grid"),
+        nargs="+",
+    )
+    parser.add_argument(
+        "--policies",
+        help="Movement policies",
+        choices=("average", "closest"),
+        nargs="+",
+    )
+    parser.add_argument(
+        "--gif",
+        help="Whether the scenarios make a GIF",
+        choices=("off", "on", "both"),
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        help="Compute backend of every scenario",
+        choices=backends.BACKENDS,
+        default="numpy",
+    )
+    parser.add_argument(
+        "-p",
+        "--precision",
+        help="Floating point type of the grid model fields of every scenario",
+        choices=simulator.Environment.PRECISIONS,
+        default="float64",
+    )
+    parser.add_argument(
+        "-e",
+        "--epochs",
+        help="Epochs of each scenario",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "-t",
+        "--template",
+        help="Config providing every option that is not a scenario axis",
+        type=pathlib.Path,
+        default=config_gen.TEMPLATE_CFG,
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        help="Seed of every scenario",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of worker processes, more than 1 disturbs the timings",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--golden",
+        help="""What to do with the golden scenarios:
+        check  = compare their curves with the golden file first
+        update = rewrite the golden file from this tree
+        skip   = do not run them""",
+        choices=("check", "update", "skip"),
+        default="check",
+    )
+    parser.add_argument(
+        "--tolerance",
+        help="""Largest relative difference of a golden curve value and of
+        a backend kernel result""",
+        type=float,
+        default=1E-9,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Results file, defaults to img/bench/bench_<time>.json",
+        type=pathlib.Path,
+        default=None,
+    )
+    parser.add_argument(
+        "-c",
+        "--compare",
+        help="Earlier results file to compare the epochs per second with",
+        type=pathlib.Path,
+        default=None,
+    )
+    parser.add_argument(
+        "-ll",
+        "--log_level",
+        help="""Set the logging level:
+        1 = DEBUG
+        2 = INFO
+        3 = WARNING
+        4 = ERROR
+        5 = CRITICAL""",
+        type=int,
+        choices=range(1, 6),
+        default=2,
+    )
+    return parser.parse_args(args=arg_list)
+
+
+def scenario_id(scenario: dict) -> str:
+    """Get the name of a scenario, unique within a grid"""
+    return (f"c{scenario['count']}_e{scenario['env_size']}_"
+            f"{scenario['thermal_model']}_{scenario['movement_policy']}"
+            f"{'_gif' if scenario['make_gif'] else ''}")
+
+
+def expand_grid(grid: dict) -> list[dict]:
+    """Expand a scenario grid into one dict per combination"""
+    return [
+        dict(zip(grid, values))
+        for values in itertools.product(*grid.values())
+    ]
+
+
+def fits(scenario: dict, body_radius: int) -> bool:
+    """Check whether the colony can cover at most half the environment"""
+    footprint = 2 * body_radius * (body_radius + 1) + 1
+    return scenario["count"] * footprint <= scenario["env_size"]**2 / 2
+
+
+def machine_info() -> dict:
+    """Describe the machine and the tree the benchmarks ran on"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=simulator.SRC_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+def run_scenario(scenario: dict,
+                 template: pathlib.Path,
+                 epochs: int,
+                 seed: int,
+                 log_level: int,
+                 overrides: dict = None,
+                 backend: str = "numpy",
+                 precision: str = "float64") -> dict:
+    """Simulate one scenario in a worker process
+
+    Parameters
+    ----------
+    scenario : dict
+        Values of the scenario parameters
+    template : pathlib.Path
+        Config providing every other option
+    epochs : int
+        Epochs to simulate
+    seed : int
+        Seed of the global random and NumPy generators
+    log_level : int
+        Minimum logging level
+    overrides : dict
+        Other options to replace, by section and option
+    backend : str
+        Compute backend, one of backend.BACKENDS
+    precision : str
+        Floating point type of the grid model fields, one of
+        Environment.PRECISIONS
+
+    Returns
+    -------
+    dict
+        Scenario, throughput, peak RSS, profile and curves of the run
+    """
+    config = simulator.parse_config(template)
+    config.read_dict(overrides or dict())
+    name = scenario_id(scenario)
+    config["general"]["name"] = name
+    config["general"]["make_gif"] = str(scenario["make_gif"])
+    config["general"]["replicates"] = "1"
+    config["general"]["profile"] = "True"
+    config["general"]["profile_log_interval"] = "0"
+    config["general"]["checkpoint_epochs"] = "0"
+    config["general"]["checkpoint_seconds"] = "0"
+    config["general"]["record"] = "False"
+    config["general"]["backend"] = backend
+    config["env"]["env_size"] = (f"{scenario['env_size']}, "
+                                 f"{scenario['env_size']}")
+    config["env"]["epochs"] = str(epochs)
+    config["env"]["thermal_model"] = scenario["thermal_model"]
+    config["env"]["precision"] = precision
+    config["penguin"]["count"] = str(scenario["count"])
+    config["penguin"]["movement_policy"] = scenario["movement_policy"]
+
+    image_dir = BENCH_DIR.joinpath(name)
+    shutil.rmtree(image_dir, ignore_errors=True)
+    image_dir.mkdir(mode=0o775, parents=True)
+    simulator.seed_rngs(seed)
+    start = time.perf_counter()
+    env = simulator.build_environment(config, image_dir, log_level)
+    setup_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    env.run()
+    wall_seconds = time.perf_counter() - start
+    summary = env.summary()
+    profile = env.profile_totals()
+    epochs_run = max(profile["epochs"], 1)
+    return {
+        "id": name,
+        **scenario,
+        "agents": summary["agents"],
+        "epochs": summary["epochs"],
+        "setup_seconds": setup_seconds,
+        "run_seconds": env.run_seconds,
+        "wall_seconds": wall_seconds,
+        "epochs_per_second": summary["epochs"] / env.run_seconds,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss /
+        1024,
+        "phase_ms_per_epoch": {
+            phase: seconds * 1E3 / epochs_run
+            for phase, seconds in profile["seconds"].items()
+        },
+        "counts_per_epoch": {
+            counter: count / epochs_run
+            for counter, count in profile["counts"].items()
+        },
+        "alive_portion": summary["alive_portion"],
+        "mean_temp": summary["mean_temp"],
+        "curves": env.curves(),
+    }
+
+
+def run_scenarios(scenarios: list[dict],
+                  template: pathlib.Path,
+                  epochs: int,
+                  seed: int,
+                  jobs: int,
+                  log_level: int,
+                  overrides: dict = None,
+                  backend: str = "numpy",
+                  precision: str = "float64") -> list[dict]:
+    """Run scenarios, each in a fresh worker process
+
+    See run_scenario for the parameters.
+
+    Returns
+    -------
+    list[dict]
+        Results of the scenarios that finished, in the scenario order
+    """
+    results = dict()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=1,
+    ) as pool:
+        futures = {
+            pool.submit(run_scenario, scenario, template, epochs, seed,
+                        log_level, overrides, backend,
+                        precision): scenario_id(scenario)
+            for scenario in scenarios
+        }
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+            except Exception as error:
+                LOG.error(f"Scenario {name} failed: {error!r}")
+                continue
+            result = results[name]
+            LOG.info(f"{name}: {result['agents']} agents, "
+                     f"{result['epochs_per_second']:.2f} epochs/s, "
+                     f"{result['peak_rss_mb']:.0f} MB peak RSS")
+    return [
+        results[scenario_id(scenario)] for scenario in scenarios
+        if scenario_id(scenario) in results
+    ]
+
+
+def compare_curves(reference: dict, curves: dict, tolerance: float) -> str:
+    """Describe the first difference between two sets of curves
+
+    Returns
+    -------
+    str
+        Description of the difference, None if the curves match.
+    """
+    if reference["epochs"] != curves["epochs"]:
+        return (f"ran {len(curves['epochs'])} epochs instead of "
+                f"{len(reference['epochs'])}")
+    for series in ("alive_portion", "mean_temp"):
+        for epoch, expected, actual in zip(reference["epochs"],
+                                           reference[series],
+                                           curves[series]):
+            if not math.isclose(expected, actual, rel_tol=tolerance,
+                                abs_tol=0.0):
+                return (f"{series} at epoch {epoch} is {actual!r} instead "
+                        f"of {expected!r}")
+    return None
+
+
+def check_golden(results: list[dict], tolerance: float) -> bool:
+    """Compare the curves of the golden scenarios with GOLDEN_FILE
+
+    Returns
+    -------
+    bool
+        Whether every golden scenario matches
+    """
+    with open(GOLDEN_FILE) as golden_file:
+        golden = json.load(golden_file)
+    if (golden["epochs"] != GOLDEN_EPOCHS or golden["seed"] != GOLDEN_SEED
+            or golden["overrides"] != GOLDEN_OVERRIDES
+            or len(results) != len(GOLDEN_SCENARIOS)):
+        LOG.error("The golden file was made for other golden scenarios, "
+                  "rerun with --golden update")
+        return False
+    matched = True
+    for result in results:
+        reference = golden["curves"].get(result["id"])
+        if reference is None:
+            LOG.error(f"Golden scenario {result['id']} is not in "
+                      f"{GOLDEN_FILE}")
+            matched = False
+            continue
+        difference = compare_curves(reference, result["curves"], tolerance)
+        if difference is not None:
+            LOG.error(f"Golden scenario {result['id']} changed: "
+                      f"{difference}")
+            matched = False
+    return matched
+
+
+def check_backend(name: str, tolerance: float) -> bool:
+    """Compare the kernels of a backend with the NumPy kernels
+
+    Returns
+    -------
+    bool
+        Whether every kernel matches
+    """
+    backend = backends.load_backend(name)
+    if backend.name != name:
+        LOG.error(f"The {name} backend is not installed")
+        return False
+    errors = backends.equivalence_errors(backend, tolerance)
+    for error in errors:
+        LOG.error(f"Backend {name}: {error}")
+    return not errors
+
+
+def save_golden(results: list[dict]) -> None:
+    """Write the curves of the golden scenarios to GOLDEN_FILE"""
+    GOLDEN_FILE.parent.mkdir(mode=0o775, exist_ok=True)
+    with open(GOLDEN_FILE, "w") as golden_file:
+        json.dump(
+            {
+                "epochs": GOLDEN_EPOCHS,
+                "seed": GOLDEN_SEED,
+                "overrides": GOLDEN_OVERRIDES,
+                "curves": {
+                    result["id"]: result["curves"]
+                    for result in results
+                },
+            },
+            golden_file,
+            indent=1)
+    LOG.info(f"Golden curves saved in:\n{GOLDEN_FILE}")
+
+
+def log_comparison(previous_path: pathlib.Path, results: list[dict]) -> None:
+    """Log the speedup of every scenario over an earlier results file"""
+    with open(previous_path) as previous_file:
+        previous = json.load(previous_file)
+    rates = {
+        result["id"]: result["epochs_per_second"]
+        for result in previous["results"]
+    }
+    for result in results:
+        if result["id"] not in rates:
+            continue
+        LOG.info(f"{result['id']}: {rates[result['id']]:.2f} -> "
+                 f"{result['epochs_per_second']:.2f} epochs/s, "
+                 f"{result['epochs_per_second'] / rates[result['id']]:.2f}x")
+
+
+###############################################################################
+# Main function
+###############################################################################
+
+
+def main(suite: str, counts: list[int], env_sizes: list[int],
+         thermal_models: list[str], policies: list[str], gif: str,
+         backend: str, precision: str, epochs: int, template: pathlib.Path,
+         seed: int, jobs: int, golden: str, tolerance: float,
+         output: pathlib.Path, compare: pathlib.Path, log_level: int) -> int:
+    """Main function
+
+    Parameters
+    ----------
+    TODO
+    """
+    coloredlogs.install(
+        level=log_level * 10,
+        logger=LOG,
+        milliseconds=True,
+    )
+    template = template.resolve()
+    config = simulator.parse_config(template)
+    if config is None:
+        LOG.error("Could not read config file")
+        return 1
+    if not simulator.validate_config(config):
+        return 1
+
+    grid = dict(SUITES[suite])
+    for axis, values in (("count", counts), ("env_size", env_sizes),
+                         ("thermal_model", thermal_models),
+                         ("movement_policy", policies)):
+        if values:
+            grid[axis] = tuple(values)
+    if gif is not None:
+        grid["make_gif"] = {
+            "off": (False, ),
+            "on": (True, ),
+            "both": (False, True)
+        }[gif]
+    body_radius = int(config["penguin"]["body_radius"])
+    scenarios = list()
+    for scenario in expand_grid(grid):
+        if fits(scenario, body_radius):
+            scenarios.append(scenario)
+        else:
+            LOG.warning(f"Skipping {scenario_id(scenario)}, the colony "
+                        "does not fit in the environment")
+
+    if backend != "numpy":
+        if not check_backend(backend, tolerance):
+            return 1
+        LOG.info(f"The {backend} kernels match the numpy kernels")
+        if golden == "update":
+            LOG.error("Golden curves are only updated with the numpy backend")
+            return 1
+    golden_tolerance = tolerance
+    if precision != "float64":
+        if golden == "update":
+            LOG.error("Golden curves are only updated in float64")
+            return 1
+        golden_tolerance = max(tolerance, PRECISION_TOLERANCE)
+
+    golden_ok = True
+    if golden != "skip":
+        LOG.info(f"Running {len(GOLDEN_SCENARIOS)} golden scenarios")
+        golden_results = run_scenarios(list(GOLDEN_SCENARIOS), template,
+                                       GOLDEN_EPOCHS, GOLDEN_SEED, jobs,
+                                       log_level, GOLDEN_OVERRIDES, backend,
+                                       precision)
+        if golden == "update":
+            save_golden(golden_results)
+        else:
+            golden_ok = check_golden(golden_results, golden_tolerance)
+            if golden_ok:
+                LOG.info("Golden curves match")
+
+    LOG.info(f"Running {len(scenarios)} scenarios of {epochs} epochs on "
+             f"{jobs} workers")
+    results = run_scenarios(scenarios, template, epochs, seed, jobs,
+                            log_level, backend=backend, precision=precision)
+    if output is None:
+        BENCH_DIR.mkdir(mode=0o775, parents=True, exist_ok=True)
+        output = BENCH_DIR.joinpath(
+            f"bench_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, "w") as output_file:
+        json.dump(
+            {
+                "machine": machine_info(),
+                "suite": suite,
+                "epochs": epochs,
+                "seed": seed,
+                "template": str(template),
+                "backend": backend,
+                "precision": precision,
+                "golden": golden if golden_ok else "failed",
+                "results": results,
+            },
+            output_file,
+            indent=4)
+    LOG.info(f"Benchmark results saved in:\n{output}")
+    if compare is not None:
+        log_comparison(compare, results)
+    logging.shutdown()
+    if not golden_ok or len(results) < len(scenarios):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    args = parse_args()
+    sys.exit(main(**vars(args)))
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""This module contains atomic binary checkpoints of a simulation.
+
+A checkpoint is a single uncompressed ``.npz`` archive of named arrays. It
+is written to a temporary file next to its destination, flushed to disk and
+renamed over the previous checkpoint, so a crash while writing always leaves
+the last complete checkpoint in place.
+"""
+# Standard library
+from __future__ import annotations
+import os
+import pathlib
+import random
+import time
+# Packages
+import numpy as np
+
+
+def random_state() -> dict[str, np.ndarray]:
+    """Capture the state of the global random and NumPy generators.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        Arrays accepted by set_random_state.
+    """
+    version, words, gauss_next = random.getstate()
+    _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {
+        "random_version": np.array(version),
+        "random_words": np.array(words, dtype=np.uint64),
+        "random_gauss": np.array(np.nan if gauss_next is None else
+                                 gauss_next),
+        "np_random_keys": keys,
+        "np_random_pos": np.array(pos),
+        "np_random_has_gauss": np.array(has_gauss),
+        "np_random_gauss": np.array(cached_gaussian),
+    }
+
+
+def set_random_state(arrays: dict[str, np.ndarray]) -> None:
+    """Restore the global generators captured by random_state."""
+    gauss_next = float(arrays["random_gauss"])
+    random.setstate((
+        int(arrays["random_version"]),
+        tuple(int(word) for word in arrays["random_words"]),
+        None if np.isnan(gauss_next) else gauss_next,
+    ))
+    np.random.set_state((
+        "MT19937",
+        arrays["np_random_keys"],
+        int(arrays["np_random_pos"]),
+        int(arrays["np_random_has_gauss"]),
+        float(arrays["np_random_gauss"]),
+    ))
+
+
+def write_atomic(path: pathlib.Path, arrays: dict[str, np.ndarray]) -> int:
+    """Write arrays to an archive that replaces path in one rename.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        Destination of the archive.
+    arrays : dict[str, np.ndarray]
+        Arrays to store by name.
+
+    Returns
+    -------
+    int
+        Size of the archive in bytes.
+    """
+    temp_path = path.with_name(f".{path.name}.tmp")
+    with open(temp_path, "wb") as archive:
+        np.savez(archive, **arrays)
+        archive.flush()
+        os.fsync(archive.fileno())
+        size = archive.tell()
+    os.replace(temp_path, path)
+    return size
+
+
+def read(path: pathlib.Path) -> dict[str, np.ndarray]:
+    """Read every array of an archive written by write_atomic."""
+    with np.load(path, allow_pickle=False) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+class Checkpointer:
+    """Decide when to checkpoint and account for the time it takes.
+
+    A checkpoint is due every ``every_epochs`` epochs or once
+    ``every_seconds`` have passed since the last one, whichever comes first.
+    Both at 0 disable checkpoints.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        Destination of the checkpoint.
+    every_epochs : int
+        Epochs between checkpoints, 0 for no epoch interval.
+    every_seconds : float
+        Wall time between checkpoints in s, 0 for no time interval.
+    """
+    def __init__(self, path: pathlib.Path, every_epochs: int = 0,
+                 every_seconds: float = 0.0):
+        self._path = path
+        self._every_epochs = every_epochs
+        self._every_seconds = every_seconds
+        self._last_time = time.perf_counter()
+        self._count = 0
+        self._seconds = 0.0
+        self._size = 0
+
+    @property
+    def path(self) -> pathlib.Path:
+        """pathlib.Path: Destination of the checkpoint"""
+        return self._path
+
+    @property
+    def enabled(self) -> bool:
+        """bool: Whether any interval is set"""
+        return self._every_epochs > 0 or self._every_seconds > 0
+
+    def due(self, epoch: int) -> bool:
+        """Check whether a checkpoint is due after an epoch."""
+        if self._every_epochs > 0 and epoch % self._every_epochs == 0:
+            return True
+        return (self._every_seconds > 0 and time.perf_counter() -
+                self._last_time >= self._every_seconds)
+
+    @property
+    def count(self) -> int:
+        """int: Number of checkpoints written"""
+        return self._count
+
+    @property
+    def seconds(self) -> float:
+        """float: Total wall time spent writing checkpoints in s"""
+        return self._seconds
+
+    @property
+    def size(self) -> int:
+        """int: Size of the last checkpoint in bytes"""
+        return self._size
+
+    def save(self, arrays: dict[str, np.ndarray]) -> float:
+        """Write a checkpoint.
+
+        Parameters
+        ----------
+        arrays : dict[str, np.ndarray]
+            Arrays to store by name.
+
+        Returns
+        -------
+        float
+            Wall time of the write in s.
+        """
+        start = time.perf_counter()
+        size = write_atomic(self._path, arrays)
+        self._last_time = time.perf_counter()
+        seconds = self._last_time - start
+        self._count += 1
+        self._seconds += seconds
+        self._size = size
+        return seconds
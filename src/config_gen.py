@@ -45,6 +45,12 @@ CONFIG_SECTIONS = {
     ],
 }
 
+# Parameter grid swept by the generated configs
+BODY_RADII = [1, 3, 5]
+SENSE_RADII = [10, 25, 50, 100]
+COUNTS = [32]
+MOVEMENT_SPEEDS = [2, 5, 10]
+
 ###############################################################################
 # Function definitions
 ###############################################################################
@@ -108,6 +114,38 @@ def parse_config(config_file: str) -> configparser.ConfigParser:
     return config
 
 
+def generate_configs(template: pathlib.Path = TEMPLATE_CFG):
+    """Expand the parameter grid into configs
+
+    Parameters
+    ----------
+    template : pathlib.Path
+        Config providing every option that is not swept
+
+    Yields
+    ------
+    tuple[str, configparser.ConfigParser]
+        File stem and config of each combination of the grid
+    """
+    for br in BODY_RADII:
+        for sr in SENSE_RADII:
+            for c in COUNTS:
+                for ms in MOVEMENT_SPEEDS:
+                    config = parse_config(template)
+                    if config is None:
+                        LOG.error("Could not read config file")
+                        return
+
+                    # Overwrite testing configs
+                    config["general"]["name"] = (
+                        f"BR={br}, SR={sr}, C={c}, MS={ms}")
+                    config["penguin"]["count"] = str(c)
+                    config["penguin"]["body_radius"] = str(br)
+                    config["penguin"]["sense_radius"] = str(sr)
+                    config["penguin"]["movement_speed"] = str(ms)
+                    yield f"auto_br{br}_sr{sr}_c{c}_ms{ms}", config
+
+
 ###############################################################################
 # Main function
 ###############################################################################
@@ -126,33 +164,9 @@ def main(log_level: int) -> int:
         milliseconds=True,
     )
 
-    body_radii = [1, 3, 5]
-    sense_radii = [10, 25, 50, 100]
-    counts = [32]
-    movement_speeds = [2, 5, 10]
-
-    for br in body_radii:
-        for sr in sense_radii:
-            for c in counts:
-                for ms in movement_speeds:
-                    cfg_f_name = f"auto_br{br}_sr{sr}_c{c}_ms{ms}.ini"
-                    cfg_path = CFG_DIR.joinpath(cfg_f_name)
-                    cfg_name = f"BR={br}, SR={sr}, C={c}, MS={ms}"
-
-                    # Parse config file
-                    config = parse_config(TEMPLATE_CFG)
-                    if config is None:
-                        LOG.error("Could not read config file")
-                        break
-
-                    # Overwrite testing configs
-                    config["general"]["name"] = cfg_name
-                    config["penguin"]["count"] = str(c)
-                    config["penguin"]["body_radius"] = str(br)
-                    config["penguin"]["sense_radius"] = str(sr)
-                    config["penguin"]["movement_speed"] = str(ms)
-                    with open(cfg_path, "w") as cfg_file:
-                        config.write(cfg_file)
+    for stem, config in generate_configs():
+        with open(CFG_DIR.joinpath(f"{stem}.ini"), "w") as cfg_file:
+            config.write(cfg_file)
 
     LOG.info("Done.")
     logging.shutdown()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""This module contains the steady-state monitor of a run.
+
+Once a colony settles into a stable huddle its statistics stop changing,
+and the remaining epochs add nothing to the plots. The monitor keeps the
+last ``window`` epochs of the alive count, the mean and standard deviation
+of the core temperatures and the centroid of the huddle, and declares a
+steady state once all of them are flat over the window.
+"""
+# Standard library
+from __future__ import annotations
+import collections
+# Packages
+import numpy as np
+
+# Actions taken at a steady state
+ACTIONS = ("stop", "fast_forward")
+
+
+class ConvergenceMonitor:
+    """Detect a steady state over a sliding window of epochs.
+
+    The window is flat when no agent died in it, the mean and standard
+    deviation of the core temperatures each vary by at most
+    ``temp_tolerance`` and the huddle centroid moved by at most
+    ``displacement_tolerance`` cells in Manhattan distance.
+
+    Parameters
+    ----------
+    window : int
+        Number of epochs that must be flat.
+    temp_tolerance : float
+        Largest range of the mean and standard deviation of the core
+        temperatures over the window in degrees C.
+    displacement_tolerance : float
+        Largest range of the huddle centroid over the window in cells.
+    """
+    def __init__(self, window: int, temp_tolerance: float,
+                 displacement_tolerance: float):
+        self._window = window
+        self._temp_tolerance = temp_tolerance
+        self._displacement_tolerance = displacement_tolerance
+        self._values = collections.deque(maxlen=window)
+
+    @property
+    def window(self) -> int:
+        """int: Number of epochs that must be flat"""
+        return self._window
+
+    def update(self, alive: int, mean_temp: float, std_temp: float,
+               centroid: np.ndarray) -> bool:
+        """Add the statistics of an epoch.
+
+        Parameters
+        ----------
+        alive : int
+            Number of alive agents.
+        mean_temp, std_temp : float
+            Mean and standard deviation of the alive core temperatures.
+        centroid : np.ndarray[float]
+            Mean position of the alive agents (row, col).
+
+        Returns
+        -------
+        bool
+            Whether the last window epochs are flat.
+        """
+        self._values.append((alive, mean_temp, std_temp, *centroid))
+        if len(self._values) < self._window:
+            return False
+        values = np.array(self._values)
+        spread = values.max(axis=0) - values.min(axis=0)
+        return bool(spread[0] == 0
+                    and spread[1] <= self._temp_tolerance
+                    and spread[2] <= self._temp_tolerance
+                    and spread[3] + spread[4] <= self._displacement_tolerance)
+
+    def reset(self) -> None:
+        """Forget the window, after the run changed state abruptly."""
+        self._values.clear()
+
+    def snapshot(self) -> np.ndarray:
+        """Copy the window for a checkpoint, in the form (epochs, 5)."""
+        return np.array(self._values, dtype=float).reshape(-1, 5)
+
+    def restore(self, values: np.ndarray) -> None:
+        """Replace the window with a snapshot."""
+        self._values.clear()
+        for alive, *rest in values:
+            self._values.append((int(alive), *rest))
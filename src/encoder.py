@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""This module contains the streaming GIF encoding pipeline.
+
+The simulation hands rasterized canvases to a bounded queue. A worker
+thread composes and encodes them into the output GIF one frame at a time,
+so encoding overlaps the simulation and memory does not grow with the
+number of epochs.
+"""
+# Standard library
+from __future__ import annotations
+import logging
+import pathlib
+import queue
+import threading
+# Packages
+import numpy as np
+from PIL import GifImagePlugin, Image
+# Custom
+from renderer import Renderer
+
+LOG = logging.getLogger("penguin_swarm.encoder")
+
+
+class GifWriter:
+    """Append palette frames to a GIF file as they arrive.
+
+    Every frame must use the same palette, which Renderer guarantees.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        Output GIF path.
+    duration : int
+        Display time of each frame in ms.
+    """
+    def __init__(self, path: pathlib.Path, duration: int = 100):
+        self._path = path
+        self._duration = duration
+        self._file = None
+        self._frames = 0
+
+    @property
+    def frames(self) -> int:
+        """int: Number of frames written so far"""
+        return self._frames
+
+    def write(self, frame: Image.Image) -> None:
+        """Encode one frame at the end of the file."""
+        if self._file is None:
+            self._file = open(self._path, "wb")
+            header, _ = GifImagePlugin.getheader(frame,
+                                                 info={
+                                                     "loop": 0,
+                                                     "optimize": False
+                                                 })
+            for chunk in header:
+                self._file.write(chunk)
+        for chunk in GifImagePlugin.getdata(frame, duration=self._duration):
+            self._file.write(chunk)
+        self._frames += 1
+
+    def close(self) -> None:
+        """Write the GIF trailer and close the file."""
+        if self._file is None:
+            return
+        self._file.write(b";")
+        self._file.close()
+        self._file = None
+
+
+class FramePipeline:
+    """Encode frames on a background thread through a bounded queue.
+
+    Parameters
+    ----------
+    renderer : Renderer
+        Renderer used to compose the frames on the worker.
+    path : pathlib.Path
+        Output GIF path.
+    queue_size : int
+        Maximum number of canvases waiting to be encoded. ``submit`` blocks
+        when the queue is full, which keeps the simulation from outrunning
+        the encoder.
+    duration : int
+        Display time of each frame in ms.
+    """
+    def __init__(self,
+                 renderer: Renderer,
+                 path: pathlib.Path,
+                 queue_size: int = 8,
+                 duration: int = 100):
+        self._renderer = renderer
+        self._writer = GifWriter(path, duration)
+        self._queue = queue.Queue(maxsize=max(int(queue_size), 1))
+        self._error = None
+        self._thread = threading.Thread(target=self._work,
+                                        name="gif-encoder",
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def frames(self) -> int:
+        """int: Number of frames encoded so far"""
+        return self._writer.frames
+
+    def submit(self, canvas: np.ndarray, title: str) -> None:
+        """Queue a canvas for encoding.
+
+        Parameters
+        ----------
+        canvas : np.ndarray[np.uint8]
+            Environment pixels, copied before queueing.
+        title : str
+            Title of the frame.
+        """
+        self._raise_error()
+        self._queue.put((canvas.copy(), title))
+
+    def close(self) -> None:
+        """Encode the queued frames, finish the GIF and stop the worker."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._writer.close()
+        self._raise_error()
+
+    def _raise_error(self) -> None:
+        """Re-raise an exception from the worker in the caller."""
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("GIF encoding failed") from error
+
+    def _work(self) -> None:
+        """Worker loop, encodes until it receives None."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                # Keep draining so the producer never blocks
+                continue
+            try:
+                self._writer.write(self._renderer.compose(*item))
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.error(f"GIF encoding failed: {error}")
+                self._error = error
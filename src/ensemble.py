@@ -0,0 +1,569 @@
+# -*- coding: utf-8 -*-
+"""This module contains the batched replicate ensemble.
+
+An Ensemble runs R replicates of one config with different random
+placements as a single simulation. Positions, temperatures and the
+occupancy grid carry a leading replicate dimension, so every step of the
+update advances all replicates in one set of array operations and the
+Python overhead is paid once per ensemble instead of once per replicate.
+
+Only the lumped thermal model with the exact pairwise kernel is batched.
+"""
+# Standard library
+from __future__ import annotations
+import csv
+import functools
+import logging
+import pathlib
+import re
+import statistics
+# Packages
+import coloredlogs
+import matplotlib.pyplot as plt
+import numpy as np
+# Custom
+from backend import load_backend
+from spatial import footprint_cells, OccupancyGrid
+from swarm_state import FIELDS
+import policy
+import thermal
+
+LOG = logging.getLogger("penguin_swarm.ensemble")
+
+
+def _field(name: str) -> property:
+    """Build a read-only property exposing a (R, N) field."""
+    def getter(self) -> np.ndarray:
+        return self._data[name]
+
+    return property(getter, doc=f"np.ndarray: Per-agent {name}.")
+
+
+class EnsembleState:
+    """Struct-of-arrays storage for R replicates of N agents.
+
+    The attributes mirror those of SwarmState with a leading replicate
+    dimension, so thermal.simple_thermal_step advances every replicate at
+    once. Replicates that could not place all N agents keep the missing
+    slots absent: they are not alive, never move and are perfectly
+    insulated so they exchange no heat.
+
+    Parameters
+    ----------
+    replicates : int
+        Number of replicates R.
+    count : int
+        Number of agent slots N in each replicate.
+    """
+    def __init__(self, replicates: int, count: int):
+        shape = (replicates, count)
+        self._positions = np.zeros(shape=shape + (2, ), dtype=int)
+        self._core_temp = np.zeros(shape=shape, dtype=float)
+        self._present = np.zeros(shape=shape, dtype=bool)
+        self._data = {
+            name: np.zeros(shape=shape, dtype=dtype)
+            for name, dtype in FIELDS.items()
+        }
+
+    body_radius = _field("body_radius")
+    sense_radius = _field("sense_radius")
+    low_death_threshold = _field("low_death_threshold")
+    high_death_threshold = _field("high_death_threshold")
+    low_move_threshold = _field("low_move_threshold")
+    high_move_threshold = _field("high_move_threshold")
+    internal_conductivity = _field("internal_conductivity")
+    external_conductivity = _field("external_conductivity")
+    insulation_thickness = _field("insulation_thickness")
+    density = _field("density")
+    movement_policy = _field("movement_policy")
+    movement_speed = _field("movement_speed")
+    metabolism = _field("metabolism")
+    alive = _field("alive")
+
+    @property
+    def shape(self) -> tuple[int]:
+        """tuple[int]: Number of replicates and agent slots (R, N)"""
+        return self._core_temp.shape
+
+    @property
+    def positions(self) -> np.ndarray:
+        """np.ndarray[int]: Agent centres in the form (R, N, 2)"""
+        return self._positions
+
+    @property
+    def rows(self) -> np.ndarray:
+        """np.ndarray[int]: Row of each agent centre"""
+        return self._positions[..., 0]
+
+    @property
+    def cols(self) -> np.ndarray:
+        """np.ndarray[int]: Column of each agent centre"""
+        return self._positions[..., 1]
+
+    @property
+    def core_temp(self) -> np.ndarray:
+        """np.ndarray[float]: Core temperature of each agent (writable)"""
+        return self._core_temp
+
+    @property
+    def present(self) -> np.ndarray:
+        """np.ndarray[bool]: Whether each agent slot was placed"""
+        return self._present
+
+    def place(self, replicates: np.ndarray, slots: np.ndarray,
+              positions: np.ndarray, body_temp: float, **fields) -> None:
+        """Place one agent in each of several replicates.
+
+        Parameters
+        ----------
+        replicates, slots : np.ndarray[int]
+            Replicate and agent slot of each placed agent.
+        positions : np.ndarray[int]
+            Centres in the form (B, 2).
+        body_temp : float
+            Initial core temperature.
+        **fields
+            One value for each entry of ``FIELDS`` except ``alive``.
+        """
+        self._positions[replicates, slots] = positions
+        self._core_temp[replicates, slots] = body_temp
+        self._present[replicates, slots] = True
+        for name in FIELDS:
+            self._data[name][replicates, slots] = fields.get(name, True)
+
+    def seal(self) -> None:
+        """Insulate and kill the agent slots that were never placed."""
+        absent = ~self._present
+        self._data["insulation_thickness"][absent] = np.inf
+        self._data["alive"][absent] = False
+
+    def kill_out_of_range(self) -> np.ndarray:
+        """Kill every agent whose core temperature left its safe range.
+
+        Returns
+        -------
+        np.ndarray[bool]
+            Mask of the agents that died in this call.
+        """
+        core = self._core_temp
+        dying = ((core > self.high_death_threshold)
+                 | (core < self.low_death_threshold)) & self.alive
+        self.alive[dying] = False
+        return dying
+
+
+class Ensemble:
+    """Advance R replicates of one config together.
+
+    Every replicate follows the rules of Environment with the lumped
+    thermal model, and all agents share the parameters of the config. With
+    the sequential movement update, step k of an epoch moves the k-th agent
+    of the shuffled order of every replicate in one batch.
+
+    Parameters
+    ----------
+    log_level : int
+        Minimum logging level.
+    name : str
+        Name of the config.
+    image_dir : pathlib.Path
+        Directory for the outputs.
+    env_size : tuple[int]
+        Size of the environment (rows, cols).
+    grid_size, time_step_size : float
+        Size of each cell in m and time step in s.
+    epochs : int
+        Maximum number of epochs.
+    air_conductivity, ambient_temp : float
+        Thermal conductivity and temperature of the air.
+    replicates : int
+        Number of replicates R.
+    confidence : float
+        Confidence level of the bands around the replicate mean.
+    pair_chunk_size : int
+        Receiving agents per block of the pairwise heat exchange.
+    movement_update : str
+        Movement update, sequential or synchronous.
+    backend : str
+        Compute backend of the pairwise heat and the move steps, see
+        backend.BACKENDS.
+    """
+    def __init__(
+        self,
+        log_level: int,
+        name: str,
+        image_dir: pathlib.Path,
+        env_size: tuple[int],
+        grid_size: float,
+        time_step_size: float,
+        epochs: int,
+        air_conductivity: float,
+        ambient_temp: float,
+        replicates: int,
+        confidence: float = 0.95,
+        pair_chunk_size: int = 0,
+        movement_update: str = "sequential",
+        backend: str = "numpy",
+    ):
+        coloredlogs.install(
+            level=log_level * 10,
+            logger=LOG,
+            milliseconds=True,
+        )
+        self._name = name
+        # Same file name rules as Environment
+        self._file_name = re.sub(" ", "_", self._name.lower())
+        self._file_name = re.sub("[^a-z0-9_-]", "", self._file_name)
+        self._image_dir = image_dir
+        self._env_size = env_size
+        self._grid_size = grid_size
+        self._time_step_size = time_step_size
+        self._epochs = epochs
+        self._air_conductivity = air_conductivity
+        self._ambient_air_temp = ambient_temp
+        self._replicates = replicates
+        self._confidence = confidence
+        self._movement_update = movement_update
+        self._state = EnsembleState(replicates, 0)
+        self._body_radius = 1
+        self._backend = load_backend(backend)
+        self._pair_kernel = functools.partial(self._backend.pair_heat_flow,
+                                              chunk_size=pair_chunk_size)
+        self._occupancy = np.full(shape=(replicates, ) + tuple(env_size),
+                                  fill_value=OccupancyGrid.EMPTY, dtype=int)
+        self._epoch = 0
+        self._epochs_plot = list()
+        # Per replicate curves, one (R, ) entry per recorded epoch
+        self._alive_plot = list()
+        self._temps_plot = list()
+        # Agents at the start of the run and last mean core temperature of
+        # each replicate, set by run
+        self._total_agents = np.ones(shape=replicates, dtype=int)
+        self._last_temps = np.full(shape=replicates, fill_value=np.nan)
+        # Shuffled update order of each replicate, drawn every epoch
+        self._order = np.zeros(shape=(replicates, 0), dtype=int)
+        LOG.debug(f"Initialized Ensemble: {self._name} x {replicates}")
+
+    @property
+    def state(self) -> EnsembleState:
+        """EnsembleState: Batched agent storage"""
+        return self._state
+
+    def populate(self, count: int, body_temp: float, attempts: int,
+                 **fields) -> np.ndarray:
+        """Place up to count agents at random in every replicate.
+
+        Like main.build_environment, each attempt draws one random centre
+        per replicate and keeps it if the body fits.
+
+        Parameters
+        ----------
+        count : int
+            Agents per replicate.
+        body_temp : float
+            Initial core temperature.
+        attempts : int
+            Maximum number of placement attempts per replicate.
+        **fields
+            One value for each entry of ``FIELDS`` except ``alive``.
+
+        Returns
+        -------
+        np.ndarray[int]
+            Number of agents placed in each replicate.
+        """
+        self._state = EnsembleState(self._replicates, count)
+        self._occupancy[...] = OccupancyGrid.EMPTY
+        radius = self._body_radius = int(fields["body_radius"])
+        placed = np.zeros(shape=self._replicates, dtype=int)
+        for _ in range(attempts):
+            replicates = np.flatnonzero(placed < count)
+            if len(replicates) == 0:
+                break
+            positions = np.stack((
+                np.random.randint(self._env_size[0], size=len(replicates)),
+                np.random.randint(self._env_size[1], size=len(replicates)),
+            ), axis=1)
+            fits = self._fits(replicates, positions, radius,
+                              np.full(len(replicates), OccupancyGrid.EMPTY))
+            replicates, positions = replicates[fits], positions[fits]
+            slots = placed[replicates]
+            self._state.place(replicates, slots, positions, body_temp,
+                              **fields)
+            self._stamp(replicates, slots, positions, radius)
+            placed[replicates] += 1
+        self._state.seal()
+        LOG.info(f"Added {placed.min()} to {placed.max()} agents per "
+                 "replicate.")
+        return placed
+
+    def _cells(self, positions: np.ndarray, radius: int) -> tuple[np.ndarray]:
+        """Get the (B, K) footprint cells of a batch of centres."""
+        return footprint_cells(positions[:, 0], positions[:, 1], radius)
+
+    def _stamp(self, replicates: np.ndarray, slots: np.ndarray,
+               positions: np.ndarray, radius: int) -> None:
+        """Stamp agents into the occupancy grid of their replicates."""
+        rows, cols = self._cells(positions, radius)
+        self._occupancy[replicates[:, None], rows, cols] = slots[:, None]
+
+    def _fits(self, replicates: np.ndarray, positions: np.ndarray,
+              radius: int, ignore: np.ndarray) -> np.ndarray:
+        """Check whether bodies fit at a batch of positions.
+
+        Parameters
+        ----------
+        replicates : np.ndarray[int]
+            Replicate of each candidate.
+        positions : np.ndarray[int]
+            Candidate centres in the form (B, 2).
+        radius : int
+            Body radius of every candidate.
+        ignore : np.ndarray[int]
+            Agent slot allowed to overlap each candidate.
+
+        Returns
+        -------
+        np.ndarray[bool]
+            Whether each candidate is inside the environment and free.
+        """
+        rows, cols = positions[:, 0], positions[:, 1]
+        inside = ((rows >= radius - 1)
+                  & (rows <= self._env_size[0] - radius)
+                  & (cols >= radius - 1)
+                  & (cols <= self._env_size[1] - radius))
+        fits = np.zeros(shape=len(positions), dtype=bool)
+        candidates = np.flatnonzero(inside)
+        rows, cols = self._cells(positions[candidates], radius)
+        cells = self._occupancy[replicates[candidates, None], rows, cols]
+        fits[candidates] = np.all((cells == OccupancyGrid.EMPTY)
+                                  | (cells == ignore[candidates, None]),
+                                  axis=1)
+        return fits
+
+    def run(self) -> None:
+        """Run for a set number of epochs or until every replicate died"""
+        state = self._state
+        self._total_agents = np.maximum(state.alive.sum(axis=1), 1)
+        self._last_temps = np.full(shape=self._replicates,
+                                   fill_value=np.nan)
+        self.record()
+        for epoch in range(self._epochs):
+            LOG.info(f"Begin epoch {epoch + 1}/{self._epochs}: "
+                     f"{state.alive.sum()}/{state.present.sum()} agents "
+                     f"alive in {self._replicates} replicates")
+            self.run_epoch()
+            self.update_simple_thermal()
+            self.record()
+            if not state.alive.any():
+                LOG.info("Simulation early stop due to 0 agent alive")
+                break
+        self.save_bands()
+        self.plot_vs_epoch()
+
+    def record(self) -> None:
+        """Append the alive portion and mean core temperature of each
+        replicate to the curves.
+
+        A replicate without survivors keeps its last mean temperature, like
+        Environment does on its final epoch.
+        """
+        state = self._state
+        alive = state.alive.sum(axis=1)
+        total = np.where(alive > 0, alive, 1)
+        temps = np.where(state.alive, state.core_temp, 0.0).sum(axis=1)
+        self._last_temps = np.where(alive > 0, temps / total,
+                                    self._last_temps)
+        self._epochs_plot.append(self._epoch)
+        self._alive_plot.append(alive / self._total_agents)
+        self._temps_plot.append(self._last_temps.copy())
+
+    def run_epoch(self) -> None:
+        """Run one epoch in every replicate
+
+        Each replicate draws its own shuffled order, see
+        Environment.run_epoch for the movement updates.
+        """
+        self._epoch += 1
+        state = self._state
+        replicates, count = state.shape
+        self._order = np.argsort(np.random.random_sample((replicates,
+                                                          count)),
+                                 axis=1)
+        batch = np.arange(replicates)
+        if self._movement_update == "synchronous":
+            proposals = self._propose_moves(
+                np.repeat(batch, count),
+                self._order.ravel()).reshape(replicates, count, 2)
+            for step in range(count):
+                self._commit_moves(batch, self._order[:, step],
+                                   proposals[:, step])
+        else:
+            for step in range(count):
+                index = self._order[:, step]
+                self._commit_moves(batch, index,
+                                   self._propose_moves(batch, index))
+
+    def _propose_moves(self, replicates: np.ndarray,
+                       indices: np.ndarray) -> np.ndarray:
+        """Propose the next position of a batch of agents.
+
+        Parameters
+        ----------
+        replicates, indices : np.ndarray[int]
+            Replicate and agent slot of each agent of the batch.
+
+        Returns
+        -------
+        np.ndarray[int]
+            Proposed positions in the form (B, 2).
+        """
+        state = self._state
+        positions = state.positions[replicates, indices]
+        others = state.positions[replicates]
+        dist = np.abs(others - positions[:, None]).sum(axis=2)
+        # Sense like Environment.neighbor_indices, in shuffled order
+        sensed = ((dist < state.sense_radius[replicates])
+                  & state.alive[replicates])
+        sensed[np.arange(len(indices)), indices] = False
+        order = self._order[replicates]
+        segment, rank = np.nonzero(
+            np.take_along_axis(sensed, order, axis=1))
+        found = order[segment, rank]
+        return policy.propose_moves(
+            positions,
+            state.core_temp[replicates, indices],
+            state.low_move_threshold[replicates, indices],
+            state.high_move_threshold[replicates, indices],
+            state.movement_speed[replicates, indices],
+            state.movement_policy[replicates, indices],
+            others[segment, found] - positions[segment],
+            segment,
+            policy.draw_jitter(len(indices)),
+            self._backend.greedy_step,
+        )
+
+    def _commit_moves(self, replicates: np.ndarray, indices: np.ndarray,
+                      moves: np.ndarray) -> None:
+        """Move agents whose new position is valid.
+
+        Each replicate may appear at most once in the batch.
+        """
+        state = self._state
+        present = state.present[replicates, indices]
+        replicates, indices = replicates[present], indices[present]
+        moves = moves[present]
+        radius = self._body_radius
+        moving = self._fits(replicates, moves, radius, indices)
+        replicates, indices = replicates[moving], indices[moving]
+        moves = moves[moving]
+        rows, cols = self._cells(state.positions[replicates, indices],
+                                 radius)
+        self._occupancy[replicates[:, None], rows,
+                        cols] = OccupancyGrid.EMPTY
+        self._stamp(replicates, indices, moves, radius)
+        state.positions[replicates, indices] = moves
+
+    def update_simple_thermal(self) -> None:
+        """Update the core temperatures of every replicate.
+
+        See Environment.update_simple_thermal.
+        """
+        state = self._state
+        state.core_temp[...] = thermal.simple_thermal_step(
+            state,
+            self._grid_size,
+            self._time_step_size,
+            self._ambient_air_temp,
+            self._air_conductivity,
+            self._pair_kernel,
+        )
+        state.kill_out_of_range()
+
+    def bands(self) -> dict:
+        """Get the replicate mean and confidence band of each curve.
+
+        The band is the normal confidence interval of the mean at the
+        configured confidence level.
+
+        Returns
+        -------
+        dict
+            Epochs and, for ``alive`` and ``temp``, the mean, low and high
+            bound at each recorded epoch.
+        """
+        z_score = statistics.NormalDist().inv_cdf((1 + self._confidence) / 2)
+        bands = {"epoch": np.array(self._epochs_plot)}
+        for name, curve in (("alive", self._alive_plot),
+                            ("temp", self._temps_plot)):
+            curve = np.array(curve)
+            mean = curve.mean(axis=1)
+            if self._replicates > 1:
+                half_width = z_score * curve.std(axis=1, ddof=1) / np.sqrt(
+                    self._replicates)
+            else:
+                half_width = np.zeros_like(mean)
+            bands[f"{name}_mean"] = mean
+            bands[f"{name}_low"] = mean - half_width
+            bands[f"{name}_high"] = mean + half_width
+        return bands
+
+    def save_bands(self) -> None:
+        """Write the replicate mean and confidence bands to a CSV file"""
+        bands = self.bands()
+        csv_path = self._image_dir.joinpath(f"{self._file_name}_ensemble.csv")
+        with open(csv_path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(bands)
+            writer.writerows(zip(*bands.values()))
+        LOG.info(f"Ensemble bands saved in:\n{csv_path}")
+
+    def plot_vs_epoch(self) -> None:
+        """Plot the replicate mean and confidence bands vs epoch"""
+        bands = self.bands()
+        state = self._state
+        fig, survive_axis = plt.subplots()
+        survive_axis.plot(bands["epoch"], bands["alive_mean"],
+                          label=f"{self._name}", color="blue")
+        survive_axis.fill_between(bands["epoch"], bands["alive_low"],
+                                  bands["alive_high"], color="blue",
+                                  alpha=0.25)
+        survive_axis.set_xlabel("Epoch")
+        survive_axis.set_xlim([0, len(bands["epoch"])])
+        survive_axis.set_ylim([0.0, 1.1])
+        survive_axis.set_ylabel("Portion Surviving Penguins", color="blue")
+
+        temp_axis = survive_axis.twinx()
+        temp_axis.plot(bands["epoch"], bands["temp_mean"],
+                       label=f"{self._name}", color="red")
+        temp_axis.fill_between(bands["epoch"], bands["temp_low"],
+                               bands["temp_high"], color="red", alpha=0.25)
+        temp_axis.set_ylim([state.low_death_threshold[0, 0],
+                            state.high_death_threshold[0, 0]])
+        temp_axis.set_ylabel(r"Average Core Temperature ($\degree$C)",
+                             color="red")
+
+        fig.suptitle(f"Colony Health vs Epoch ({self._replicates} "
+                     f"replicates, {self._confidence:.0%} confidence)")
+        img_path = self._image_dir.joinpath(
+            f"{self._file_name}_plot_vs_epoch.png")
+        fig.savefig(img_path)
+        fig.clf()
+        plt.close()
+
+    def summary(self) -> dict:
+        """Summarize the outcome of the last run
+
+        Returns
+        -------
+        dict
+            Like Environment.summary, averaged over the replicates.
+        """
+        return {
+            "name": self._name,
+            "epochs": int(self._epoch),
+            "agents": self._state.shape[1],
+            "alive_portion": float(np.mean(self._alive_plot[-1])),
+            "mean_temp": float(np.mean(self._temps_plot[-1])),
+            "replicates": self._replicates,
+        }
@@ -6,19 +6,33 @@ The Environment implements a container to hold agents and control interactions.
 """
 # Standard library
 from __future__ import annotations
+import functools
+from typing import Callable
 import logging
 import pathlib
 import random
 import re
-import shutil
-import colorsys
+import time
 # Packages
 import coloredlogs
 import matplotlib.pyplot as plt
 import numpy as np
-from PIL import Image
 # Custom
+from active import ActiveTiles
 from agent import Agent
+from backend import load_backend
+import checkpoint
+from convergence import ConvergenceMonitor
+from swarm_state import SwarmState
+from encoder import FramePipeline
+from profiler import NullProfiler, Profiler
+from recorder import TrajectoryRecorder
+from refinement import TwoLevelGrid
+from renderer import Renderer
+from spatial import OccupancyGrid, SpatialHash
+from strips import StripSolver
+import policy
+import thermal
 
 LOG = logging.getLogger("penguin_swarm.environment")
 
@@ -26,6 +40,101 @@ LOG = logging.getLogger("penguin_swarm.environment")
 SRC_DIR = pathlib.Path(__file__).parent.resolve()
 PROJ_DIR = SRC_DIR.parent
 
+# Epochs evaluated at once by Environment.fast_forward
+FAST_FORWARD_CHUNK = 256
+
+
+def plot_vs_epoch(
+    img_path: pathlib.Path,
+    name: str,
+    epochs: list[int],
+    alive: list[float],
+    temps: list[float],
+    error_x: list[int],
+    error_y: list[float],
+    error_std: list[float],
+    temp_range: tuple[float],
+    converged_epoch: int = None,
+    fast_forwards: list[tuple[int]] = (),
+) -> None:
+    """Plot colony health vs epoch
+
+    Parameters
+    ----------
+    img_path : pathlib.Path
+        Output image path
+    name : str
+        Name of the simulation, used as the label
+    epochs : list[int]
+        Epoch of each point
+    alive : list[float]
+        Portion of surviving penguins at each epoch
+    temps : list[float]
+        Mean core temperature of the survivors at each epoch
+    error_x, error_y, error_std : list
+        Epoch, mean and standard deviation of the error bars
+    temp_range : tuple[float]
+        Limits of the temperature axis
+    converged_epoch : int
+        Epoch a steady state was declared at, marked with a line
+    fast_forwards : list[tuple[int]]
+        First and last epoch of each fast-forwarded span, shaded
+    """
+    fig, survive_axis = plt.subplots()
+
+    survive_axis.plot(
+        epochs,
+        alive,
+        label=f"{name}",
+        color="blue",
+    )
+    survive_axis.set_xlabel("Epoch")
+    survive_axis.set_xlim([0, len(epochs)])
+    survive_axis.set_ylim([0.0, 1.1])
+    survive_axis.set_ylabel("Portion Surviving Penguins",
+                            color="blue")
+    if converged_epoch is not None:
+        survive_axis.axvline(
+            converged_epoch,
+            label="Steady state",
+            color="green",
+            linestyle="--",
+        )
+    for span_index, (first, last) in enumerate(fast_forwards):
+        survive_axis.axvspan(
+            first,
+            last,
+            label="Fast-forwarded" if span_index == 0 else None,
+            color="gray",
+            alpha=0.2,
+        )
+    if converged_epoch is not None or fast_forwards:
+        survive_axis.legend(loc="lower left")
+
+
+    temp_axis = survive_axis.twinx()
+    temp_axis.plot(
+        epochs,
+        temps,
+        label=f"{name}",
+        color="red"
+        )
+    temp_axis.errorbar(
+        error_x,
+        error_y,
+        yerr = error_std,
+        label = f"{name}",
+        color = "red",
+    )
+    temp_axis.set_ylim(list(temp_range))
+    temp_axis.set_ylabel(r"Average Core Temperature ($\degree$C)",
+                         color="red")
+
+    fig.suptitle("Colony Health vs Epoch")
+    fig.savefig(img_path)
+    fig.clf()
+    plt.close()
+
 
 class Environment:
     """Environment container.
@@ -36,7 +145,93 @@ class Environment:
         Minimum logging level
     config : configparser.ConfigParser
         ConfigParser object with the configurations
+    pair_chunk_size : int
+        Agents per block of the pairwise heat exchange, 0 for one block
+    thermal_model : str
+        Thermal model to run each epoch, one of THERMAL_MODELS
+    thermal_integrator : str
+        Time integrator of the grid model, one of thermal.INTEGRATORS
+    movement_update : str
+        How moves are proposed each epoch, one of MOVEMENT_UPDATES
+    pair_approximation : str
+        Pairwise heat exchange of the simple model, one of
+        PAIR_APPROXIMATIONS
+    pm_cell_size, pm_cutoff : int
+        Mesh cell size and exact near-field cutoff of the particle-mesh
+        approximation, see thermal.population_heat_flow_pm
+    pm_error_interval : int
+        Epochs between reports of the particle-mesh error against the exact
+        sum, 0 to never report
+    draw_map : bool
+        Whether GIF frames show the thermal map behind the penguins
+    gif_scale : int
+        Pixels per cell side in the GIF frames
+    gif_queue_size : int
+        Frames waiting for the background GIF encoder before draw blocks
+    checkpoint_epochs : int
+        Epochs between checkpoints, 0 for no epoch interval
+    checkpoint_seconds : float
+        Wall time between checkpoints in s, 0 for no time interval
+    record : bool
+        Whether to record the trajectory for replay.py
+    record_map_interval : int
+        Epochs between thermal map snapshots in the recording, 0 for none
+    profile : bool
+        Whether to time the phases of each epoch and count hot-path events
+    profile_log_interval : int
+        Epochs between profile log lines, 0 to only log at the end
+    prune_dead : bool
+        Whether dead agents leave the update order, the spatial indexes and
+        the pairwise heat exchange. Off, they keep moving and exchanging heat
+        like the original model.
+    convergence_window : int
+        Epochs that must be flat to declare a steady state, 0 to never check
+    convergence_tolerance : float
+        Largest range of the mean and standard deviation of the core
+        temperatures over the window in degrees C
+    convergence_displacement : float
+        Largest range of the huddle centroid over the window in cells
+    convergence_action : str
+        What to do at a steady state, one of convergence.ACTIONS
+    thermal_tolerance : float
+        Largest local error of an adaptive thermal sub-step in degrees C, 0
+        for one step of time_step_size per epoch
+    movement_interval : int
+        Epochs between movement passes, which also run early when an agent
+        crossed a move threshold or died, 1 to move every epoch
+    thermal_tile : int
+        Side in cells of the coarse cells of a two-level grid for the grid
+        model, 0 for a uniform grid, see refinement.TwoLevelGrid
+    refine_margin : int
+        Air cells kept at full resolution around every penguin by the
+        two-level grid
+    active_tile : int
+        Side in cells of the tiles of the grid model that rest once their
+        cells stop changing, 0 to update every cell, see active.ActiveTiles
+    active_tolerance : float
+        Change of a cell in degrees C below which a tile rests
+    backend : str
+        Compute backend of the hot kernels, see backend.BACKENDS
+    thermal_workers : int
+        Worker processes of the explicit grid model, each advancing one strip
+        of the grid, 0 to advance it in this process, see strips.StripSolver
+    precision : str
+        Floating point type of the per-cell fields of the grid model, one of
+        PRECISIONS. The thermal map stays float64, so changes finer than the
+        float32 resolution of the temperatures still add up
+    precision_error_interval : int
+        Epochs between reports of the grid model error against a float64
+        step, 0 to never report
     """
+    # Thermal models selectable with the thermal_model parameter
+    THERMAL_MODELS = ("simple", "grid")
+    # Movement updates selectable with the movement_update parameter
+    MOVEMENT_UPDATES = ("sequential", "synchronous")
+    # Pairwise heat exchange selectable with the pair_approximation parameter
+    PAIR_APPROXIMATIONS = ("exact", "pm")
+    # Floating point types selectable with the precision parameter
+    PRECISIONS = ("float64", "float32")
+
     def __init__(
         self,
         log_level: int,
@@ -50,6 +245,38 @@ class Environment:
         initial_air_temp: float,
         ambient_air_temp: float,
         make_gif: bool,
+        pair_chunk_size: int = 0,
+        thermal_model: str = "simple",
+        thermal_integrator: str = "explicit",
+        movement_update: str = "sequential",
+        pair_approximation: str = "exact",
+        pm_cell_size: int = 8,
+        pm_cutoff: int = 32,
+        pm_error_interval: int = 0,
+        draw_map: bool = False,
+        gif_scale: int = 2,
+        gif_queue_size: int = 8,
+        checkpoint_epochs: int = 0,
+        checkpoint_seconds: float = 0.0,
+        record: bool = False,
+        record_map_interval: int = 0,
+        profile: bool = False,
+        profile_log_interval: int = 0,
+        prune_dead: bool = False,
+        convergence_window: int = 0,
+        convergence_tolerance: float = 0.05,
+        convergence_displacement: float = 10.0,
+        convergence_action: str = "stop",
+        thermal_tolerance: float = 0.0,
+        movement_interval: int = 1,
+        thermal_tile: int = 0,
+        refine_margin: int = 16,
+        active_tile: int = 0,
+        active_tolerance: float = 1E-3,
+        backend: str = "numpy",
+        thermal_workers: int = 0,
+        precision: str = "float64",
+        precision_error_interval: int = 0,
     ):
         coloredlogs.install(
             level=log_level * 10,
@@ -63,7 +290,18 @@ class Environment:
         self._file_name = re.sub(" ", "_", self._file_name)
         self._file_name = re.sub("[^a-z0-9_-]", "", self._file_name)
         self._env_size = env_size
+        self._state = SwarmState()
         self._agents = list()
+        self._order = list()
+        # Position of each agent in the shuffled update order
+        self._rank = np.zeros(shape=0, dtype=int)
+        # Sorted indices of the alive agents, compacted when agents die
+        self._alive_index = np.zeros(shape=0, dtype=int)
+        self._prune_dead = prune_dead
+        # Built on the first add_agent, buckets are sized to its sense radius
+        self._spatial = None
+        self._max_sense_radius = 0
+        self._occupancy = OccupancyGrid(self._state, self._env_size)
         self._epoch = 0
         self._grid_size = grid_size
         self._time_step_size = time_step_size
@@ -71,6 +309,7 @@ class Environment:
         self._make_gif = make_gif
         self._image_dir = image_dir
         self._alive_agents = 0
+        self._total_agents = 0
         self._alive_agents_plot = list()
         self._epochs_plot = list()
         self._temps_plot = list()
@@ -79,33 +318,117 @@ class Environment:
         self._temps_error_x = list()
         self._temps_error_y = list()
 
-        # Drawing environment
-        self._drawing_env = np.ones(
-            shape=(self.env_size[0], self.env_size[1], 3),
-            dtype=float,
+        # Drawing environment, the renderer is built on the first draw
+        self._draw_map = draw_map
+        self._gif_scale = gif_scale
+        self._gif_queue_size = gif_queue_size
+        self._renderer = None
+        self._gif_pipeline = None
+        self._gif_name = f"{self._file_name}.gif"
+
+        # Checkpoints, see save_checkpoint and restore
+        self._checkpointer = checkpoint.Checkpointer(
+            self._image_dir.joinpath(f"{self._file_name}_checkpoint.npz"),
+            checkpoint_epochs,
+            checkpoint_seconds,
         )
+        self._resumed = False
 
-        # Thermal model related members
-        self._thermal_map = np.full(shape=self._env_size,
-                                    fill_value=initial_air_temp,
-                                    dtype=float)
-        # I intend this to store a string but Sid you may change the dtype
-        # I did not do enums because I dislike Python enums
-        """
-        Material Map Key:
-            [0] = Air
-            [1] = Penguin Core
-            [2] = Penguin Internal
-            [3] = Penguin External
-        """
-        self._material_map = np.zeros(shape=self._env_size, dtype=float)
+        # Trajectory recording, created when the run starts
+        self._record = record
+        self._record_map_interval = record_map_interval
+        self._recorder = None
+
+        # Phase timers and counters, see profiler.Profiler
+        self._profiler = Profiler() if profile else NullProfiler()
+        self._profile_log_interval = profile_log_interval
+        self._run_seconds = 0.0
+
+        # Steady-state detection, see check_convergence
+        self._monitor = None
+        if convergence_window > 0:
+            self._monitor = ConvergenceMonitor(convergence_window,
+                                               convergence_tolerance,
+                                               convergence_displacement)
+        self._convergence_action = convergence_action
+        self._converged_epoch = None
+        self._fast_forwards = list()
+
+        # Thermal model related members, a two-level grid replaces the maps
+        self._thermal_grid = None
+        self._active_tiles = None
+        self._thermal_strips = None
+        self._thermal_map = None
+        self._material_map = None
+        self._field_dtype = np.dtype(precision)
+        self._precision_error_interval = precision_error_interval
+        self._precision_errors = list()
+        if thermal_model == "grid" and thermal_tile > 0:
+            self._thermal_grid = TwoLevelGrid(self._env_size, thermal_tile,
+                                              refine_margin, grid_size,
+                                              air_conductivity,
+                                              ambient_air_temp,
+                                              initial_air_temp)
+        elif thermal_model == "grid" and active_tile > 0:
+            self._active_tiles = ActiveTiles(self._env_size, active_tile,
+                                             active_tolerance, grid_size,
+                                             air_conductivity,
+                                             ambient_air_temp,
+                                             initial_air_temp,
+                                             self._field_dtype)
+            self._thermal_map = self._active_tiles.thermal_map
+        elif thermal_model == "grid" and thermal_workers > 0:
+            self._thermal_strips = StripSolver(self._env_size,
+                                               thermal_workers, grid_size,
+                                               air_conductivity,
+                                               ambient_air_temp,
+                                               initial_air_temp,
+                                               self._field_dtype)
+            self._thermal_map = self._thermal_strips.thermal_map
+        else:
+            self._thermal_map = np.full(shape=self._env_size,
+                                        fill_value=initial_air_temp,
+                                        dtype=float)
+            # I intend this to store a string but Sid you may change the
+            # dtype. I did not do enums because I dislike Python enums
+            """
+            Material Map Key:
+                [0] = Air
+                [1] = Penguin Core
+                [2] = Penguin Internal
+                [3] = Penguin External
+            """
+            self._material_map = np.zeros(shape=self._env_size,
+                                          dtype=np.uint8)
         self._air_conductivity = air_conductivity
         self._initial_air_temp = initial_air_temp
         self._ambient_air_temp = ambient_air_temp
+        self._pair_chunk_size = pair_chunk_size
+        self._backend = load_backend(backend)
+        self._exact_pair_kernel = functools.partial(
+            self._backend.pair_heat_flow, chunk_size=pair_chunk_size)
+        if pair_approximation == "pm":
+            self._pair_kernel = functools.partial(
+                thermal.population_heat_flow_pm,
+                env_size=self._env_size,
+                cell_size=pm_cell_size,
+                cutoff=pm_cutoff,
+            )
+        else:
+            self._pair_kernel = self._exact_pair_kernel
+        self._pm_error_interval = pm_error_interval
+        self._pair_errors = list()
+        self._thermal_model = thermal_model
+        self._thermal_integrator = thermal_integrator
+        # Adaptive sub-steps, see integrate_thermal
+        self._thermal_tolerance = thermal_tolerance
+        self._thermal_substep = None
+        self._movement_update = movement_update
+        # Movement cadence, see movement_due
+        self._movement_interval = movement_interval
+        self._movement_epoch = 0
+        self._movement_bands = None
 
-        # Initialize image directories
-        self._gif_img_dir = self._image_dir.joinpath("gif_imgs")
-        self._gif_img_dir.mkdir(mode=0o775, exist_ok=True)
         LOG.debug(f"Initialized Environment: {self._name}")
 
     @property
@@ -114,88 +437,693 @@ class Environment:
         return self._env_size
 
     def run(self) -> None:
-        """Run for a set number of epochs"""
+        """Run for a set number of epochs
+
+        A restored Environment continues from the epoch of its checkpoint.
+        """
         # TODO: Initialize the thermal environment, probably around here.
         # Do that initialization in a separate function.
-        # Draw initial board
-        self.draw()
-        total_agents = np.sum([a.alive for a in self._agents])
-        self._alive_agents = np.sum([a.alive for a in self._agents])
-        self._alive_agents_plot.append(self._alive_agents / total_agents)
-        self._temps_plot.append(np.mean([a.core_temp for a in self._agents if a.alive]))
-        self._temps_error_std.append(np.std([a.core_temp for a in self._agents if a.alive]))
-        self._temps_error_x.append(self._epoch)
-        self._temps_error_y.append(np.mean([a.core_temp for a in self._agents if a.alive]))
-        self._epochs_plot.append(self._epoch)
-        for epoch in range(self._epochs):
-            LOG.info(f"Begin epoch {epoch + 1}/{self._epochs}: "
-                     f"{self._alive_agents}"
-                     f"/{len(self._agents)} agents alive")
-            self.run_epoch()
-            self.update_simple_thermal()
-            self._alive_agents = np.sum([a.alive for a in self._agents])
-            self._alive_agents_plot.append(self._alive_agents / total_agents)
-            self._epochs_plot.append(self._epoch)
-            if np.sum([a.alive for a in self._agents]) == 0:
-                self._temps_plot.append(self._temps_plot[-1])
-                LOG.info("Simulation early stop due to 0 agent alive")
-                break
-            if epoch % self._temps_error_interval == 0:
-                self._temps_error_std.append(np.std([a.core_temp for a in self._agents if a.alive]))
-                self._temps_error_x.append(self._epoch)
-                self._temps_error_y.append(np.mean([a.core_temp for a in self._agents if a.alive]))
-            self._temps_plot.append(np.mean([a.core_temp for a in self._agents if a.alive]))
-        self.save_gif()
+        start = time.perf_counter()
+        profiler = self._profiler
+        try:
+            state = self._state
+            self._alive_index = np.flatnonzero(state.alive)
+            # A restored run was pruned by restore
+            if self._prune_dead and not self._resumed:
+                self.prune(np.flatnonzero(~state.alive))
+            if self._record:
+                self.start_recording()
+            if not self._resumed:
+                # Draw initial board
+                self.draw()
+                with profiler.phase("statistics"):
+                    core = state.core_temp[self._alive_index]
+                    mean_temp = np.mean(core)
+                    self._total_agents = np.sum(state.alive)
+                    self._alive_agents = len(self._alive_index)
+                    self._alive_agents_plot.append(self._alive_agents /
+                                                   self._total_agents)
+                    self._temps_plot.append(mean_temp)
+                    self._temps_error_std.append(np.std(core))
+                    self._temps_error_x.append(self._epoch)
+                    self._temps_error_y.append(mean_temp)
+                    self._epochs_plot.append(self._epoch)
+                self.record_epoch()
+                self.end_profile_epoch()
+            while self._epoch < self._epochs:
+                epoch = self._epoch
+                LOG.info(f"Begin epoch {epoch + 1}/{self._epochs}: "
+                         f"{self._alive_agents}"
+                         f"/{len(state)} agents alive")
+                with profiler.phase("run_epoch"):
+                    self.run_epoch()
+                with profiler.phase("thermal"):
+                    if self._thermal_model == "grid":
+                        self.update_thermal()
+                    else:
+                        self.update_simple_thermal()
+                with profiler.phase("statistics"):
+                    self.update_alive()
+                    self._alive_agents_plot.append(self._alive_agents /
+                                                   self._total_agents)
+                    self._epochs_plot.append(self._epoch)
+                self.record_epoch()
+                if self._alive_agents == 0:
+                    self._temps_plot.append(self._temps_plot[-1])
+                    self.end_profile_epoch()
+                    LOG.info("Simulation early stop due to 0 agent alive")
+                    break
+                with profiler.phase("statistics"):
+                    core = self.append_temp_statistics(epoch)
+                if self._monitor is not None:
+                    with profiler.phase("convergence"):
+                        converged = self.check_convergence(core)
+                    if converged:
+                        self.end_profile_epoch()
+                        LOG.info("Simulation early stop at a steady state")
+                        break
+                if self._checkpointer.due(self._epoch):
+                    with profiler.phase("checkpoint"):
+                        self.save_checkpoint()
+                self.end_profile_epoch()
+            self._run_seconds = time.perf_counter() - start
+        finally:
+            # Always stop the GIF encoder, even if an epoch raised
+            self.save_gif()
+            if self._recorder is not None:
+                self._recorder.close()
+                self._recorder = None
+            if self._thermal_strips is not None:
+                self._thermal_strips.close()
+            self.save_profile()
+        checkpoints = self._checkpointer
+        if checkpoints.count > 0:
+            run_seconds = time.perf_counter() - start
+            LOG.info(f"{checkpoints.count} checkpoints of "
+                     f"{checkpoints.size / 1E6:.2f} MB took "
+                     f"{checkpoints.seconds:.3f} s, "
+                     f"{100 * checkpoints.seconds / run_seconds:.2f}% "
+                     "of the run")
+        if self._active_tiles is not None:
+            LOG.info(f"Active tiles ran "
+                     f"{100 * self._active_tiles.update_fraction:.1f}% of "
+                     "the tile updates, the resting tiles skipped at most "
+                     f"{self._active_tiles.error_estimate:.3g} degrees")
+        if self._thermal_strips is not None:
+            LOG.info(f"Thermal strips took "
+                     f"{self._thermal_strips.step_ms:.2f} ms per step")
+            for worker, timing in enumerate(self._thermal_strips.timings()):
+                LOG.info(f"Strip {worker} of rows {timing['rows'][0]} to "
+                         f"{timing['rows'][1] - 1}: "
+                         f"{timing['compute_ms']:.2f} ms compute and "
+                         f"{timing['wait_ms']:.2f} ms barrier wait per step, "
+                         f"{100 * timing['halo_portion']:.1f}% halo cells")
         self.plot_vs_epoch()
-        shutil.rmtree(self._gif_img_dir, ignore_errors=True)
-    
+
+    def append_temp_statistics(self, epoch: int) -> np.ndarray:
+        """Append the mean core temperature of the alive agents
+
+        The standard deviation is also appended as an error bar when the loop
+        epoch is a multiple of the error bar interval.
+
+        Parameters
+        ----------
+        epoch : int
+            Epoch before the one just run.
+
+        Returns
+        -------
+        np.ndarray[float]
+            Core temperatures of the alive agents.
+        """
+        core = self._state.core_temp[self._alive_index]
+        mean_temp = np.mean(core)
+        if epoch % self._temps_error_interval == 0:
+            self._temps_error_std.append(np.std(core))
+            self._temps_error_x.append(self._epoch)
+            self._temps_error_y.append(mean_temp)
+        self._temps_plot.append(mean_temp)
+        return core
+
+    def check_convergence(self, core: np.ndarray) -> bool:
+        """Feed the steady-state monitor with the epoch just run
+
+        At a steady state the run stops, or the simple thermal model is
+        fast-forwarded, see fast_forward.
+
+        Parameters
+        ----------
+        core : np.ndarray[float]
+            Core temperatures of the alive agents.
+
+        Returns
+        -------
+        bool
+            Whether the run should stop.
+        """
+        state = self._state
+        if not self._monitor.update(
+                self._alive_agents,
+                self._temps_plot[-1],
+                np.std(core),
+                state.positions[self._alive_index].mean(axis=0),
+        ):
+            return False
+        if self._converged_epoch is None:
+            self._converged_epoch = self._epoch
+        LOG.info(f"Steady state at epoch {self._epoch}, flat for "
+                 f"{self._monitor.window} epochs")
+        self._monitor.reset()
+        if self._convergence_action == "fast_forward":
+            return not self.fast_forward()
+        return True
+
+    def fast_forward(self) -> bool:
+        """Advance the simple thermal model analytically
+
+        The positions are held at the steady state, so the random jitter and
+        the blocked moves of the huddle are not simulated, and no GIF frames
+        are drawn. The fast-forward ends at the last epoch, or before the
+        first epoch at which an alive agent would cross a move or death
+        threshold. The run then continues normally.
+
+        Returns
+        -------
+        bool
+            Whether the model could be fast-forwarded. It cannot when the
+            time step is above the stability limit of the explicit step.
+        """
+        state = self._state
+        index = (self._alive_index
+                 if self._prune_dead else np.arange(len(state)))
+        try:
+            modes = thermal.simple_thermal_modes(state, self._grid_size,
+                                                 self._time_step_size,
+                                                 self._ambient_air_temp,
+                                                 self._air_conductivity,
+                                                 index)
+        except ValueError as error:
+            LOG.warning(f"Cannot fast-forward, {error}")
+            return False
+        core = state.core_temp[index]
+        alive = state.alive[index]
+        thresholds = np.stack((
+            state.low_death_threshold[index],
+            state.low_move_threshold[index],
+            state.high_move_threshold[index],
+            state.high_death_threshold[index],
+        ), axis=1)
+        # Number of thresholds below each temperature, its behaviour band
+        band = (core[:, None] > thresholds).sum(axis=1)
+        first = self._epoch
+        crossed = False
+        while self._epoch < self._epochs and not crossed:
+            steps = np.arange(
+                self._epoch - first + 1,
+                min(self._epoch + FAST_FORWARD_CHUNK, self._epochs) - first +
+                1)
+            temps = thermal.evolve_simple_thermal(modes, core, steps)
+            changed = np.any(
+                ((temps[..., None] > thresholds).sum(axis=2) != band) & alive,
+                axis=1)
+            crossed = changed.any()
+            if crossed:
+                temps = temps[:np.argmax(changed)]
+            for temp in temps:
+                epoch = self._epoch
+                self._epoch += 1
+                state.body_temp[index] = temp[:, None, None]
+                self._alive_agents_plot.append(self._alive_agents /
+                                               self._total_agents)
+                self._epochs_plot.append(self._epoch)
+                self.record_epoch()
+                self.append_temp_statistics(epoch)
+        if self._epoch > first:
+            self._fast_forwards.append((first, self._epoch))
+            LOG.info(f"Fast-forwarded from epoch {first} to {self._epoch}")
+        return True
+
+    def update_alive(self) -> None:
+        """Compact the alive index after a thermal update killed agents
+
+        Only the agents alive before the update are visited. With
+        prune_dead, the agents that died are pruned.
+        """
+        still_alive = self._state.alive[self._alive_index]
+        if still_alive.all():
+            return
+        dead = self._alive_index[~still_alive]
+        self._alive_index = self._alive_index[still_alive]
+        self._alive_agents = len(self._alive_index)
+        if self._prune_dead:
+            self.prune(dead)
+
+    def prune(self, dead: np.ndarray) -> None:
+        """Remove dead agents from the update order and the spatial indexes
+
+        They no longer move, block moves, get sensed or exchange heat, and
+        their core temperature stays at its value when they died.
+
+        Parameters
+        ----------
+        dead : np.ndarray[int]
+            Indices of the agents to remove.
+        """
+        if len(dead) == 0:
+            return
+        dead_set = set(dead.tolist())
+        self._order = [index for index in self._order
+                       if index not in dead_set]
+        self.update_rank()
+        for index in dead_set:
+            self._spatial.remove(index)
+            self._occupancy.erase(index)
+        LOG.debug(f"Pruned {len(dead_set)} dead agents")
+
+    def update_rank(self) -> None:
+        """Recompute the position of each agent in the update order"""
+        self._rank = np.zeros(shape=len(self._state), dtype=int)
+        self._rank[self._order] = np.arange(len(self._order))
+
+    @property
+    def thermal_map(self) -> np.ndarray:
+        """np.ndarray[float]: Temperature of every cell of the environment
+
+        A two-level grid is expanded, every coarse cell covering its tile.
+        """
+        if self._thermal_grid is not None:
+            return self._thermal_grid.full_map()
+        return self._thermal_map
+
+    @property
+    def run_seconds(self) -> float:
+        """float: Wall time of the epochs of the last run in s
+
+        Finishing the GIF and saving the plot are not included.
+        """
+        return self._run_seconds
+
+    def profile_totals(self) -> dict:
+        """Get the phase and counter totals, see profiler.Profiler.totals"""
+        return self._profiler.totals()
+
+    @property
+    def recording_path(self) -> pathlib.Path:
+        """pathlib.Path: Directory of the trajectory recording"""
+        return self._image_dir.joinpath(f"{self._file_name}_trajectory")
+
+    def start_recording(self) -> None:
+        """Open the trajectory recording, see recorder.TrajectoryRecorder
+
+        A resumed run keeps the recording and drops the frames recorded
+        after its checkpoint.
+        """
+        self._recorder = TrajectoryRecorder(
+            self.recording_path,
+            self._state,
+            self._env_size,
+            self._record_map_interval,
+            self._epoch if self._resumed else None,
+            name=self._name,
+            file_name=self._file_name,
+            ambient_temp=self._ambient_air_temp,
+            initial_temp=self._initial_air_temp,
+            temps_error_interval=self._temps_error_interval,
+            gif_scale=self._gif_scale,
+            draw_map=self._draw_map,
+        )
+
+    def record_epoch(self) -> None:
+        """Append the current epoch to the trajectory recording"""
+        if self._recorder is not None:
+            with self._profiler.phase("record"):
+                # A two-level grid is only expanded for the map snapshots
+                map_due = (self._record_map_interval > 0 and
+                           self._epoch % self._record_map_interval == 0)
+                self._recorder.append(self._epoch, self._state,
+                                      self.thermal_map if map_due else None)
+
+    def end_profile_epoch(self) -> None:
+        """Close the profile row of the epoch and log it periodically"""
+        self._profiler.end_epoch(self._epoch)
+        if (self._profile_log_interval > 0
+                and self._epoch % self._profile_log_interval == 0):
+            LOG.info(f"Profile at epoch {self._epoch}, "
+                     f"{self._profiler.format()}")
+
+    def save_profile(self) -> None:
+        """Write the phase timers and counters as JSON and CSV"""
+        if not self._profiler.enabled:
+            return
+        json_path = self._image_dir.joinpath(f"{self._file_name}_profile.json")
+        self._profiler.save(
+            json_path,
+            self._image_dir.joinpath(f"{self._file_name}_profile.csv"))
+        LOG.info(f"Profile, {self._profiler.format()}")
+        LOG.info(f"The profile has been saved in:\n{json_path}")
+
+    @property
+    def checkpoint_path(self) -> pathlib.Path:
+        """pathlib.Path: File written by save_checkpoint"""
+        return self._checkpointer.path
+
+    def save_checkpoint(self) -> None:
+        """Atomically write everything needed to resume after this epoch
+
+        The checkpoint holds the SwarmState, the thermal and material maps,
+        the shuffled order, the plot series and the state of the global
+        random and NumPy generators, so a restored run continues bit for
+        bit.
+        """
+        arrays = {
+            f"state_{name}": array
+            for name, array in self._state.snapshot().items()
+        }
+        arrays.update(checkpoint.random_state())
+        arrays.update(
+            env_size=np.array(self._env_size),
+            epoch=np.array(self._epoch),
+            order=np.array(self._order, dtype=int),
+            alive_agents=np.array(self._alive_agents),
+            total_agents=np.array(self._total_agents),
+            alive_agents_plot=np.array(self._alive_agents_plot),
+            epochs_plot=np.array(self._epochs_plot),
+            temps_plot=np.array(self._temps_plot),
+            temps_error_std=np.array(self._temps_error_std),
+            temps_error_x=np.array(self._temps_error_x),
+            temps_error_y=np.array(self._temps_error_y),
+            pair_errors=np.array(self._pair_errors,
+                                 dtype=float).reshape(-1, 2),
+            precision_errors=np.array(self._precision_errors,
+                                      dtype=float).reshape(-1, 2),
+            convergence_window=(self._monitor.snapshot() if self._monitor
+                                is not None else np.zeros(shape=(0, 5))),
+            converged_epoch=np.array(-1 if self._converged_epoch is None else
+                                     self._converged_epoch),
+            fast_forwards=np.array(self._fast_forwards,
+                                   dtype=int).reshape(-1, 2),
+            thermal_substep=np.array(np.nan if self._thermal_substep is None
+                                     else self._thermal_substep),
+            movement_epoch=np.array(self._movement_epoch),
+            movement_bands=(np.zeros(shape=0, dtype=int)
+                            if self._movement_bands is None else
+                            self._movement_bands),
+        )
+        if self._thermal_grid is not None:
+            arrays.update({
+                f"grid_{name}": array
+                for name, array in self._thermal_grid.snapshot().items()
+            })
+        elif self._active_tiles is not None:
+            arrays.update({
+                f"tiles_{name}": array
+                for name, array in self._active_tiles.snapshot().items()
+            })
+        elif self._thermal_strips is not None:
+            arrays.update({
+                f"strips_{name}": array
+                for name, array in self._thermal_strips.snapshot().items()
+            })
+        else:
+            arrays.update(thermal_map=self._thermal_map,
+                          material_map=self._material_map)
+        if self._recorder is not None:
+            # The recording must reach the checkpoint epoch to be resumed
+            self._recorder.flush()
+        seconds = self._checkpointer.save(arrays)
+        LOG.info(f"Checkpoint at epoch {self._epoch}: "
+                 f"{self._checkpointer.size / 1E6:.2f} MB in "
+                 f"{seconds * 1E3:.1f} ms")
+
+    def restore(self, path: pathlib.Path, agent_type: type) -> None:
+        """Replace the agents and progress with a checkpoint
+
+        Parameters
+        ----------
+        path : pathlib.Path
+            Checkpoint written by save_checkpoint.
+        agent_type : type
+            Agent subclass of the restored agent views.
+
+        Raises
+        ------
+        ValueError
+            If the checkpoint was written for another environment size or
+            with another thermal grid.
+        """
+        arrays = checkpoint.read(path)
+        if tuple(arrays["env_size"]) != tuple(self._env_size):
+            raise ValueError(f"Checkpoint env_size {arrays['env_size']} "
+                             f"does not match {self._env_size}")
+        if (("grid_window" in arrays) != (self._thermal_grid is not None)
+                or ("tiles_map" in arrays) !=
+                (self._active_tiles is not None)
+                or ("strips_map" in arrays) !=
+                (self._thermal_strips is not None)):
+            raise ValueError("Checkpoint thermal grid does not match "
+                             "thermal_tile, active_tile and thermal_workers")
+        state = self._state
+        state.restore({
+            name[len("state_"):]: array
+            for name, array in arrays.items() if name.startswith("state_")
+        })
+        self._agents = [agent_type.view(state, i) for i in range(len(state))]
+        self._order = arrays["order"].tolist()
+        # Pruned agents stay out of the order and the spatial indexes, a
+        # live agent may stand on the cells one left
+        present = None
+        if self._prune_dead:
+            present = np.flatnonzero(state.alive)
+            self._order = [index for index in self._order
+                           if state.alive[index]]
+        self.update_rank()
+        self._spatial = None
+        self._max_sense_radius = 0
+        if len(state) > 0:
+            self._max_sense_radius = int(state.sense_radius.max())
+            self._spatial = SpatialHash(state, self._env_size,
+                                        state.sense_radius[0])
+            self._spatial.rebuild(present)
+        self._occupancy.rebuild(present)
+        self._epoch = int(arrays["epoch"])
+        if self._thermal_grid is not None:
+            self._thermal_grid.restore({
+                name[len("grid_"):]: array
+                for name, array in arrays.items() if name.startswith("grid_")
+            })
+        elif self._active_tiles is not None:
+            self._active_tiles.restore({
+                name[len("tiles_"):]: array
+                for name, array in arrays.items()
+                if name.startswith("tiles_")
+            })
+        elif self._thermal_strips is not None:
+            self._thermal_strips.restore({
+                name[len("strips_"):]: array
+                for name, array in arrays.items()
+                if name.startswith("strips_")
+            })
+            self._thermal_map = self._thermal_strips.thermal_map
+        else:
+            self._thermal_map = arrays["thermal_map"]
+            self._material_map = arrays["material_map"]
+        self._alive_agents = arrays["alive_agents"][()]
+        self._total_agents = arrays["total_agents"][()]
+        self._alive_agents_plot = list(arrays["alive_agents_plot"])
+        self._epochs_plot = arrays["epochs_plot"].tolist()
+        self._temps_plot = list(arrays["temps_plot"])
+        self._temps_error_std = list(arrays["temps_error_std"])
+        self._temps_error_x = arrays["temps_error_x"].tolist()
+        self._temps_error_y = list(arrays["temps_error_y"])
+        self._pair_errors = [(int(epoch), error)
+                             for epoch, error in arrays["pair_errors"]]
+        self._precision_errors = [
+            (int(epoch), error)
+            for epoch, error in arrays["precision_errors"]
+        ]
+        if self._monitor is not None:
+            self._monitor.restore(arrays["convergence_window"])
+        converged_epoch = int(arrays["converged_epoch"])
+        self._converged_epoch = (None
+                                 if converged_epoch < 0 else converged_epoch)
+        self._fast_forwards = [(int(first), int(last))
+                               for first, last in arrays["fast_forwards"]]
+        thermal_substep = float(arrays["thermal_substep"])
+        self._thermal_substep = (None if np.isnan(thermal_substep) else
+                                 thermal_substep)
+        self._movement_epoch = int(arrays["movement_epoch"])
+        self._movement_bands = (arrays["movement_bands"]
+                                if len(arrays["movement_bands"]) == len(state)
+                                else None)
+        checkpoint.set_random_state(arrays)
+        # The GIF of the previous run cannot be appended to
+        self._gif_name = f"{self._file_name}_from_{self._epoch:06d}.gif"
+        self._resumed = True
+        LOG.info(f"Resumed from epoch {self._epoch}: {path}")
+
+    def summary(self) -> dict:
+        """Summarize the outcome of the last run
+
+        Returns
+        -------
+        dict
+            Name, epochs run, final surviving portion, final mean core
+            temperature of the surviving agents and the epoch a steady state
+            was declared at, None if none was.
+        """
+        return {
+            "name": self._name,
+            "epochs": int(self._epoch),
+            "agents": len(self._state),
+            "alive_portion": float(self._alive_agents_plot[-1]),
+            "mean_temp": float(self._temps_plot[-1]),
+            "converged_epoch": self._converged_epoch,
+        }
+
+    def curves(self) -> dict:
+        """Get the per-epoch series of the last run
+
+        Returns
+        -------
+        dict
+            Epochs, surviving portion and mean core temperature of the
+            surviving agents, one value per recorded epoch.
+        """
+        return {
+            "epochs": [int(epoch) for epoch in self._epochs_plot],
+            "alive_portion": [float(value)
+                              for value in self._alive_agents_plot],
+            "mean_temp": [float(value) for value in self._temps_plot],
+        }
+
     def update_simple_thermal(self) -> None:
-        A=self._grid_size*1.1
-        
-        agent_body_temps=[]
-        
-        for n in self._agents:                       
-            
-            Q_meta=n._metabolism*pow(self._grid_size, 2)*1.1
-            
-            n_avg_temp=n.body_temp[n.body_radius-1][n.body_radius-1]            
-            
-            Q_env=n._internal_conductivity*A*(self._ambient_air_temp-n_avg_temp)
-            
-            Q_pop=0
-            
-            for m in self._agents:
-                if(n is m):
-                    continue
-                else:
-                    m_avg_temp=m.body_temp[m.body_radius-1][m.body_radius-1]            
-                    
-                    dist=(self.manhatten_distance(n,m)-n.body_radius-m.body_radius+1)*self._grid_size
-                    
-                    heat_res=n._insulation_thickness/(n._external_conductivity*A)
-                    heat_res+=m._insulation_thickness/(m._external_conductivity*A)
-                    heat_res+=dist/(self._air_conductivity*A)
-                    
-                    Q_pop+=(1/heat_res)*(m_avg_temp-n_avg_temp)
-                    
-            Q=(Q_meta+Q_env+Q_pop)*self._time_step_size
-            
-            n_avg_temp+=Q/(n._density*pow(self._grid_size,2)*1.1*3E3)
-            
-            body_temp=np.zeros((2*n.body_radius-1,2*n.body_radius-1))                    
-            for i in range(n.body_radius):
-                    for j in range(n.body_radius - i):
-                        body_temp[n.body_radius-1+i][n.body_radius-1+j]=n_avg_temp
-                        body_temp[n.body_radius-1+i][n.body_radius-1-j]=n_avg_temp
-                        body_temp[n.body_radius-1-i][n.body_radius-1+j]=n_avg_temp
-                        body_temp[n.body_radius-1-i][n.body_radius-1-j]=n_avg_temp
-            
-            agent_body_temps.append(body_temp)
-            
-        for n in range(len(self._agents)):
-            
-            self._agents[n].body_temp=agent_body_temps[n]
-    
+        """Update agent core temperatures with the lumped thermal model.
+
+        Each agent is a single thermal mass exchanging heat with the ambient
+        air and with every other agent through a resistance that grows with
+        the distance between them. See thermal.simple_thermal_step.
+        """
+        state = self._state
+        if (self._pair_kernel is not self._exact_pair_kernel
+                and self._pm_error_interval > 0
+                and self._epoch % self._pm_error_interval == 0):
+            self.report_pair_error()
+        # Pruned agents are left out of the exchange
+        index = self._alive_index if self._prune_dead else slice(None)
+        if self._pair_kernel is self._exact_pair_kernel:
+            count = len(state.core_temp[index])
+            self._profiler.count("thermal_pairs", count * (count - 1))
+        if self._thermal_tolerance > 0:
+            def step(core: np.ndarray, time_step_size: float) -> np.ndarray:
+                return thermal.simple_thermal_step(
+                    state,
+                    self._grid_size,
+                    time_step_size,
+                    self._ambient_air_temp,
+                    self._air_conductivity,
+                    self._pair_kernel,
+                    index,
+                    core,
+                )
+            new_core = self.integrate_thermal(step, state.core_temp[index])
+        else:
+            new_core = thermal.simple_thermal_step(
+                state,
+                self._grid_size,
+                self._time_step_size,
+                self._ambient_air_temp,
+                self._air_conductivity,
+                self._pair_kernel,
+                index,
+            )
+        # Each body is a uniform diamond at the core temperature
+        state.body_temp[index] = new_core[:, None, None]
+        state.kill_out_of_range()
+
+    def report_pair_error(self) -> float:
+        """Compare the configured pairwise kernel against the exact sum
+
+        The error is logged in W, relative to the largest exact heat flow
+        and as the core temperature error it causes in one time step.
+
+        Returns
+        -------
+        float
+            Maximum error relative to the largest exact heat flow.
+        """
+        state = self._state
+        area = self._grid_size * thermal.CELL_DEPTH
+        args = (
+            state.rows,
+            state.cols,
+            state.body_radius,
+            state.core_temp,
+            state.insulation_thickness / (state.external_conductivity * area),
+            1 / (self._air_conductivity * area),
+            self._grid_size,
+        )
+        approximate = self._pair_kernel(*args)
+        exact = self._exact_pair_kernel(*args)
+        error = thermal.heat_flow_error(approximate, exact)
+        capacity = (state.density * pow(self._grid_size, 2) *
+                    thermal.CELL_DEPTH * thermal.PENGUIN_SPECIFIC_HEAT)
+        temp_error = np.max(
+            np.abs(approximate - exact) / capacity) * self._time_step_size
+        self._pair_errors.append((self._epoch, error))
+        LOG.info(f"Pairwise heat exchange error at epoch {self._epoch}: "
+                 f"{np.max(np.abs(approximate - exact)):.3e} W, "
+                 f"{error:.3e} relative, {temp_error:.3e} degrees per step")
+        return error
+
+    def report_precision_error(self, fields: thermal.GridFields) -> float:
+        """Compare a step of the grid model against a step in float64
+
+        Both steps start from the current map, the float64 step from the
+        fields cast up. The error is logged in degrees and relative to the
+        largest change the float64 step makes. A warning is logged when the
+        map lost the change of some cells to rounding.
+
+        Parameters
+        ----------
+        fields : GridFields
+            Fields of the current rasterization.
+
+        Returns
+        -------
+        float
+            Maximum error of the step in degrees C.
+        """
+        args = (
+            self._grid_size,
+            self._time_step_size,
+            self._ambient_air_temp,
+            self._air_conductivity,
+            self._thermal_integrator,
+            self._backend.apply_operator,
+        )
+        start = self._thermal_map
+        reference = thermal.grid_step(
+            start,
+            thermal.GridFields(fields.material, fields.agent_id,
+                               *(field.astype(float)
+                                 for field in fields[2:])),
+            *args,
+        )
+        approximate = thermal.grid_step(start, fields, *args)
+        error = float(np.max(np.abs(approximate - reference)))
+        change = float(np.max(np.abs(reference - start)))
+        self._precision_errors.append((self._epoch, error))
+        LOG.info(f"{self._field_dtype.name} grid error at epoch "
+                 f"{self._epoch}: {error:.3e} degrees per step, "
+                 f"{error / change if change > 0 else 0.0:.3e} relative to "
+                 f"the largest change")
+        rounded = np.count_nonzero((approximate == start)
+                                   & (reference != start))
+        if rounded > 0:
+            LOG.warning(f"{rounded} cells of the {start.dtype.name} map lost "
+                        f"their change at epoch {self._epoch} to rounding")
+        return error
+
     def update_thermal(self) -> None:
         """Update the thermals of the environment.
 
@@ -203,251 +1131,292 @@ class Environment:
         calculating the body temperature of each agent, and anything
         else included in the thermal model.
         """
+        if self._thermal_grid is not None:
+            self.update_two_level_thermal()
+            return
+        if self._active_tiles is not None:
+            self._profiler.count(
+                "active_tiles",
+                self._active_tiles.step(self._state, self._time_step_size))
+            return
+        if self._thermal_strips is not None:
+            self._thermal_strips.step(self._state, self._time_step_size)
+            self._thermal_map = self._thermal_strips.thermal_map
+            return
+        state = self._state
         prev_material_map = self._material_map
-        """Update Maps"""
-        agent_id = np.full(shape=self._env_size, fill_value=-1, dtype=int)
-        heat_capacity = np.full(shape=self._env_size,
-                                fill_value=(1.657 * pow(self._grid_size, 2) *
-                                            1.1 * 0.716E3),
-                                dtype=float)
-        self._material_map = np.zeros(shape=self._env_size, dtype=float)
-        for n in range(len(self._agents)):
-            if (self._agents[n].alive):
-                pos = self._agents[n].position
-                for i in range(self._agents[n]._body_radius):
-                    for j in range(self._agents[n]._body_radius - i):
-                        """Material Map"""
-                        if (i == 0 and j == 0):
-                            self._material_map[pos[0], pos[1]] = 1
-                        elif (i == self._agents[n]._body_radius - 1
-                              or j == self._agents[n]._body_radius - 1):
-                            self._material_map[pos[0] + i, pos[1] + j] = 3
-                            self._material_map[pos[0] + i, pos[1] - j] = 3
-                            self._material_map[pos[0] - i, pos[1] + j] = 3
-                            self._material_map[pos[0] - i, pos[1] - j] = 3
-                        else:
-                            self._material_map[pos[0] + i, pos[1] + j] = 2
-                            self._material_map[pos[0] + i, pos[1] - j] = 2
-                            self._material_map[pos[0] - i, pos[1] + j] = 2
-                            self._material_map[pos[0] - i, pos[1] - j] = 2
-                        """Specific Heat Capacity Map"""
-                        heat_capacity[pos[0] + i,
-                                      pos[1] + j] = (self._agents[n]._density *
-                                                     pow(self._grid_size, 2) *
-                                                     1.1 * 3E3)
-                        heat_capacity[pos[0] + i,
-                                      pos[1] - j] = (self._agents[n]._density *
-                                                     pow(self._grid_size, 2) *
-                                                     1.1 * 3E3)
-                        heat_capacity[pos[0] - i,
-                                      pos[1] + j] = (self._agents[n]._density *
-                                                     pow(self._grid_size, 2) *
-                                                     1.1 * 3E3)
-                        heat_capacity[pos[0] - i,
-                                      pos[1] - j] = (self._agents[n]._density *
-                                                     pow(self._grid_size, 2) *
-                                                     1.1 * 3E3)
-                        """Thermal/Temperature Map"""
-                        self._thermal_map[pos[0] + i, pos[1] +
-                                          j] = self._agents[n].body_temp[
-                                              self._agents[n].body_radius - 1 +
-                                              i][self._agents[n].body_radius -
-                                                 1 + j]
-                        self._thermal_map[pos[0] + i, pos[1] -
-                                          j] = self._agents[n].body_temp[
-                                              self._agents[n].body_radius - 1 +
-                                              i][self._agents[n].body_radius -
-                                                 1 - j]
-                        self._thermal_map[pos[0] - i, pos[1] +
-                                          j] = self._agents[n].body_temp[
-                                              self._agents[n].body_radius - 1 -
-                                              i][self._agents[n].body_radius -
-                                                 1 + j]
-                        self._thermal_map[pos[0] - i, pos[1] -
-                                          j] = self._agents[n].body_temp[
-                                              self._agents[n].body_radius - 1 -
-                                              i][self._agents[n].body_radius -
-                                                 1 - j]
-                        """Agent ID Map"""
-                        agent_id[pos[0] + i, pos[1] + j] = n
-                        agent_id[pos[0] + i, pos[1] - j] = n
-                        agent_id[pos[0] - i, pos[1] + j] = n
-                        agent_id[pos[0] - i, pos[1] - j] = n
-        """Fill Air Gaps"""
-        for i in range(self._env_size[0]):
-            for j in range(self._env_size[1]):
-                if (self._material_map[i][j] == 0.0
-                        and prev_material_map[i][j] > 0):
-                    self._thermal_map[i][j] = self._ambient_air_temp
-        """Compute Heat Exchange Map"""
-        heat_exchange = np.zeros(shape=self._env_size, dtype=float)
-        for i in range(self._env_size[0]):
-            for j in range(self._env_size[1]):
-                """Environmental Cooling and Heat Generation"""
-                if(self._material_map[i][j] == 0):
-                    heat_exchange[i][j] += self._air_conductivity*4*self._grid_size*1.1*(self._ambient_air_temp-self._thermal_map[i][j])
-                    
-                elif(self._material_map[i][j] == 1):
-                    heat_exchange[i][j] += self._agents[agent_id[i][j]]._metabolism*pow(self._grid_size,2)*1.1
-
-
-                """Neighborhood Heat Exchange"""
-                if (i > 0):
-                    heat_res = 0
-                    """Agent"""
-                    if(self._material_map[i][j] == 0):
-                        heat_res += 1/(self._air_conductivity *
-                                       self._grid_size*1.1)
-                    elif(self._material_map[i][j] > 0):
-                        heat_res += 1/(self._agents[agent_id[i][j]]._internal_conductivity*self._grid_size*1.1/(self._grid_size/2))
-                        if(self._material_map[i][j] == 3 and (self._material_map[i-1][j] > 2 or self._material_map[i-1][j] < 1)):
-                            heat_res += 1/(self._agents[agent_id[i][j]]._external_conductivity*self._grid_size*1.1/(self._agents[agent_id[i][j]]._insulation_thickness))
-                    """Adjacent"""
-                    if(self._material_map[i-1][j] == 0):
-                        heat_res += 1/(self._air_conductivity *
-                                       self._grid_size*1.1)
-                    elif(self._material_map[i-1][j] > 0):
-                        heat_res += 1/(self._agents[agent_id[i-1][j]]._internal_conductivity*self._grid_size*1.1/(self._grid_size/2))
-                        if(self._material_map[i-1][j] == 3 and (self._material_map[i][j] > 2 or self._material_map[i][j] < 1)):
-                            heat_res += 1/(self._agents[agent_id[i-1][j]]._external_conductivity*self._grid_size*1.1/(self._agents[agent_id[i-1][j]]._insulation_thickness))
-                            
-                    heat_exchange[i][j] += ((1/heat_res) *
-                                            (self._thermal_map[i-1][j]-self._thermal_map[i][j]))
-
-                if(j > 0):
-                    heat_res = 0
-                    """Agent"""
-                    if(self._material_map[i][j] == 0):
-                        heat_res += 1/(self._air_conductivity *
-                                       self._grid_size*1.1)
-                    elif(self._material_map[i][j] > 0):
-                        heat_res += 1/(self._agents[agent_id[i][j]]._internal_conductivity*self._grid_size*1.1/(self._grid_size/2))
-                        if(self._material_map[i][j] == 3 and (self._material_map[i][j-1] > 2 or self._material_map[i][j-1] < 1)):
-                            heat_res += 1/(self._agents[agent_id[i][j]]._external_conductivity*self._grid_size*1.1/(self._agents[agent_id[i][j]]._insulation_thickness))
-                    """Adjacent"""
-                    if(self._material_map[i][j-1] == 0):
-                        heat_res += 1/(self._air_conductivity *
-                                       self._grid_size*1.1)
-                    elif(self._material_map[i][j-1] > 0):
-                        heat_res += 1/(self._agents[agent_id[i-1][j]]._internal_conductivity*self._grid_size*1.1/(self._grid_size/2))
-                        if(self._material_map[i][j-1] == 3 and (self._material_map[i][j] > 2 or self._material_map[i][j] < 1)):
-                            heat_res += 1/(self._agents[agent_id[i][j-1]]._external_conductivity*self._grid_size*1.1/(self._agents[agent_id[i][j-1]]._insulation_thickness))
-                            
-                    heat_exchange[i][j] += ((1/heat_res)*(self._thermal_map[i]
-                                            [j-1]-self._thermal_map[i][j]))
-
-                if(i < self._env_size[0]-1):
-                    heat_res = 0
-                    """Agent"""
-                    if(self._material_map[i][j] == 0):
-                        heat_res += 1/(self._air_conductivity *
-                                      self._grid_size*1.1)
-                    elif(self._material_map[i][j] > 0):
-                        heat_res += 1/(self._agents[agent_id[i][j]]._internal_conductivity*self._grid_size*1.1/(self._grid_size/2))
-                        if(self._material_map[i][j] == 3 and (self._material_map[i+1][j] > 2 or self._material_map[i+1][j] < 1)):
-                            heat_res += 1/(self._agents[agent_id[i][j]]._external_conductivity*self._grid_size*1.1/(self._agents[agent_id[i][j]]._insulation_thickness))
-                    """Adjacent"""
-                    if(self._material_map[i+1][j] == 0):
-                        heat_res += 1/(self._air_conductivity *
-                                       self._grid_size*1.1)
-                    elif(self._material_map[i+1][j] > 0):
-                        heat_res += 1/(self._agents[agent_id[i+1][j]]._internal_conductivity*self._grid_size*1.1/(self._grid_size/2))
-                        if(self._material_map[i+1][j] == 3 and (self._material_map[i][j] > 2 or self._material_map[i][j] < 1)):
-                            heat_res += 1/(self._agents[agent_id[i+1][j]]._external_conductivity*self._grid_size*1.1/(self._agents[agent_id[i+1][j]]._insulation_thickness))
-                    
-                    heat_exchange[i][j] += ((1/heat_res) *
-                                            (self._thermal_map[i+1][j]-self._thermal_map[i][j]))
-
-                if(j < self._env_size[1]-1):
-                    heat_res = 0
-                    """Agent"""
-                    if(self._material_map[i][j] == 0):
-                        heat_res += 1/(self._air_conductivity *
-                                       self._grid_size*1.1)
-                    elif(self._material_map[i][j] > 0):
-                        heat_res += 1/(self._agents[agent_id[i][j]]._internal_conductivity*self._grid_size*1.1/(self._grid_size/2))
-                        if(self._material_map[i][j] == 3 and (self._material_map[i][j+1] > 2 or self._material_map[i][j+1] < 1)):
-                            heat_res += 1/(self._agents[agent_id[i][j]]._external_conductivity*self._grid_size*1.1/(self._agents[agent_id[i][j]]._insulation_thickness))
-                    """Adjacent"""
-                    if(self._material_map[i][j+1] == 0):
-                        heat_res += 1/(self._air_conductivity *
-                                       self._grid_size*1.1)
-                    elif(self._material_map[i][j+1] > 0):
-                        heat_res += 1/(self._agents[agent_id[i][j+1]]._internal_conductivity*self._grid_size*1.1/(self._grid_size/2))
-                        if(self._material_map[i][j+1] == 3 and (self._material_map[i][j] > 2 or self._material_map[i][j] < 1)):
-                            heat_res += 1/(self._agents[agent_id[i][j+1]]._external_conductivity*self._grid_size*1.1/(self._agents[agent_id[i][j+1]]._insulation_thickness))
-                    
-                    heat_exchange[i][j] += ((1/heat_res)*(self._thermal_map[i]
-                                            [j+1]-self._thermal_map[i][j]))
-
-
-        """Update Thermal Map"""
-        self._thermal_map += ((heat_exchange / heat_capacity) *
-                              self._time_step_size)
-        """Update Agent Temps"""
-        for agent in self._agents:
-            if (agent.alive):
-                new_body_temp = np.zeros(shape=(2 * agent.body_radius - 1,
-                                                2 * agent.body_radius - 1),
-                                         dtype=float)
-                pos = agent.position
-                for i in range(agent.body_radius):
-                    for j in range(agent.body_radius - i):
-                        new_body_temp[agent.body_radius - 1 + i,
-                                      agent.body_radius - 1 +
-                                      j] = self._thermal_map[pos[0] + i,
-                                                             pos[1] + j]
-                        new_body_temp[agent.body_radius - 1 + i,
-                                      agent.body_radius - 1 -
-                                      j] = self._thermal_map[pos[0] + i,
-                                                             pos[1] - j]
-                        new_body_temp[agent.body_radius - 1 - i,
-                                      agent.body_radius - 1 +
-                                      j] = self._thermal_map[pos[0] - i,
-                                                             pos[1] + j]
-                        new_body_temp[agent.body_radius - 1 - i,
-                                      agent.body_radius - 1 -
-                                      j] = self._thermal_map[pos[0] - i,
-                                                             pos[1] - j]
-                agent.body_temp = new_body_temp
+        fields = thermal.rasterize(state, self._thermal_map, self._grid_size,
+                                   self._air_conductivity,
+                                   dtype=self._field_dtype)
+        self._material_map = fields.material
+        # Cells vacated by a penguin are refilled with ambient air
+        self._thermal_map[(self._material_map == thermal.AIR)
+                          & (prev_material_map > 0)] = self._ambient_air_temp
+        if (self._field_dtype != np.float64
+                and self._precision_error_interval > 0
+                and self._epoch % self._precision_error_interval == 0):
+            self.report_precision_error(fields)
+        if self._thermal_tolerance > 0:
+            operator = thermal.grid_operator(fields, self._grid_size,
+                                             self._ambient_air_temp,
+                                             self._air_conductivity)
+            self._thermal_map = self.integrate_thermal(
+                functools.partial(thermal.advance_grid, operator,
+                                  fields.heat_capacity,
+                                  integrator=self._thermal_integrator,
+                                  heat_flow=self._backend.apply_operator),
+                self._thermal_map,
+                self.max_grid_step(),
+            )
+        else:
+            self._thermal_map = thermal.grid_step(
+                self._thermal_map,
+                fields,
+                self._grid_size,
+                self._time_step_size,
+                self._ambient_air_temp,
+                self._air_conductivity,
+                self._thermal_integrator,
+                self._backend.apply_operator,
+            )
+        thermal.gather_body_temps(state, self._thermal_map)
+
+    def update_two_level_thermal(self) -> None:
+        """Update the thermals on the two-level grid
+
+        The fine window first follows the colony, then both levels advance
+        together, see refinement.TwoLevelGrid.
+        """
+        state = self._state
+        grid = self._thermal_grid
+        grid.follow(state)
+        fields = grid.rasterize(state)
+        operator, capacity = grid.operator(fields)
+        self._profiler.count("fine_cells", grid.fine_cells)
+        step = functools.partial(thermal.advance_two_level, operator,
+                                 capacity,
+                                 integrator=self._thermal_integrator)
+        if self._thermal_tolerance > 0:
+            values = self.integrate_thermal(step, grid.pack(),
+                                            self.max_grid_step())
+        else:
+            values = step(grid.pack(), self._time_step_size)
+        grid.unpack(values)
+        grid.gather(state)
+
+    def max_grid_step(self) -> float:
+        """Get the longest sub-step of the grid model integrator
+
+        Returns
+        -------
+        float
+            Stability limit of the explicit integrator in s, infinite for
+            the others.
+        """
+        if self._thermal_integrator != "explicit":
+            return np.inf
+        state = self._state
+        return thermal.explicit_time_step_limit(
+            self._grid_size,
+            self._air_conductivity,
+            state.internal_conductivity.max(),
+            state.density.min(),
+        )
+
+    def integrate_thermal(self, step: Callable, values: np.ndarray,
+                          max_step: float = np.inf) -> np.ndarray:
+        """Advance the temperatures by one epoch in adaptive sub-steps
+
+        The positions are held for the whole epoch. The trial length of the
+        first sub-step is the last one of the previous epoch, see
+        thermal.integrate_adaptive.
+
+        Parameters
+        ----------
+        step : Callable
+            ``step(values, h)`` advancing the temperatures by ``h`` s.
+        values : np.ndarray[float]
+            Temperatures at the start of the epoch.
+        max_step : float
+            Longest sub-step in s, the stability limit of the integrator.
+
+        Returns
+        -------
+        np.ndarray[float]
+            Temperatures at the end of the epoch.
+        """
+        values, self._thermal_substep, accepted, rejected = (
+            thermal.integrate_adaptive(step, values, self._time_step_size,
+                                       self._thermal_tolerance,
+                                       self._thermal_substep, max_step))
+        self._profiler.count("thermal_substeps", accepted)
+        self._profiler.count("rejected_substeps", rejected)
+        return values
 
     def run_epoch(self):
-        """Run one epoch"""
+        """Run one epoch
+
+        Agents move one at a time in a shuffled order. With the sequential
+        movement update every agent senses the positions left by the agents
+        before it. With the synchronous update all moves are proposed in one
+        batch from the positions at the start of the epoch. Epochs without
+        a movement pass hold every position, see movement_due.
+        """
         self._epoch += 1
-        random.shuffle(self._agents)
-        for agent in self._agents:
-            neighbors = self.get_neighbors(agent)
-            pos = agent.position
-            size = agent.body_radius - 1
-            thermal_points = {
-                "up": self._thermal_map[pos[0] - size, pos[1]],
-                "down": self._thermal_map[pos[0] + size, pos[1]],
-                "left": self._thermal_map[pos[0], pos[1] - size],
-                "right": self._thermal_map[pos[0], pos[1] + size],
-            }
-            move = agent.get_move(neighbors, thermal_points)
-            old_position = agent.position
-            agent.position = move
-            if self.check_valid_pos(agent, move[0], move[1]):
-                LOG.debug(f"Moving agent: {agent.position} -> {move}")
+        if self.movement_due():
+            self._movement_epoch = self._epoch
+            random.shuffle(self._order)
+            self.update_rank()
+            if self._movement_update == "synchronous":
+                proposals = self._propose_moves(np.asarray(self._order))
+                for index, move in zip(self._order, proposals):
+                    self._commit_move(index, move)
             else:
-                LOG.debug(f"Move invalid: {agent.position} -> {move}")
-                agent.position = old_position
+                for index in self._order:
+                    move = self._propose_moves(np.array([index]))[0]
+                    self._commit_move(index, move)
+        else:
+            self._profiler.count("skipped_movement")
         self.draw()
 
+    def movement_due(self) -> bool:
+        """Check whether the epoch being run has a movement pass
+
+        A pass is due every movement_interval epochs, or as soon as an agent
+        changed its movement band or died since the last pass. The band is
+        cold below the low move threshold, hot above the high move threshold
+        and comfortable in between. Between passes the bands are the only
+        input of the movement policy that depends on the thermal update.
+
+        Returns
+        -------
+        bool
+            Whether the agents move this epoch.
+        """
+        if self._movement_interval <= 1:
+            return True
+        state = self._state
+        core = state.core_temp
+        bands = ((core >= state.low_move_threshold).astype(int) +
+                 (core > state.high_move_threshold))
+        bands[~state.alive] = -1
+        due = (self._movement_bands is None
+               or self._epoch - self._movement_epoch >= self._movement_interval
+               or not np.array_equal(bands, self._movement_bands))
+        if due:
+            self._movement_bands = bands
+        return due
+
+    def _propose_moves(self, indices: np.ndarray) -> np.ndarray:
+        """Propose the next position of a batch of agents.
+
+        Parameters
+        ----------
+        indices : np.ndarray[int]
+            Agents of the batch, in update order.
+
+        Returns
+        -------
+        np.ndarray[int]
+            Proposed positions in the form (B, 2).
+        """
+        state = self._state
+        positions = state.positions[indices]
+        with self._profiler.phase("neighbor_query"):
+            neighbors = [
+                self.neighbor_indices(row, col, index)
+                for index, (row, col) in zip(indices, positions)
+            ]
+        with self._profiler.phase("get_move"):
+            segment = np.repeat(np.arange(len(indices)),
+                                [len(found) for found in neighbors])
+            found = (np.concatenate(neighbors)
+                     if neighbors else np.zeros(0, int))
+            return policy.propose_moves(
+                positions,
+                state.core_temp[indices],
+                state.low_move_threshold[indices],
+                state.high_move_threshold[indices],
+                state.movement_speed[indices],
+                state.movement_policy[indices],
+                state.positions[found] - positions[segment],
+                segment,
+                policy.draw_jitter(len(indices)),
+                self._backend.greedy_step,
+            )
+
+    def _commit_move(self, index: int, move: np.ndarray) -> bool:
+        """Move an agent if the new position is valid.
+
+        Returns
+        -------
+        bool
+            Whether the agent moved.
+        """
+        old_position = self._state.positions[index].copy()
+        self._profiler.count("collision_checks")
+        with self._profiler.phase("validity_check"):
+            valid = self.check_valid_pos(self._agents[index], move[0],
+                                         move[1])
+        if valid:
+            LOG.debug(f"Moving agent: {old_position} -> {move}")
+            self._state.positions[index] = move
+            self._spatial.move(index, old_position, move)
+            self._occupancy.move(index, old_position, move)
+            return True
+        LOG.debug(f"Move invalid: {old_position} -> {move}")
+        self._profiler.count("rejected_moves")
+        return False
+
+    def neighbor_indices(self, row: int, col: int,
+                         exclude: int = -1) -> np.ndarray:
+        """Get the indices of the agents sensing a position
+
+        Only the spatial hash buckets around the position are visited, and
+        the distance to every agent in them counts as one distance
+        evaluation.
+
+        Parameters
+        ----------
+        row, col : int
+            Position to query.
+        exclude : int
+            Agent index to leave out, usually the agent at the position.
+
+        Returns
+        -------
+        np.ndarray[int]
+            Alive agents within their sense radius of the position, in the
+            current shuffled update order.
+        """
+        if self._spatial is None:
+            return np.zeros(shape=0, dtype=int)
+        state = self._state
+        found = self._spatial.candidates(row, col,
+                                         self._max_sense_radius - 1)
+        self._profiler.count("distance_evaluations", len(found))
+        found = self._backend.sense_filter(found, state.rows, state.cols,
+                                           state.sense_radius, state.alive,
+                                           row, col, exclude)
+        if len(self._rank) != len(state):
+            self.update_rank()
+        return found[np.argsort(self._rank[found])]
+
     def get_neighbors(self, test_agent: Agent) -> list[Agent]:
         """Get a list of neighbors in the sense radius"""
-        neighbors = list()
-        for agent in self._agents:
-            if agent is test_agent:
-                continue
-            dist = self.manhatten_distance(test_agent, agent)
-            if dist < agent.sense_radius and agent.alive:
-                neighbors.append(agent)
-        return neighbors
+        row, col = test_agent.position
+        exclude = test_agent.index if test_agent.state is self._state else -1
+        return [
+            self._agents[i]
+            for i in self.neighbor_indices(row, col, exclude)
+        ]
 
     def check_valid_pos(self, agent: Agent, row: int, col: int) -> bool:
-        """Check if a new position is valid for an agent"""
+        """Check if a new position is valid for an agent
+
+        Collisions are found by reading the occupancy grid under the
+        footprint the agent would cover.
+        """
         # Check bounds of environment
         if (row < agent.body_radius - 1) or (
                 row > self.env_size[0] - agent.body_radius):
@@ -455,125 +1424,91 @@ class Environment:
         if (col < agent.body_radius - 1) or (
                 col > self.env_size[1] - agent.body_radius):
             return False
-        for curr_agent in self._agents:
-            if (curr_agent is not agent) and agent.is_collision(curr_agent):
-                return False
-        return True
+        ignore = agent.index if agent.state is self._state else -1
+        return self._occupancy.is_free(row, col, agent.body_radius, ignore)
 
     def manhatten_distance(self, agent1: Agent, agent2: Agent) -> int:
         """Calculate manhatten distance between two agents"""
-        return (abs(agent1.position[0] - agent2.position[0]) +
-                abs(agent1.position[1] - agent2.position[1]))
+        state = self._state
+        return (abs(state.rows[agent1.index] - state.rows[agent2.index]) +
+                abs(state.cols[agent1.index] - state.cols[agent2.index]))
 
     def add_agent(self, agent: Agent) -> bool:
-        """Add agent if no collisions"""
+        """Add agent if no collisions
+
+        The agent is adopted into the environment SwarmState and stays a view
+        onto its row there.
+        """
         if self.check_valid_pos(agent, agent.position[0], agent.position[1]):
+            index = self._state.adopt(agent)
             self._agents.append(agent)
+            self._order.append(index)
+            if self._spatial is None:
+                self._spatial = SpatialHash(self._state, self._env_size,
+                                            agent.sense_radius)
+            self._spatial.insert(index)
+            self._occupancy.stamp(index)
+            self._max_sense_radius = max(self._max_sense_radius,
+                                         agent.sense_radius)
             LOG.debug(f"Added agent number {len(self._agents)} at"
                       f"pos {agent.position}")
             return True
         return False
 
     def draw(self) -> None:
-        """Draw the environment and save it as a PNG"""
+        """Rasterize the environment and queue it for the GIF encoder
+
+        Frames are encoded on a background thread, see FramePipeline.
+        """
         if not self._make_gif:
             return
-        LOG.debug("Drawing env")
-        self._drawing_env = np.ones(
-            shape=(self.env_size[0], self.env_size[1], 3),
-            dtype=float,
-        )
-        #self.draw_map()
-        for agent in self._agents:
-            if agent.alive:
-                self.draw_agent(agent)
-        fig, axis = plt.subplots()
-        axis.imshow(self._drawing_env)
-        axis.axis("off")
-        axis.set_title(f"{self._name}\n" f"epoch {self._epoch:06d}")
-        img_path = self._gif_img_dir.joinpath(f"epoch_{self._epoch:010d}.png")
-        fig.savefig(img_path)
-        fig.clf()
-        plt.close()
-
-    def draw_agent(self, agent):
-        """Draw an agent in the environment"""
-        pos = agent.position
-        for i in range(agent.body_radius):
-            for j in range(agent.body_radius - i):
-                self._drawing_env[pos[0] + i, pos[1] + j] = agent.color
-                self._drawing_env[pos[0] + i, pos[1] - j] = agent.color
-                self._drawing_env[pos[0] - i, pos[1] + j] = agent.color
-                self._drawing_env[pos[0] - i, pos[1] - j] = agent.color
-
-    def draw_map(self):
-        normalized_temp = (self._thermal_map - self._ambient_air_temp) / \
-            (self._agents[0]._high_death_threshold - self._initial_air_temp)
-        normalized_temp = np.clip(0.5 - 0.5 * normalized_temp, 0.0, 0.5)
-        for i in range(self._env_size[0]):
-            for j in range(self.env_size[1]):
-                self._drawing_env[i, j] = np.array(
-                    colorsys.hsv_to_rgb(normalized_temp[i, j], 0.25, 1.0))
+        with self._profiler.phase("draw"):
+            LOG.debug("Drawing env")
+            if self._gif_pipeline is None:
+                self._renderer = Renderer(
+                    self._env_size,
+                    self._state.low_death_threshold[0],
+                    self._state.high_death_threshold[0],
+                    self._ambient_air_temp,
+                    self._initial_air_temp,
+                    self._gif_scale,
+                )
+                self._gif_pipeline = FramePipeline(
+                    self._renderer,
+                    self._image_dir.joinpath(self._gif_name),
+                    self._gif_queue_size,
+                )
+            self._gif_pipeline.submit(
+                self._renderer.rasterize(
+                    self._state,
+                    self.thermal_map if self._draw_map else None,
+                ),
+                f"{self._name}\nepoch {self._epoch:06d}",
+            )
 
     def plot_vs_epoch(self):
-        fig, survive_axis = plt.subplots()
-
-        survive_axis.plot(
+        """Plot the surviving portion and mean core temperature vs epoch"""
+        plot_vs_epoch(
+            self._image_dir.joinpath(f"{self._file_name}_plot_vs_epoch.png"),
+            self._name,
             self._epochs_plot,
             self._alive_agents_plot,
-            label=f"{self._name}",
-            color="blue",
-        )
-        survive_axis.set_xlabel("Epoch")
-        survive_axis.set_xlim([0, len(self._epochs_plot)])
-        survive_axis.set_ylim([0.0, 1.1])
-        survive_axis.set_ylabel("Portion Surviving Penguins",
-                                color="blue")
-
-
-        temp_axis = survive_axis.twinx()
-        temp_axis.plot(
-            self._epochs_plot,
             self._temps_plot,
-            label=f"{self._name}",
-            color="red"
-            )
-        temp_axis.errorbar(
             self._temps_error_x,
             self._temps_error_y,
-            yerr = self._temps_error_std,
-            label = f"{self._name}",
-            color = "red",
+            self._temps_error_std,
+            (self._state.low_death_threshold[0],
+             self._state.high_death_threshold[0]),
+            self._converged_epoch,
+            self._fast_forwards,
         )
-        temp_axis.set_ylim([self._agents[0]._low_death_threshold,
-                            self._agents[0]._high_death_threshold])
-        temp_axis.set_ylabel(r"Average Core Temperature ($\degree$C)",
-                             color="red")
-
-        fig.suptitle("Colony Health vs Epoch")
-        img_path = self._image_dir.joinpath(
-            f"{self._file_name}_plot_vs_epoch.png")
-        fig.savefig(img_path)
-        fig.clf()
-        plt.close()
 
     def save_gif(self) -> None:
-        """Save the GIF"""
-        if not self._make_gif:
+        """Finish the GIF and stop the background encoder"""
+        if self._gif_pipeline is None:
             return
-        LOG.info("Generating GIF...")
-        images = []
-        for path in sorted(list(self._gif_img_dir.iterdir())):
-            LOG.debug(f"Adding {path}")
-            image = Image.open(path)
-            images.append(image.copy())
-            image.close()
-        gif_path = self._image_dir.joinpath(f"{self._file_name}.gif")
-        images[0].save(
-            gif_path,
-            save_all=True,
-            duration=100,
-            append_images=images[1:],
-            loop=0,
-        )
+        LOG.info("Finishing GIF...")
+        pipeline, self._gif_pipeline = self._gif_pipeline, None
+        pipeline.close()
+        gif_path = self._image_dir.joinpath(self._gif_name)
         LOG.info(f"A GIF of the simulation has been saved in:\n{gif_path}")
@@ -6,14 +6,21 @@
 import argparse
 import configparser
 import logging
+import multiprocessing
 import random
 import pathlib
 import shutil
 # Packages
 import coloredlogs
+import numpy as np
 # Custom
+from ensemble import Ensemble
 from environment import Environment
 from penguin import Penguin
+import backend
+import convergence
+import policy
+import thermal
 
 ###############################################################################
 # Constant definitions
@@ -78,6 +85,19 @@ def parse_args(arg_list: list[str] = None):
         choices=range(1, 6),
         default=2,
     )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        help="Seed for reproducible runs, unseeded if omitted",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        help="Continue from the last checkpoint instead of starting over",
+        action="store_true",
+    )
     return parser.parse_args(args=arg_list)
 
 
@@ -113,33 +133,252 @@ def parse_config(config_file: str) -> configparser.ConfigParser:
 ###############################################################################
 
 
-def main(config_file: str, log_level: int) -> int:
-    """Main function
+def validate_config(config: configparser.ConfigParser) -> bool:
+    """Check the option values of a parsed config
 
     Parameters
     ----------
-    TODO
+    config : configparser.ConfigParser
+        Config returned by parse_config
+
+    Returns
+    -------
+    bool
+        Whether the config can be simulated
     """
-    coloredlogs.install(
-        level=log_level * 10,
-        logger=LOG,
-        milliseconds=True,
-    )
+    thermal_model = config["env"].get("thermal_model", "simple")
+    if thermal_model not in Environment.THERMAL_MODELS:
+        LOG.error(f"Unknown thermal model {thermal_model}")
+        return False
+    thermal_integrator = config["env"].get("thermal_integrator", "explicit")
+    if thermal_integrator not in thermal.INTEGRATORS:
+        LOG.error(f"Unknown thermal integrator {thermal_integrator}")
+        return False
+    movement_update = config["env"].get("movement_update", "sequential")
+    if movement_update not in Environment.MOVEMENT_UPDATES:
+        LOG.error(f"Unknown movement update {movement_update}")
+        return False
+    if config["penguin"]["movement_policy"] not in policy.POLICIES:
+        LOG.error("Unknown movement policy "
+                  f"{config['penguin']['movement_policy']}")
+        return False
+    if config["general"].get("backend", "numpy") not in backend.BACKENDS:
+        LOG.error(f"Unknown backend {config['general']['backend']}")
+        return False
+    pair_approximation = config["env"].get("pair_approximation", "exact")
+    if pair_approximation not in Environment.PAIR_APPROXIMATIONS:
+        LOG.error(f"Unknown pair approximation {pair_approximation}")
+        return False
+    pm_cell_size = config["env"].getint("pm_cell_size", 8)
+    pm_cutoff = config["env"].getint("pm_cutoff", 32)
+    if pair_approximation == "pm" and pm_cutoff < 2 * pm_cell_size:
+        LOG.warning("pm_cutoff is below twice pm_cell_size, the "
+                    "particle-mesh error will be large")
+    convergence_window = config["env"].getint("convergence_window", 0)
+    if convergence_window < 0:
+        LOG.error("convergence_window must be at least 0, not "
+                  f"{convergence_window}")
+        return False
+    convergence_action = config["env"].get("convergence_action", "stop")
+    if convergence_action not in convergence.ACTIONS:
+        LOG.error(f"Unknown convergence action {convergence_action}")
+        return False
+    if (convergence_action == "fast_forward" and convergence_window > 0
+            and (thermal_model != "simple" or pair_approximation != "exact")):
+        LOG.error("Fast-forwarding needs the simple thermal model and the "
+                  "exact pair approximation")
+        return False
+    thermal_tolerance = config["env"].getfloat("thermal_tolerance", 0.0)
+    if thermal_tolerance < 0:
+        LOG.error("thermal_tolerance must be at least 0, not "
+                  f"{thermal_tolerance}")
+        return False
+    movement_interval = config["env"].getint("movement_interval", 1)
+    if movement_interval < 1:
+        LOG.error("movement_interval must be at least 1, not "
+                  f"{movement_interval}")
+        return False
+    thermal_tile = config["env"].getint("thermal_tile", 0)
+    if thermal_tile < 0:
+        LOG.error(f"thermal_tile must be at least 0, not {thermal_tile}")
+        return False
+    refine_margin = config["env"].getint("refine_margin", 16)
+    if thermal_tile > 0 and thermal_model != "grid":
+        LOG.warning("thermal_tile only applies to the grid thermal model")
+    elif thermal_tile > 0:
+        if thermal_integrator not in thermal.TWO_LEVEL_INTEGRATORS:
+            LOG.error("The two-level grid needs the explicit or implicit "
+                      "thermal_integrator")
+            return False
+        movement_speed = int(config["penguin"]["movement_speed"])
+        if refine_margin < movement_speed:
+            LOG.error(f"refine_margin must be at least the movement_speed "
+                      f"of {movement_speed}, not {refine_margin}")
+            return False
+    active_tile = config["env"].getint("active_tile", 0)
+    if active_tile < 0:
+        LOG.error(f"active_tile must be at least 0, not {active_tile}")
+        return False
+    if config["env"].getfloat("active_tolerance", 1E-3) < 0:
+        LOG.error("active_tolerance must be at least 0")
+        return False
+    if active_tile > 0 and thermal_model != "grid":
+        LOG.warning("active_tile only applies to the grid thermal model")
+    elif active_tile > 0:
+        if thermal_integrator != "explicit" or thermal_tolerance > 0:
+            LOG.error("Active tiles need the explicit thermal_integrator "
+                      "without thermal sub-steps")
+            return False
+        if thermal_tile > 0:
+            LOG.error("active_tile and thermal_tile cannot both be set")
+            return False
+    thermal_workers = config["env"].getint("thermal_workers", 0)
+    if thermal_workers < 0:
+        LOG.error(f"thermal_workers must be at least 0, not {thermal_workers}")
+        return False
+    if thermal_workers > 0 and thermal_model != "grid":
+        LOG.warning("thermal_workers only applies to the grid thermal model")
+    elif thermal_workers > 0:
+        if thermal_integrator != "explicit" or thermal_tolerance > 0:
+            LOG.error("Thermal workers need the explicit thermal_integrator "
+                      "without thermal sub-steps")
+            return False
+        if thermal_tile > 0 or active_tile > 0:
+            LOG.error("thermal_workers cannot be set with thermal_tile or "
+                      "active_tile")
+            return False
+        rows = int(config["env"]["env_size"].split(", ")[0])
+        if thermal_workers > rows:
+            LOG.error(f"thermal_workers must be at most the {rows} rows of "
+                      "the environment")
+            return False
+        if thermal_workers > multiprocessing.cpu_count():
+            LOG.warning(f"thermal_workers is above the "
+                        f"{multiprocessing.cpu_count()} cores of this machine")
+    precision = config["env"].get("precision", "float64")
+    if precision not in Environment.PRECISIONS:
+        LOG.error(f"Unknown precision {precision}")
+        return False
+    precision_error_interval = config["env"].getint(
+        "precision_error_interval", 0)
+    if precision_error_interval < 0:
+        LOG.error("precision_error_interval must be at least 0, not "
+                  f"{precision_error_interval}")
+        return False
+    if precision != "float64" and thermal_model != "grid":
+        LOG.warning("precision only applies to the grid thermal model")
+    elif precision != "float64":
+        if thermal_tile > 0:
+            LOG.error(f"The two-level grid cannot run in {precision}")
+            return False
+        if precision_error_interval > 0 and (active_tile > 0
+                                             or thermal_workers > 0):
+            LOG.warning("The precision error is not reported with "
+                        "active_tile or thermal_workers")
+    replicates = config["general"].getint("replicates", 1)
+    if replicates < 1:
+        LOG.error(f"replicates must be at least 1, not {replicates}")
+        return False
+    if replicates > 1:
+        if thermal_model != "simple" or pair_approximation != "exact":
+            LOG.error("Replicate ensembles need the simple thermal model "
+                      "and the exact pair approximation")
+            return False
+        if config["general"]["make_gif"] == "True":
+            LOG.warning("No GIF is made for replicate ensembles")
+        if config["env"].get("prune_dead", "False") == "True":
+            LOG.warning("Dead agents are not pruned in replicate ensembles")
+        if convergence_window > 0:
+            LOG.warning("Replicate ensembles always run every epoch")
+        if thermal_tolerance > 0 or movement_interval > 1:
+            LOG.warning("Replicate ensembles take one thermal step and one "
+                        "movement pass per epoch")
+        if (config["general"].getint("checkpoint_epochs", 0) > 0
+                or config["general"].getfloat("checkpoint_seconds", 0) > 0):
+            LOG.warning("No checkpoint is written for replicate ensembles")
+    confidence = config["general"].getfloat("confidence", 0.95)
+    if not 0 < confidence < 1:
+        LOG.error(f"confidence must be between 0 and 1, not {confidence}")
+        return False
+    if thermal_model == "grid":
+        time_step_limit = thermal.explicit_time_step_limit(
+            float(config["env"]["grid_size"]),
+            float(config["env"]["air_conductivity"]),
+            float(config["penguin"]["internal_conductivity"]),
+            float(config["penguin"]["density"]),
+        )
+        LOG.info(f"Explicit stability limit: {time_step_limit:.4g} s")
+        if (thermal_integrator == "explicit" and thermal_tolerance == 0
+                and float(config["env"]["time_step_size"]) > time_step_limit):
+            LOG.warning("time_step_size is above the explicit stability "
+                        f"limit of {time_step_limit:.4g} s, use the implicit "
+                        "or adi thermal_integrator")
+    return True
 
-    # Parse config file
-    config_file = pathlib.Path(config_file).resolve()
-    config = parse_config(config_file)
-    if config is None:
-        LOG.error("Could not read config file")
-        return 1
-    env_size = tuple(map(int, config["env"]["env_size"].split(", ")))
 
-    # Set up image dir
+def seed_rngs(seed: int) -> None:
+    """Seed the global random and NumPy generators used by the simulation
+
+    Parameters
+    ----------
+    seed : int
+        Seed shared by both generators
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def prepare_image_dir(config: configparser.ConfigParser,
+                      stem: str,
+                      clean: bool = True) -> pathlib.Path:
+    """Create an empty output directory for one config
+
+    Parameters
+    ----------
+    config : configparser.ConfigParser
+        Config holding paths:image_dir
+    stem : str
+        Name of the run directory, usually the config file stem
+    clean : bool
+        Whether to delete the previous outputs, off when resuming
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the run directory
+    """
     image_dir = PROJ_DIR.joinpath(config["paths"]["image_dir"])
     image_dir.mkdir(mode=0o775, exist_ok=True)
-    image_dir = image_dir.joinpath(config_file.stem)
-    shutil.rmtree(image_dir, ignore_errors=True)
+    image_dir = image_dir.joinpath(stem)
+    if clean:
+        shutil.rmtree(image_dir, ignore_errors=True)
     image_dir.mkdir(mode=0o775, exist_ok=True)
+    return image_dir
+
+
+def build_environment(config: configparser.ConfigParser,
+                      image_dir: pathlib.Path,
+                      log_level: int,
+                      populate: bool = True) -> Environment:
+    """Create an Environment and populate it with penguins
+
+    Parameters
+    ----------
+    config : configparser.ConfigParser
+        Config checked by validate_config
+    image_dir : pathlib.Path
+        Directory for the outputs of the run
+    log_level : int
+        Minimum logging level
+    populate : bool
+        Whether to place penguins, off when they come from a checkpoint
+
+    Returns
+    -------
+    Environment
+        Environment ready to run
+    """
+    env_size = tuple(map(int, config["env"]["env_size"].split(", ")))
 
     # Create environment
     env = Environment(
@@ -154,7 +393,41 @@ def main(config_file: str, log_level: int) -> int:
         float(config["env"]["initial_temp"]),
         float(config["env"]["ambient_temp"]),
         (config["general"]["make_gif"] == "True"),
+        config["env"].getint("pair_chunk_size", 0),
+        config["env"].get("thermal_model", "simple"),
+        config["env"].get("thermal_integrator", "explicit"),
+        config["env"].get("movement_update", "sequential"),
+        config["env"].get("pair_approximation", "exact"),
+        config["env"].getint("pm_cell_size", 8),
+        config["env"].getint("pm_cutoff", 32),
+        config["env"].getint("pm_error_interval", 0),
+        (config["general"].get("draw_map", "False") == "True"),
+        config["general"].getint("gif_scale", 2),
+        config["general"].getint("gif_queue_size", 8),
+        config["general"].getint("checkpoint_epochs", 0),
+        config["general"].getfloat("checkpoint_seconds", 0.0),
+        (config["general"].get("record", "False") == "True"),
+        config["general"].getint("record_map_interval", 0),
+        (config["general"].get("profile", "False") == "True"),
+        config["general"].getint("profile_log_interval", 0),
+        (config["env"].get("prune_dead", "False") == "True"),
+        config["env"].getint("convergence_window", 0),
+        config["env"].getfloat("convergence_tolerance", 0.05),
+        config["env"].getfloat("convergence_displacement", 10.0),
+        config["env"].get("convergence_action", "stop"),
+        config["env"].getfloat("thermal_tolerance", 0.0),
+        config["env"].getint("movement_interval", 1),
+        config["env"].getint("thermal_tile", 0),
+        config["env"].getint("refine_margin", 16),
+        config["env"].getint("active_tile", 0),
+        config["env"].getfloat("active_tolerance", 1E-3),
+        config["general"].get("backend", "numpy"),
+        config["env"].getint("thermal_workers", 0),
+        config["env"].get("precision", "float64"),
+        config["env"].getint("precision_error_interval", 0),
     )
+    if not populate:
+        return env
 
     # Add agents to environment
     added_penguins = 0
@@ -184,6 +457,124 @@ def main(config_file: str, log_level: int) -> int:
             if added_penguins >= max_penguins:
                 break
     LOG.info(f"Added {added_penguins} agents.")
+    return env
+
+
+def build_ensemble(config: configparser.ConfigParser,
+                   image_dir: pathlib.Path, log_level: int) -> Ensemble:
+    """Create an Ensemble and populate its replicates with penguins
+
+    Parameters
+    ----------
+    config : configparser.ConfigParser
+        Config checked by validate_config
+    image_dir : pathlib.Path
+        Directory for the outputs of the run
+    log_level : int
+        Minimum logging level
+
+    Returns
+    -------
+    Ensemble
+        Ensemble ready to run
+    """
+    env_size = tuple(map(int, config["env"]["env_size"].split(", ")))
+    ensemble = Ensemble(
+        log_level,
+        config["general"]["name"],
+        image_dir,
+        env_size,
+        float(config["env"]["grid_size"]),
+        float(config["env"]["time_step_size"]),
+        int(config["env"]["epochs"]),
+        float(config["env"]["air_conductivity"]),
+        float(config["env"]["ambient_temp"]),
+        config["general"].getint("replicates", 1),
+        config["general"].getfloat("confidence", 0.95),
+        config["env"].getint("pair_chunk_size", 0),
+        config["env"].get("movement_update", "sequential"),
+        config["general"].get("backend", "numpy"),
+    )
+    max_penguins = int(config["penguin"]["count"])
+    ensemble.populate(
+        max_penguins,
+        float(config["penguin"]["body_temp"]),
+        max_penguins * 10,
+        body_radius=int(config["penguin"]["body_radius"]),
+        sense_radius=int(config["penguin"]["sense_radius"]),
+        low_death_threshold=float(config["penguin"]["low_death_threshold"]),
+        high_death_threshold=float(
+            config["penguin"]["high_death_threshold"]),
+        low_move_threshold=float(config["penguin"]["low_move_threshold"]),
+        high_move_threshold=float(config["penguin"]["high_move_threshold"]),
+        internal_conductivity=float(
+            config["penguin"]["internal_conductivity"]),
+        external_conductivity=float(
+            config["penguin"]["external_conductivity"]),
+        insulation_thickness=float(
+            config["penguin"]["insulation_thickness"]),
+        density=float(config["penguin"]["density"]),
+        movement_policy=config["penguin"]["movement_policy"],
+        movement_speed=int(config["penguin"]["movement_speed"]),
+        metabolism=float(config["penguin"]["metabolism"]),
+    )
+    return ensemble
+
+
+def build_simulation(config: configparser.ConfigParser,
+                     image_dir: pathlib.Path, log_level: int):
+    """Create an Environment, or an Ensemble when replicates exceeds 1
+
+    Both provide run and summary.
+    """
+    if config["general"].getint("replicates", 1) > 1:
+        return build_ensemble(config, image_dir, log_level)
+    return build_environment(config, image_dir, log_level)
+
+
+def main(config_file: str,
+         log_level: int,
+         seed: int = None,
+         resume: bool = False) -> int:
+    """Main function
+
+    Parameters
+    ----------
+    TODO
+    """
+    coloredlogs.install(
+        level=log_level * 10,
+        logger=LOG,
+        milliseconds=True,
+    )
+
+    # Parse config file
+    config_file = pathlib.Path(config_file).resolve()
+    config = parse_config(config_file)
+    if config is None:
+        LOG.error("Could not read config file")
+        return 1
+    if not validate_config(config):
+        return 1
+    if seed is not None:
+        seed_rngs(seed)
+
+    image_dir = prepare_image_dir(config, config_file.stem, not resume)
+    if resume:
+        if config["general"].getint("replicates", 1) > 1:
+            LOG.error("Replicate ensembles cannot be resumed")
+            return 1
+        env = build_environment(config, image_dir, log_level, False)
+        if not env.checkpoint_path.exists():
+            LOG.error(f"No checkpoint to resume {str(env.checkpoint_path)}")
+            return 1
+        try:
+            env.restore(env.checkpoint_path, Penguin)
+        except (OSError, KeyError, ValueError) as error:
+            LOG.error(f"Could not resume from checkpoint: {error}")
+            return 1
+    else:
+        env = build_simulation(config, image_dir, log_level)
 
     # Run the simulation
     env.run()
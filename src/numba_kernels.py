@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""This module contains the Numba backend of the hot kernels.
+
+Each kernel is the loop the NumPy reference vectorizes, compiled with
+Numba. The loops need no temporary arrays: the pairwise heat term never
+builds the N x N conductance matrix, the stencil visits every cell once and
+the neighbour scan and the move steps stop as soon as they can. Importing
+this module raises ImportError when numba is not installed, see
+backend.load_backend.
+"""
+# Standard library
+from __future__ import annotations
+# Packages
+import numba
+import numpy as np
+# Custom
+from backend import Backend
+from thermal import GridOperator
+
+
+@numba.njit(parallel=True, cache=True)
+def _pair_heat_flow(rows, cols, radius, core, insulation_res, air_res_per_m,
+                    grid_size):
+    """Loop version of thermal.population_heat_flow on (B, N) arrays."""
+    batches, count = core.shape
+    heat_flow = np.empty((batches, count))
+    for task in numba.prange(batches * count):
+        batch = task // count
+        receiver = task % count
+        total = 0.0
+        for sender in range(count):
+            if sender == receiver:
+                continue
+            dist = (abs(rows[batch, receiver] - rows[batch, sender]) +
+                    abs(cols[batch, receiver] - cols[batch, sender]) -
+                    radius[batch, receiver] - radius[batch, sender] +
+                    1) * grid_size
+            heat_res = (insulation_res[batch, receiver] +
+                        insulation_res[batch, sender] + dist * air_res_per_m)
+            total += (core[batch, sender] -
+                      core[batch, receiver]) / heat_res
+        heat_flow[batch, receiver] = total
+    return heat_flow
+
+
+def pair_heat_flow(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    radius: np.ndarray,
+    core: np.ndarray,
+    insulation_res: np.ndarray,
+    air_res_per_m: float,
+    grid_size: float,
+    chunk_size: int = 0,
+) -> np.ndarray:
+    """Compute the heat every agent receives from all other agents.
+
+    See thermal.population_heat_flow. chunk_size is ignored, no pairwise
+    matrix is built.
+    """
+    shape = core.shape
+    count = shape[-1] if len(shape) else 0
+
+    def flat(values: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(np.broadcast_to(values, shape)).reshape(
+            -1, count)
+
+    heat_flow = _pair_heat_flow(flat(rows), flat(cols), flat(radius),
+                                flat(core).astype(float),
+                                flat(insulation_res).astype(float),
+                                float(air_res_per_m), float(grid_size))
+    return heat_flow.reshape(shape)
+
+
+@numba.njit(parallel=True, cache=True)
+def _apply_operator(vertical, horizontal, sink, load, thermal_map):
+    """Loop version of thermal.apply_operator.
+
+    The terms are added in the order of the NumPy reference, so the result
+    is the same to the last bit.
+    """
+    rows, cols = thermal_map.shape
+    heat = np.empty_like(thermal_map)
+    for row in numba.prange(rows):
+        for col in range(cols):
+            temp = thermal_map[row, col]
+            down = 0.0
+            if row < rows - 1:
+                down = vertical[row, col] * (thermal_map[row + 1, col] - temp)
+            if row > 0:
+                down -= vertical[row - 1, col] * (temp -
+                                                  thermal_map[row - 1, col])
+            right = 0.0
+            if col < cols - 1:
+                right = horizontal[row, col] * (thermal_map[row, col + 1] -
+                                                temp)
+            if col > 0:
+                right -= horizontal[row, col - 1] * (
+                    temp - thermal_map[row, col - 1])
+            heat[row, col] = (load[row, col] - sink[row, col] * temp + down +
+                              right)
+    return heat
+
+
+def apply_operator(operator: GridOperator,
+                   thermal_map: np.ndarray) -> np.ndarray:
+    """Compute the net heat flow into every cell in W.
+
+    See thermal.apply_operator.
+    """
+    return _apply_operator(operator.vertical, operator.horizontal,
+                           operator.sink, operator.load, thermal_map)
+
+
+@numba.njit(cache=True)
+def _sense_filter(found, rows, cols, sense_radius, alive, row, col, exclude):
+    """Loop version of spatial.sense_filter."""
+    kept = np.empty(len(found), dtype=found.dtype)
+    count = 0
+    for index in found:
+        if index == exclude or not alive[index]:
+            continue
+        if abs(rows[index] - row) + abs(cols[index] - col) < sense_radius[
+                index]:
+            kept[count] = index
+            count += 1
+    return kept[:count]
+
+
+def sense_filter(found: np.ndarray, rows: np.ndarray, cols: np.ndarray,
+                 sense_radius: np.ndarray, alive: np.ndarray, row: int,
+                 col: int, exclude: int) -> np.ndarray:
+    """Keep the candidate agents that sense a cell.
+
+    See spatial.sense_filter.
+    """
+    return _sense_filter(found, rows, cols, sense_radius, alive, int(row),
+                         int(col), int(exclude))
+
+
+@numba.njit(cache=True)
+def _greedy_step(start, target, speed):
+    """Loop version of policy.greedy_step."""
+    end = start.copy()
+    for index in range(len(start)):
+        for _ in range(speed[index]):
+            # A column step wins a tie with a row step
+            if end[index, 1] != target[index, 1]:
+                end[index, 1] += 1 if target[index, 1] > end[index, 1] else -1
+            elif end[index, 0] != target[index, 0]:
+                end[index, 0] += 1 if target[index, 0] > end[index, 0] else -1
+            else:
+                break
+    return end
+
+
+def greedy_step(start: np.ndarray, target: np.ndarray,
+                speed: np.ndarray) -> np.ndarray:
+    """Walk up to ``speed`` single-tile steps from start toward target.
+
+    See policy.greedy_step.
+    """
+    return _greedy_step(np.ascontiguousarray(start),
+                        np.ascontiguousarray(target),
+                        np.ascontiguousarray(speed))
+
+
+BACKEND = Backend("numba", pair_heat_flow, apply_operator, sense_filter,
+                  greedy_step)
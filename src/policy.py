@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""This module contains the batched movement policy engine.
+
+A movement policy maps the neighbours of a batch of agents to one target
+offset per agent. Neighbours are passed as flat arrays: ``rel[k]`` is the
+position of a neighbour relative to agent ``segment[k]`` of the batch, and
+the neighbours of each agent are contiguous and in sensing order.
+
+Custom policies are added with the ``register_policy`` decorator and are
+then selectable by name with the ``movement_policy`` option.
+"""
+# Standard library
+from __future__ import annotations
+from typing import Callable
+# Packages
+import numpy as np
+
+# Half width of the random jitter added to every proposed move
+JITTER = 3
+
+POLICIES = dict()
+
+
+def register_policy(name: str) -> Callable:
+    """Register a batched movement policy under a name.
+
+    The decorated function takes ``(rel, segment, count)`` and returns a
+    ``(count, 2)`` array of target offsets. Agents without neighbours never
+    reach the policy, so every agent in ``range(count)`` has at least one
+    entry in ``segment``.
+    """
+    def decorator(function: Callable) -> Callable:
+        POLICIES[name] = function
+        return function
+
+    return decorator
+
+
+@register_policy("average")
+def average_policy(rel: np.ndarray, segment: np.ndarray,
+                   count: int) -> np.ndarray:
+    """Target the sum of the neighbour offsets, the direction of the mean."""
+    target = np.zeros(shape=(count, 2), dtype=int)
+    np.add.at(target, segment, rel)
+    return target
+
+
+@register_policy("closest")
+def closest_policy(rel: np.ndarray, segment: np.ndarray,
+                   count: int) -> np.ndarray:
+    """Target the closest neighbour, the first one sensed on ties."""
+    dist = np.abs(rel).sum(axis=1)
+    # Sort by agent, then distance, then sensing order
+    order = np.lexsort((np.arange(len(dist)), dist, segment))
+    first = np.ones(shape=len(order), dtype=bool)
+    first[1:] = segment[order][1:] != segment[order][:-1]
+    target = np.zeros(shape=(count, 2), dtype=int)
+    target[segment[order][first]] = rel[order][first]
+    return target
+
+
+def greedy_step(start: np.ndarray, target: np.ndarray,
+                speed: np.ndarray) -> np.ndarray:
+    """Walk up to ``speed`` single-tile steps from start toward target.
+
+    This is the closed form of stepping one tile at a time to the neighbour
+    closest to the target in Manhattan distance. On ties a column step wins
+    over a row step, so the walk first closes the column gap and spends the
+    remaining steps on the row gap.
+
+    Parameters
+    ----------
+    start, target : np.ndarray[int]
+        Positions in the form (N, 2).
+    speed : np.ndarray[int]
+        Maximum number of steps of each agent.
+
+    Returns
+    -------
+    np.ndarray[int]
+        End positions in the form (N, 2).
+    """
+    gap = target - start
+    col_step = np.clip(gap[:, 1], -speed, speed)
+    remaining = speed - np.abs(col_step)
+    row_step = np.clip(gap[:, 0], -remaining, remaining)
+    return start + np.stack((row_step, col_step), axis=1)
+
+
+def propose_moves(
+    positions: np.ndarray,
+    core_temp: np.ndarray,
+    low_move_threshold: np.ndarray,
+    high_move_threshold: np.ndarray,
+    movement_speed: np.ndarray,
+    movement_policy: np.ndarray,
+    rel: np.ndarray,
+    segment: np.ndarray,
+    jitter: np.ndarray,
+    step: Callable = greedy_step,
+) -> np.ndarray:
+    """Propose the next position of a batch of agents.
+
+    Every agent starts from its position plus a random jitter. Agents below
+    the low move threshold walk toward their policy target, agents above the
+    high move threshold walk away from it and the rest keep the jittered
+    position.
+
+    Parameters
+    ----------
+    positions : np.ndarray[int]
+        Agent positions in the form (B, 2).
+    core_temp : np.ndarray[float]
+        Agent core temperatures.
+    low_move_threshold, high_move_threshold : np.ndarray[float]
+        Movement thresholds of each agent.
+    movement_speed : np.ndarray[int]
+        Maximum steps of each agent.
+    movement_policy : np.ndarray[str]
+        Name of the registered policy of each agent.
+    rel : np.ndarray[int]
+        Neighbour offsets in the form (M, 2).
+    segment : np.ndarray[int]
+        Batch index of the agent owning each neighbour offset, ascending.
+    jitter : np.ndarray[int]
+        Random offset of each agent in the form (B, 2).
+    step : Callable
+        Walk toward the targets, greedy_step or a backend version of it.
+
+    Returns
+    -------
+    np.ndarray[int]
+        Proposed positions in the form (B, 2).
+    """
+    count = len(positions)
+    best_pos = positions + jitter
+    target = np.zeros(shape=(count, 2), dtype=int)
+    has_target = np.zeros(shape=count, dtype=bool)
+    has_target[segment] = True
+    for name in np.unique(movement_policy[has_target]):
+        members = np.flatnonzero(has_target & (movement_policy == name))
+        # Renumber the neighbour segments of this policy group
+        local = np.full(shape=count, fill_value=-1, dtype=int)
+        local[members] = np.arange(len(members))
+        pairs = local[segment] >= 0
+        target[members] = POLICIES[name](rel[pairs], local[segment[pairs]],
+                                         len(members))
+    cold = has_target & (core_temp < low_move_threshold)
+    hot = has_target & ~cold & (core_temp > high_move_threshold)
+    target[cold] = positions[cold] + target[cold]
+    target[hot] = positions[hot] - target[hot]
+    moving = cold | hot
+    best_pos[moving] = step(best_pos[moving], target[moving],
+                            movement_speed[moving])
+    return best_pos
+
+
+def draw_jitter(count: int) -> np.ndarray:
+    """Draw the random jitter of ``count`` agents from the global RNG."""
+    return np.random.randint(-JITTER, JITTER + 1, size=(count, 2), dtype=int)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""This module contains the built-in phase timers and hot-path counters.
+
+Environment wraps each phase of an epoch in ``profiler.phase(name)`` and
+bumps counters with ``profiler.count(name, amount)``. A disabled run uses
+NullProfiler, whose methods do nothing, so the instrumentation stays in the
+hot path at the cost of a method call.
+"""
+# Standard library
+from __future__ import annotations
+import contextlib
+import csv
+import json
+import pathlib
+import time
+
+# Shared no-op context of NullProfiler.phase
+_NULL_PHASE = contextlib.nullcontext()
+
+
+class _PhaseTimer:
+    """Reusable context manager adding its wall time to one phase."""
+    __slots__ = ("_profiler", "_name", "_start")
+
+    def __init__(self, profiler: Profiler, name: str):
+        self._profiler = profiler
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self._profiler._add_time(self._name,
+                                 time.perf_counter() - self._start)
+
+
+class Profiler:
+    """Accumulate wall time per phase and hot-path counters per epoch.
+
+    Phases may nest. The time of an outer phase includes its inner phases.
+    """
+    enabled = True
+
+    def __init__(self):
+        self._timers = dict()
+        self._epoch_times = dict()
+        self._epoch_counts = dict()
+        self._rows = list()
+
+    def phase(self, name: str) -> _PhaseTimer:
+        """Get a context manager timing a phase."""
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = _PhaseTimer(self, name)
+        return timer
+
+    def _add_time(self, name: str, seconds: float) -> None:
+        self._epoch_times[name] = self._epoch_times.get(name, 0.0) + seconds
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Add to a counter of the current epoch."""
+        self._epoch_counts[name] = self._epoch_counts.get(name, 0) + amount
+
+    def end_epoch(self, epoch: int) -> None:
+        """Close the row of an epoch and start a new one."""
+        self._rows.append((epoch, self._epoch_times, self._epoch_counts))
+        self._epoch_times = dict()
+        self._epoch_counts = dict()
+
+    def totals(self) -> dict:
+        """Sum every phase and counter over the closed epochs.
+
+        Returns
+        -------
+        dict
+            ``epochs``, ``seconds`` per phase and ``counts`` per counter.
+        """
+        seconds, counts = dict(), dict()
+        for _, epoch_times, epoch_counts in self._rows:
+            for name, value in epoch_times.items():
+                seconds[name] = seconds.get(name, 0.0) + value
+            for name, value in epoch_counts.items():
+                counts[name] = counts.get(name, 0) + value
+        return {"epochs": len(self._rows), "seconds": seconds,
+                "counts": counts}
+
+    def format(self) -> str:
+        """Describe the totals so far in one line for the log."""
+        totals = self.totals()
+        epochs = max(totals["epochs"], 1)
+        phases = ", ".join(
+            f"{name} {value * 1E3 / epochs:.3f}"
+            for name, value in totals["seconds"].items())
+        counts = ", ".join(f"{name} {value / epochs:.1f}"
+                           for name, value in totals["counts"].items())
+        if not counts:
+            return f"ms per epoch: {phases}"
+        return f"ms per epoch: {phases}; per epoch: {counts}"
+
+    def save(self, json_path: pathlib.Path, csv_path: pathlib.Path) -> None:
+        """Write the totals as JSON and one row per epoch as CSV."""
+        with open(json_path, "w") as json_file:
+            json.dump(self.totals(), json_file, indent=4)
+        phases, counters = dict(), dict()
+        for _, epoch_times, epoch_counts in self._rows:
+            phases.update(dict.fromkeys(epoch_times))
+            counters.update(dict.fromkeys(epoch_counts))
+        with open(csv_path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["epoch"] + [f"{name}_s" for name in phases] +
+                            list(counters))
+            for epoch, epoch_times, epoch_counts in self._rows:
+                writer.writerow([epoch] +
+                                [epoch_times.get(name, 0.0)
+                                 for name in phases] +
+                                [epoch_counts.get(name, 0)
+                                 for name in counters])
+
+
+class NullProfiler:
+    """Profiler stand-in that records nothing."""
+    enabled = False
+
+    def phase(self, name: str) -> contextlib.nullcontext:
+        """Get a context manager that does nothing."""
+        return _NULL_PHASE
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Do nothing."""
+
+    def end_epoch(self, epoch: int) -> None:
+        """Do nothing."""
+
+    def totals(self) -> dict:
+        """Get empty totals in the form of Profiler.totals."""
+        return {"epochs": 0, "seconds": dict(), "counts": dict()}
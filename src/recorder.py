@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""This module contains the columnar trajectory recorder.
+
+A recording is a directory holding one raw binary file per column and a
+``meta.json`` describing them. Every epoch appends one frame to each
+per-epoch column, so a recording can be memory-mapped while the simulation
+still writes it and a crash loses at most the frame being written. The
+number of frames is derived from the file sizes.
+
+Columns
+-------
+epoch : int64
+    Epoch of each frame.
+positions : int32 (N, 2)
+    Agent centres.
+core_temp : float64 (N, )
+    Agent core temperatures.
+alive : bool (N, )
+    Agent alive flags.
+thermal_map : float64 (rows, cols)
+    Optional thermal map snapshots, one per ``map_interval`` epochs.
+map_epoch : int64
+    Epoch of each thermal map snapshot.
+"""
+# Standard library
+from __future__ import annotations
+import json
+import pathlib
+import shutil
+# Packages
+import numpy as np
+# Custom
+from swarm_state import SwarmState
+
+# Description file inside a recording directory
+META_FILE = "meta.json"
+# Per-agent fields that do not change and are stored once
+STATIC_FIELDS = ("body_radius", "low_death_threshold", "high_death_threshold")
+
+
+def _columns(count: int, env_size: tuple[int]) -> dict[str, tuple]:
+    """Get the dtype and frame shape of every per-epoch column."""
+    return {
+        "epoch": ("<i8", ()),
+        "positions": ("<i4", (count, 2)),
+        "core_temp": ("<f8", (count, )),
+        "alive": ("|b1", (count, )),
+        "thermal_map": ("<f8", tuple(env_size)),
+        "map_epoch": ("<i8", ()),
+    }
+
+
+class TrajectoryRecorder:
+    """Append the trajectory of a swarm to a recording directory.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        Recording directory.
+    state : SwarmState
+        Swarm to record, its number of agents must not change.
+    env_size : tuple[int]
+        Size of the environment (rows, cols).
+    map_interval : int
+        Epochs between thermal map snapshots, 0 for none.
+    resume_epoch : int
+        Epoch of a restored checkpoint. The recording is kept and frames
+        after this epoch are dropped. None starts a new recording.
+    **meta
+        Extra entries of ``meta.json``, for example the name used by the
+        replay titles.
+    """
+    def __init__(self,
+                 path: pathlib.Path,
+                 state: SwarmState,
+                 env_size: tuple[int],
+                 map_interval: int = 0,
+                 resume_epoch: int = None,
+                 **meta):
+        self._path = path
+        self._map_interval = map_interval
+        self._columns = _columns(len(state), env_size)
+        if resume_epoch is None:
+            shutil.rmtree(path, ignore_errors=True)
+            path.mkdir(mode=0o775, parents=True)
+            for name in STATIC_FIELDS:
+                np.save(path.joinpath(f"{name}.npy"), getattr(state, name))
+            with open(path.joinpath(META_FILE), "w") as meta_file:
+                json.dump(
+                    {
+                        "count": len(state),
+                        "env_size": list(env_size),
+                        "map_interval": map_interval,
+                        "columns": {
+                            name: {
+                                "dtype": dtype,
+                                "shape": list(shape)
+                            }
+                            for name, (dtype, shape) in self._columns.items()
+                        },
+                        **meta,
+                    },
+                    meta_file,
+                    indent=4)
+        else:
+            self._truncate(resume_epoch)
+        self._files = {
+            name: open(path.joinpath(f"{name}.bin"), "ab")
+            for name in self._columns
+        }
+
+    @property
+    def path(self) -> pathlib.Path:
+        """pathlib.Path: Recording directory"""
+        return self._path
+
+    def _truncate(self, epoch: int) -> None:
+        """Drop the frames recorded after an epoch."""
+        recording = Recording(self._path)
+        frames = int(np.searchsorted(recording.epoch, epoch, side="right"))
+        maps = int(np.searchsorted(recording.map_epoch, epoch,
+                                   side="right"))
+        frame_bytes = {
+            name: recording.frame_bytes(name)
+            for name in self._columns
+        }
+        # Release the memory maps before shrinking the files under them
+        del recording
+        for name, kept in (("epoch", frames), ("positions", frames),
+                           ("core_temp", frames), ("alive", frames),
+                           ("thermal_map", maps), ("map_epoch", maps)):
+            with open(self._path.joinpath(f"{name}.bin"), "r+b") as column:
+                column.truncate(kept * frame_bytes[name])
+
+    def append(self, epoch: int, state: SwarmState,
+               thermal_map: np.ndarray) -> None:
+        """Append one frame.
+
+        Parameters
+        ----------
+        epoch : int
+            Epoch of the frame.
+        state : SwarmState
+            Swarm after the epoch.
+        thermal_map : np.ndarray[float]
+            Thermal map after the epoch, stored every map_interval epochs.
+        """
+        columns = (
+            ("epoch", epoch),
+            ("positions", state.positions),
+            ("core_temp", state.core_temp),
+            ("alive", state.alive),
+        )
+        if self._map_interval > 0 and epoch % self._map_interval == 0:
+            columns += (("thermal_map", thermal_map), ("map_epoch", epoch))
+        for name, value in columns:
+            dtype = self._columns[name][0]
+            self._files[name].write(
+                np.ascontiguousarray(value, dtype=dtype).tobytes())
+
+    def flush(self) -> None:
+        """Flush every column to the operating system."""
+        for column in self._files.values():
+            column.flush()
+
+    def close(self) -> None:
+        """Flush and close every column."""
+        for column in self._files.values():
+            column.close()
+
+
+class Recording:
+    """Read-only, memory-mapped view of a recording directory.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        Recording directory written by TrajectoryRecorder.
+    """
+    def __init__(self, path: pathlib.Path):
+        self._path = pathlib.Path(path)
+        with open(self._path.joinpath(META_FILE)) as meta_file:
+            self._meta = json.load(meta_file)
+        self._static = {
+            name: np.load(self._path.joinpath(f"{name}.npy"))
+            for name in STATIC_FIELDS
+        }
+        self._columns = dict()
+        frames = None
+        for name in ("epoch", "positions", "core_temp", "alive"):
+            column = self._map(name)
+            frames = len(column) if frames is None else min(
+                frames, len(column))
+            self._columns[name] = column
+        # A crash may leave some columns one frame ahead of the others
+        for name in ("epoch", "positions", "core_temp", "alive"):
+            self._columns[name] = self._columns[name][:frames]
+        maps = min(len(self._map("map_epoch")), len(self._map("thermal_map")))
+        self._columns["map_epoch"] = self._map("map_epoch")[:maps]
+        self._columns["thermal_map"] = self._map("thermal_map")[:maps]
+
+    def _map(self, name: str) -> np.ndarray:
+        """Memory-map the complete frames of a column."""
+        column = self._meta["columns"][name]
+        shape = tuple(column["shape"])
+        frame_bytes = self.frame_bytes(name)
+        path = self._path.joinpath(f"{name}.bin")
+        frames = path.stat().st_size // frame_bytes if path.exists() else 0
+        if frames == 0:
+            return np.empty(shape=(0, ) + shape, dtype=column["dtype"])
+        return np.memmap(path,
+                         dtype=column["dtype"],
+                         mode="r",
+                         shape=(frames, ) + shape)
+
+    def frame_bytes(self, name: str) -> int:
+        """Get the size of one frame of a column in bytes."""
+        column = self._meta["columns"][name]
+        return int(np.dtype(column["dtype"]).itemsize *
+                   np.prod(column["shape"], dtype=int))
+
+    @property
+    def meta(self) -> dict:
+        """dict: Contents of meta.json"""
+        return self._meta
+
+    @property
+    def path(self) -> pathlib.Path:
+        """pathlib.Path: Recording directory"""
+        return self._path
+
+    def __len__(self) -> int:
+        return len(self._columns["epoch"])
+
+    @property
+    def epoch(self) -> np.ndarray:
+        """np.ndarray[int]: Epoch of each frame"""
+        return self._columns["epoch"]
+
+    @property
+    def positions(self) -> np.ndarray:
+        """np.ndarray[int]: Agent centres in the form (frames, N, 2)"""
+        return self._columns["positions"]
+
+    @property
+    def core_temp(self) -> np.ndarray:
+        """np.ndarray[float]: Core temperatures in the form (frames, N)"""
+        return self._columns["core_temp"]
+
+    @property
+    def alive(self) -> np.ndarray:
+        """np.ndarray[bool]: Alive flags in the form (frames, N)"""
+        return self._columns["alive"]
+
+    @property
+    def map_epoch(self) -> np.ndarray:
+        """np.ndarray[int]: Epoch of each thermal map snapshot"""
+        return self._columns["map_epoch"]
+
+    @property
+    def thermal_map(self) -> np.ndarray:
+        """np.ndarray[float]: Snapshots in the form (maps, rows, cols)"""
+        return self._columns["thermal_map"]
+
+    def static(self, name: str) -> np.ndarray:
+        """Get a per-agent field listed in STATIC_FIELDS."""
+        return self._static[name]
+
+    def swarm_state(self) -> SwarmState:
+        """Build a SwarmState with the static fields of the recording.
+
+        Positions, core temperatures and alive flags are left to be set
+        from a frame, see set_frame.
+        """
+        state = SwarmState(self._meta["count"])
+        for index in range(self._meta["count"]):
+            state.append(0, 0, 0.0, **{
+                name: self._static[name][index]
+                for name in STATIC_FIELDS
+            })
+        return state
+
+    def set_frame(self, state: SwarmState, frame: int) -> None:
+        """Copy a frame into a SwarmState built by swarm_state."""
+        state.positions[...] = self.positions[frame]
+        state.core_temp[...] = self.core_temp[frame]
+        state.alive[...] = self.alive[frame]
+
+    def map_at(self, epoch: int) -> np.ndarray:
+        """Get the latest thermal map snapshot taken at or before an epoch.
+
+        Returns
+        -------
+        np.ndarray[float]
+            Snapshot, or None if there is none yet.
+        """
+        index = np.searchsorted(self.map_epoch, epoch, side="right") - 1
+        return self.thermal_map[index] if index >= 0 else None
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""This module contains the two-level grid of the full-grid thermal model.
+
+Most of a large environment is open air far from the colony, which only
+relaxes toward the ambient temperature. The two-level grid keeps full
+resolution in a window of tiles around the alive penguins and one coarse
+cell per tile elsewhere, so the memory and the cost of an epoch follow the
+colony footprint instead of the environment area. The window follows the
+colony every epoch.
+"""
+# Standard library
+from __future__ import annotations
+# Packages
+import numpy as np
+# Custom
+from swarm_state import SwarmState
+import thermal
+
+
+class TwoLevelGrid:
+    """Fine window of tiles around the colony inside a coarse air grid.
+
+    A coarse cell stands for the ``tile x tile`` air cells of its tile. Its
+    heat capacity and ambient sink are the sums of those of the cells, and
+    the conductance to a neighbouring coarse cell is that of the chain of
+    air cells between their centres, so both levels follow the same heat
+    equation in open air. Heat crossing the window edge leaves one level
+    exactly as it enters the other, see thermal.TwoLevelOperator.
+
+    A tile entering the window takes the temperature of its coarse cell. A
+    tile leaving it gives its coarse cell its mean temperature, which
+    conserves the heat of air tiles.
+
+    Parameters
+    ----------
+    env_size : tuple[int]
+        Size of the environment (rows, cols).
+    tile : int
+        Side of each coarse cell in cells.
+    margin : int
+        Air cells kept at full resolution around every alive penguin. It
+        must be at least the movement speed, so the cells a penguin left
+        stay in the window.
+    grid_size : float
+        Size of each cell in m.
+    air_conductivity : float
+        Thermal conductivity of air.
+    ambient_temp : float
+        Ambient air temperature.
+    initial_temp : float
+        Initial air temperature.
+    """
+    def __init__(
+        self,
+        env_size: tuple[int],
+        tile: int,
+        margin: int,
+        grid_size: float,
+        air_conductivity: float,
+        ambient_temp: float,
+        initial_temp: float,
+    ):
+        self._env_size = tuple(env_size)
+        self._tile = tile
+        self._margin = margin
+        self._grid_size = grid_size
+        self._air_conductivity = air_conductivity
+        self._ambient_temp = ambient_temp
+        area = grid_size * thermal.CELL_DEPTH
+        # Conductance between neighbouring air cells, two half resistances
+        self._air_face = air_conductivity * area / 2
+        self._air_sink = air_conductivity * 4 * area
+        self._air_capacity = (thermal.AIR_DENSITY * pow(grid_size, 2) *
+                              thermal.CELL_DEPTH * thermal.AIR_SPECIFIC_HEAT)
+        # Cells of each coarse row and column, the last ones may be cut short
+        # by the environment edge
+        self._row_extent = self._extents(self._env_size[0])
+        self._col_extent = self._extents(self._env_size[1])
+        self._coarse = np.full(
+            shape=(len(self._row_extent), len(self._col_extent)),
+            fill_value=initial_temp,
+            dtype=float,
+        )
+        # Window in coarse cells (row_low, row_high, col_low, col_high)
+        self._window = (0, 0, 0, 0)
+        self._fine = np.zeros(shape=(0, 0), dtype=float)
+        self._material = np.zeros(shape=(0, 0), dtype=np.uint8)
+        # Coarse operator, capacity and interface of the current window
+        self._coupling = None
+
+    def _extents(self, size: int) -> np.ndarray:
+        """Get the cells covered by each coarse cell along one axis."""
+        return np.minimum(self._tile, size - np.arange(0, size, self._tile))
+
+    @property
+    def origin(self) -> tuple[int]:
+        """tuple[int]: Environment cell of the first fine cell"""
+        return (self._window[0] * self._tile, self._window[2] * self._tile)
+
+    @property
+    def fine(self) -> np.ndarray:
+        """np.ndarray[float]: Temperature of each cell of the window"""
+        return self._fine
+
+    @property
+    def fine_cells(self) -> int:
+        """int: Number of cells at full resolution"""
+        return self._fine.size
+
+    def follow(self, state: SwarmState) -> bool:
+        """Move the window over the tiles around the alive agents.
+
+        The window keeps its place when no agent is alive.
+
+        Returns
+        -------
+        bool
+            Whether the window moved.
+        """
+        alive = state.alive
+        if not alive.any():
+            return False
+        reach = state.body_radius[alive] - 1 + self._margin
+        rows, cols = state.rows[alive], state.cols[alive]
+        window = (
+            max(int((rows - reach).min()) // self._tile, 0),
+            min(int((rows + reach).max()) // self._tile + 1,
+                len(self._row_extent)),
+            max(int((cols - reach).min()) // self._tile, 0),
+            min(int((cols + reach).max()) // self._tile + 1,
+                len(self._col_extent)),
+        )
+        if window == self._window:
+            return False
+        self._regrid(window)
+        return True
+
+    def _cell_range(self, window: tuple[int]) -> tuple[int]:
+        """Get the cell bounds of a window (row, row_end, col, col_end)."""
+        row_low, row_high, col_low, col_high = window
+        return (
+            row_low * self._tile,
+            row_low * self._tile +
+            int(self._row_extent[row_low:row_high].sum()),
+            col_low * self._tile,
+            col_low * self._tile +
+            int(self._col_extent[col_low:col_high].sum()),
+        )
+
+    def _regrid(self, window: tuple[int]) -> None:
+        """Restrict the old window, then prolong the new one."""
+        row_low, row_high, col_low, col_high = self._window
+        if self._fine.size > 0:
+            # Every old tile is restricted, those still in the new window are
+            # covered by it again
+            starts = (np.arange(0, self._fine.shape[0], self._tile),
+                      np.arange(0, self._fine.shape[1], self._tile))
+            sums = np.add.reduceat(np.add.reduceat(self._fine, starts[0],
+                                                   axis=0),
+                                   starts[1], axis=1)
+            self._coarse[row_low:row_high, col_low:col_high] = sums / (
+                self._row_extent[row_low:row_high, None] *
+                self._col_extent[None, col_low:col_high])
+        old_range = self._cell_range(self._window)
+        new_range = self._cell_range(window)
+        fine = np.repeat(
+            np.repeat(self._coarse[window[0]:window[1], window[2]:window[3]],
+                      self._row_extent[window[0]:window[1]], axis=0),
+            self._col_extent[window[2]:window[3]], axis=1)
+        material = np.zeros(shape=fine.shape, dtype=np.uint8)
+        top, bottom = max(old_range[0], new_range[0]), min(old_range[1],
+                                                          new_range[1])
+        left, right = max(old_range[2], new_range[2]), min(old_range[3],
+                                                          new_range[3])
+        if top < bottom and left < right:
+            new_cells = (slice(top - new_range[0], bottom - new_range[0]),
+                         slice(left - new_range[2], right - new_range[2]))
+            old_cells = (slice(top - old_range[0], bottom - old_range[0]),
+                         slice(left - old_range[2], right - old_range[2]))
+            fine[new_cells] = self._fine[old_cells]
+            material[new_cells] = self._material[old_cells]
+        self._fine = fine
+        self._material = material
+        self._window = window
+        self._coupling = None
+
+    def rasterize(self, state: SwarmState) -> thermal.GridFields:
+        """Rasterize the swarm onto the window, see thermal.rasterize
+
+        Cells vacated by a penguin are refilled with ambient air.
+        """
+        fields = thermal.rasterize(state, self._fine, self._grid_size,
+                                   self._air_conductivity, self.origin)
+        self._fine[(fields.material == thermal.AIR)
+                   & (self._material > 0)] = self._ambient_temp
+        self._material = fields.material
+        return fields
+
+    def _couple(self) -> tuple:
+        """Build the coarse operator, capacity and interface of the window."""
+        row_low, row_high, col_low, col_high = self._window
+        row_extent = self._row_extent.astype(float)
+        col_extent = self._col_extent.astype(float)
+        active = np.ones(shape=self._coarse.shape, dtype=bool)
+        active[row_low:row_high, col_low:col_high] = False
+        # A chain of air cells joins the centres of neighbouring cells
+        vertical = self._air_face * col_extent[None, :] / (
+            (row_extent[:-1] + row_extent[1:]) / 2)[:, None]
+        vertical = np.where(active[:-1] & active[1:], vertical, 0.0)
+        horizontal = self._air_face * row_extent[:, None] / (
+            (col_extent[:-1] + col_extent[1:]) / 2)[None, :]
+        horizontal = np.where(active[:, :-1] & active[:, 1:], horizontal,
+                              0.0)
+        cells = row_extent[:, None] * col_extent[None, :]
+        sink = np.where(active, self._air_sink * cells, 0.0)
+        coarse = thermal.GridOperator(vertical, horizontal, sink,
+                                      sink * self._ambient_temp)
+        # Faces between the window edge cells and the coarse cells around it
+        fine_rows, fine_cols = self._fine.shape
+        width = self._coarse.shape[1]
+        rows, cols = np.arange(fine_rows), np.arange(fine_cols)
+        coarse_rows = row_low + rows // self._tile
+        coarse_cols = col_low + cols // self._tile
+        fine_index, coarse_index, distance = list(), list(), list()
+        if row_low > 0:
+            fine_index.append(cols)
+            coarse_index.append((row_low - 1) * width + coarse_cols)
+            distance.append(np.full(fine_cols, row_extent[row_low - 1]))
+        if row_high < self._coarse.shape[0]:
+            fine_index.append((fine_rows - 1) * fine_cols + cols)
+            coarse_index.append(row_high * width + coarse_cols)
+            distance.append(np.full(fine_cols, row_extent[row_high]))
+        if col_low > 0:
+            fine_index.append(rows * fine_cols)
+            coarse_index.append(coarse_rows * width + col_low - 1)
+            distance.append(np.full(fine_rows, col_extent[col_low - 1]))
+        if col_high < width:
+            fine_index.append(rows * fine_cols + fine_cols - 1)
+            coarse_index.append(coarse_rows * width + col_high)
+            distance.append(np.full(fine_rows, col_extent[col_high]))
+        # From the centre of the edge cell to the centre of the coarse cell
+        distance = (1 + np.concatenate(distance or [np.zeros(0)])) / 2
+        return (
+            coarse,
+            self._air_capacity * cells,
+            np.concatenate(fine_index or [np.zeros(0, dtype=int)]),
+            np.concatenate(coarse_index or [np.zeros(0, dtype=int)]),
+            self._air_face / distance,
+        )
+
+    def operator(
+        self,
+        fields: thermal.GridFields,
+    ) -> tuple[thermal.TwoLevelOperator, np.ndarray]:
+        """Build the operator of both levels for the current rasterization.
+
+        Parameters
+        ----------
+        fields : thermal.GridFields
+            Fields of the window from rasterize.
+
+        Returns
+        -------
+        thermal.TwoLevelOperator
+            Operator for thermal.advance_two_level.
+        np.ndarray[float]
+            Heat capacity of every cell in J/K, packed like pack.
+        """
+        if self._coupling is None:
+            self._coupling = self._couple()
+        coarse, coarse_capacity, fine_index, coarse_index, conductance = (
+            self._coupling)
+        operator = thermal.TwoLevelOperator(
+            thermal.grid_operator(fields, self._grid_size,
+                                  self._ambient_temp, self._air_conductivity),
+            coarse,
+            fine_index,
+            coarse_index,
+            conductance,
+        )
+        return operator, np.concatenate(
+            (fields.heat_capacity.ravel(), coarse_capacity.ravel()))
+
+    def pack(self) -> np.ndarray:
+        """Get the temperature of every cell, the fine cells first."""
+        return np.concatenate((self._fine.ravel(), self._coarse.ravel()))
+
+    def unpack(self, values: np.ndarray) -> None:
+        """Set the temperature of every cell from a vector made by pack."""
+        self._fine = values[:self._fine.size].reshape(self._fine.shape)
+        self._coarse = values[self._fine.size:].reshape(self._coarse.shape)
+
+    def gather(self, state: SwarmState) -> None:
+        """Copy the window into the body blocks, see gather_body_temps."""
+        thermal.gather_body_temps(state, self._fine, self.origin)
+
+    def full_map(self) -> np.ndarray:
+        """Expand both levels to one temperature per environment cell.
+
+        Returns
+        -------
+        np.ndarray[float]
+            Temperature of each cell, each coarse cell covering its tile.
+        """
+        thermal_map = np.repeat(np.repeat(self._coarse, self._row_extent,
+                                          axis=0),
+                                self._col_extent, axis=1)
+        rows, row_end, cols, col_end = self._cell_range(self._window)
+        thermal_map[rows:row_end, cols:col_end] = self._fine
+        return thermal_map
+
+    def snapshot(self) -> dict:
+        """Copy the state of both levels for a checkpoint."""
+        return {
+            "window": np.array(self._window),
+            "fine": self._fine.copy(),
+            "coarse": self._coarse.copy(),
+            "material": self._material.copy(),
+        }
+
+    def restore(self, arrays: dict) -> None:
+        """Replace the state of both levels with a snapshot."""
+        self._window = tuple(int(value) for value in arrays["window"])
+        self._fine = arrays["fine"].astype(float)
+        self._coarse = arrays["coarse"].astype(float)
+        self._material = arrays["material"].astype(np.uint8)
+        self._coupling = None
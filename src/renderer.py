@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""This module contains the direct-to-array frame renderer.
+
+Frames are rasterized straight into a preallocated uint8 RGB buffer with
+vectorized colour lookup tables, without going through matplotlib.
+"""
+# Standard library
+from __future__ import annotations
+import colorsys
+# Packages
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+# Custom
+from spatial import scatter_footprints
+from swarm_state import SwarmState
+
+# Number of entries in each colour lookup table, two tables plus black and
+# white must fit in a 256 colour GIF palette
+LUT_SIZE = 120
+# Height of the title band in pixels, before scaling
+TITLE_HEIGHT = 26
+
+
+def color_lut(hue_low: float, hue_high: float, saturation: float,
+              value: float) -> np.ndarray:
+    """Build a uint8 RGB lookup table sweeping the hue.
+
+    Parameters
+    ----------
+    hue_low, hue_high : float
+        Hue of the first and last entry.
+    saturation, value : float
+        HSV saturation and value of every entry.
+
+    Returns
+    -------
+    np.ndarray[np.uint8]
+        Table in the form (LUT_SIZE, 3).
+    """
+    hues = np.linspace(hue_low, hue_high, LUT_SIZE)
+    rgb = np.array([
+        colorsys.hsv_to_rgb(hue, saturation, value) for hue in hues
+    ])
+    return (rgb * 255).round().astype(np.uint8)
+
+
+def lut_index(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    """Map values in [low, high] to lookup table indices."""
+    scaled = (np.asarray(values, dtype=float) - low) / (high - low)
+    return np.clip(scaled * (LUT_SIZE - 1), 0, LUT_SIZE - 1).round().astype(
+        int)
+
+
+class Renderer:
+    """Rasterize the environment into RGB frames.
+
+    Penguins are coloured from cyan when cold to red when hot, like
+    Agent.color. The optional thermal map uses pale colours from red at the
+    penguin death threshold to cyan at the ambient temperature.
+
+    Parameters
+    ----------
+    env_size : tuple[int]
+        Size of the environment (rows, cols).
+    low_death_threshold, high_death_threshold : float
+        Temperature range of the penguin colours.
+    ambient_temp, initial_temp : float
+        Temperatures used to normalise the thermal map, like draw_map did.
+    scale : int
+        Integer upscaling of each cell in the output frame.
+    """
+    def __init__(
+        self,
+        env_size: tuple[int],
+        low_death_threshold: float,
+        high_death_threshold: float,
+        ambient_temp: float,
+        initial_temp: float,
+        scale: int = 2,
+    ):
+        self._env_size = env_size
+        self._scale = max(int(scale), 1)
+        self._agent_range = (low_death_threshold, high_death_threshold)
+        self._agent_lut = color_lut(0.5, 0.0, 1.0, 0.5)
+        # draw_map maps ambient to hue 0.5 and ends at hue 0.0
+        self._map_range = (ambient_temp,
+                           ambient_temp + high_death_threshold - initial_temp)
+        self._map_lut = color_lut(0.5, 0.0, 0.25, 1.0)
+        # Fixed palette so frames are mapped to colours without quantizing
+        palette = np.concatenate((
+            self._agent_lut,
+            self._map_lut,
+            np.array([[255, 255, 255], [0, 0, 0]], dtype=np.uint8),
+        ))
+        self._palette = Image.new("P", (1, 1))
+        self._palette.putpalette(palette.ravel().tolist())
+        self._canvas = np.empty(shape=(env_size[0], env_size[1], 3),
+                                dtype=np.uint8)
+        self._font = ImageFont.load_default()
+
+    @property
+    def canvas(self) -> np.ndarray:
+        """np.ndarray[np.uint8]: Environment pixels of the last frame"""
+        return self._canvas
+
+    def rasterize(self, state: SwarmState,
+                  thermal_map: np.ndarray = None) -> np.ndarray:
+        """Draw the background and every alive agent into the canvas.
+
+        Parameters
+        ----------
+        state : SwarmState
+            Swarm to draw.
+        thermal_map : np.ndarray[float]
+            Optional temperature of each cell drawn as the background.
+
+        Returns
+        -------
+        np.ndarray[np.uint8]
+            The canvas in the form (rows, cols, 3).
+        """
+        if thermal_map is None:
+            self._canvas[...] = 255
+        else:
+            self._canvas[...] = self._map_lut[lut_index(
+                thermal_map, *self._map_range)]
+        colors = self._agent_lut[lut_index(state.core_temp,
+                                           *self._agent_range)]
+        scatter_footprints(self._canvas, state, colors)
+        return self._canvas
+
+    def compose(self, canvas: np.ndarray, title: str) -> Image.Image:
+        """Turn a rasterized canvas into a GIF frame with a title band.
+
+        This only reads its arguments, so it can run on a worker thread
+        while the simulation rasterizes the next canvas.
+
+        Parameters
+        ----------
+        canvas : np.ndarray[np.uint8]
+            Environment pixels in the form (rows, cols, 3).
+        title : str
+            Text drawn above the environment, may span lines.
+
+        Returns
+        -------
+        Image.Image
+            Palette image ready for GIF encoding.
+        """
+        if self._scale > 1:
+            canvas = canvas.repeat(self._scale, axis=0).repeat(self._scale,
+                                                               axis=1)
+        frame = Image.new("RGB", (canvas.shape[1], canvas.shape[0] +
+                                  TITLE_HEIGHT), (255, 255, 255))
+        frame.paste(Image.fromarray(canvas), (0, TITLE_HEIGHT))
+        ImageDraw.Draw(frame).multiline_text((4, 1), title, fill=(0, 0, 0),
+                                             font=self._font)
+        return frame.quantize(palette=self._palette, dither=0)
+
+    def render(self,
+               state: SwarmState,
+               title: str,
+               thermal_map: np.ndarray = None) -> Image.Image:
+        """Render one frame with a title band.
+
+        Parameters
+        ----------
+        state : SwarmState
+            Swarm to draw.
+        title : str
+            Text drawn above the environment, may span lines.
+        thermal_map : np.ndarray[float]
+            Optional temperature of each cell drawn as the background.
+
+        Returns
+        -------
+        Image.Image
+            Palette image ready for GIF encoding.
+        """
+        return self.compose(self.rasterize(state, thermal_map), title)
@@ -0,0 +1,317 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module replays trajectory recordings without re-simulating.
+
+A recording written with ``record = True`` can be turned into the GIF, the
+plot_vs_epoch figure or a CSV of any per-epoch metric. Several recordings
+are processed in parallel.
+
+Custom metrics are added with the ``register_metric`` decorator, or given
+on the command line as ``module:function``. A metric takes a Recording and
+returns one value per frame.
+"""
+# Standard library
+import argparse
+import concurrent.futures
+import csv
+import importlib
+import logging
+import os
+import pathlib
+from typing import Callable
+# Packages
+import coloredlogs
+import numpy as np
+# Custom
+from encoder import FramePipeline
+from environment import plot_vs_epoch
+from recorder import Recording
+from renderer import Renderer
+
+###############################################################################
+# Constant definitions
+###############################################################################
+
+LOG = logging.getLogger("penguin_swarm.replay")
+
+METRICS = dict()
+
+###############################################################################
+# Function definitions
+###############################################################################
+
+
+def register_metric(name: str) -> Callable:
+    """Register a per-frame metric of a Recording under a name."""
+    def decorator(function: Callable) -> Callable:
+        METRICS[name] = function
+        return function
+
+    return decorator
+
+
+@register_metric("alive_portion")
+def alive_portion(recording: Recording) -> np.ndarray:
+    """Portion of the initially alive penguins still alive."""
+    alive = np.asarray(recording.alive)
+    return alive.sum(axis=1) / alive[0].sum()
+
+
+@register_metric("mean_core_temp")
+def mean_core_temp(recording: Recording) -> np.ndarray:
+    """Mean core temperature of the survivors, NaN without survivors."""
+    alive = np.asarray(recording.alive)
+    total = np.where(alive, recording.core_temp, 0.0).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return total / alive.sum(axis=1)
+
+
+@register_metric("huddle_spread")
+def huddle_spread(recording: Recording) -> np.ndarray:
+    """Mean Manhattan distance of the survivors to their centroid."""
+    alive = np.asarray(recording.alive)[..., None]
+    positions = np.asarray(recording.positions, dtype=float)
+    count = alive.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid = np.where(alive, positions, 0.0).sum(axis=1) / count
+        dist = np.abs(positions - centroid[:, None]).sum(axis=2,
+                                                         keepdims=True)
+        return (np.where(alive, dist, 0.0).sum(axis=1) / count)[:, 0]
+
+
+def get_metric(name: str) -> Callable:
+    """Look up a registered metric or import one given as module:function.
+
+    Raises
+    ------
+    ValueError
+        If the metric is neither registered nor importable.
+    """
+    if name in METRICS:
+        return METRICS[name]
+    module_name, _, function_name = name.partition(":")
+    try:
+        return getattr(importlib.import_module(module_name), function_name)
+    except (ImportError, AttributeError, ValueError):
+        raise ValueError(f"Unknown metric {name}") from None
+
+
+def replay_gif(recording: Recording, path: pathlib.Path, draw_map: bool,
+               scale: int) -> None:
+    """Render every frame of a recording into a GIF, like Environment.draw.
+
+    Thermal map backgrounds use the latest snapshot of each frame, so they
+    are exact only on the epochs a snapshot was taken.
+    """
+    meta = recording.meta
+    state = recording.swarm_state()
+    renderer = Renderer(
+        tuple(meta["env_size"]),
+        recording.static("low_death_threshold")[0],
+        recording.static("high_death_threshold")[0],
+        meta["ambient_temp"],
+        meta["initial_temp"],
+        scale,
+    )
+    pipeline = FramePipeline(renderer, path)
+    try:
+        for frame, epoch in enumerate(recording.epoch):
+            recording.set_frame(state, frame)
+            pipeline.submit(
+                renderer.rasterize(
+                    state,
+                    recording.map_at(epoch) if draw_map else None,
+                ),
+                f"{meta['name']}\nepoch {epoch:06d}",
+            )
+    finally:
+        pipeline.close()
+
+
+def replay_plot(recording: Recording, path: pathlib.Path) -> None:
+    """Redraw the plot_vs_epoch figure of a recording.
+
+    The series follow Environment.run: error bars every
+    temps_error_interval epochs and the last mean temperature repeated
+    once every penguin died.
+    """
+    meta = recording.meta
+    epochs = recording.epoch.tolist()
+    alive = np.asarray(recording.alive)
+    total = alive[0].sum()
+    alive_plot, temps_plot = list(), list()
+    error_x, error_y, error_std = list(), list(), list()
+    for frame, epoch in enumerate(epochs):
+        mask = alive[frame]
+        core = recording.core_temp[frame][mask]
+        alive_plot.append(mask.sum() / total)
+        if not mask.any():
+            temps_plot.append(temps_plot[-1])
+            continue
+        temps_plot.append(np.mean(core))
+        if frame == 0 or (epoch - 1) % meta["temps_error_interval"] == 0:
+            error_x.append(epoch)
+            error_y.append(np.mean(core))
+            error_std.append(np.std(core))
+    plot_vs_epoch(
+        path,
+        meta["name"],
+        epochs,
+        alive_plot,
+        temps_plot,
+        error_x,
+        error_y,
+        error_std,
+        (recording.static("low_death_threshold")[0],
+         recording.static("high_death_threshold")[0]),
+    )
+
+
+def replay_metric(recording: Recording, path: pathlib.Path,
+                  name: str) -> None:
+    """Write one metric per frame of a recording to a CSV file."""
+    values = get_metric(name)(recording)
+    with open(path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(("epoch", name))
+        writer.writerows(zip(recording.epoch.tolist(), np.asarray(values)))
+
+
+def replay(recording_path: pathlib.Path, output: str, metric: str,
+           draw_map: bool, scale: int = None) -> pathlib.Path:
+    """Produce one output from a recording next to the recording.
+
+    The GIF uses the recorded gif_scale unless scale is given.
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the written file.
+    """
+    recording = Recording(recording_path)
+    out_dir = recording.path.parent
+    file_name = recording.meta["file_name"]
+    if output == "gif":
+        path = out_dir.joinpath(f"{file_name}.gif")
+        if scale is None:
+            scale = recording.meta["gif_scale"]
+        replay_gif(recording, path, draw_map, scale)
+    elif output == "plot":
+        path = out_dir.joinpath(f"{file_name}_plot_vs_epoch.png")
+        replay_plot(recording, path)
+    else:
+        safe_name = metric.replace(":", "_").replace(".", "_")
+        path = out_dir.joinpath(f"{file_name}_{safe_name}.csv")
+        replay_metric(recording, path, metric)
+    return path
+
+
+def parse_args(arg_list: list[str] = None):
+    """Parse the arguments
+
+    Parameters
+    ----------
+    arg_list : list[str]
+    """
+    parser = argparse.ArgumentParser(
+        description="Replay penguin swarm trajectory recordings",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "output",
+        help="What to produce from each recording",
+        choices=("gif", "plot", "metric"),
+    )
+    parser.add_argument(
+        "recordings",
+        help="Recording directories (img/<config>/<name>_trajectory)",
+        type=pathlib.Path,
+        nargs="+",
+    )
+    parser.add_argument(
+        "-m",
+        "--metric",
+        help=f"Metric for the metric output, one of {', '.join(METRICS)}\n"
+        "or module:function",
+        default="alive_portion",
+    )
+    parser.add_argument(
+        "--draw_map",
+        help="Draw the recorded thermal map snapshots behind the penguins",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--scale",
+        help="Pixels per cell side in the GIF, defaults to the recorded one",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of worker processes, defaults to the number of cores",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "-ll",
+        "--log_level",
+        help="""Set the logging level:
+        1 = DEBUG
+        2 = INFO
+        3 = WARNING
+        4 = ERROR
+        5 = CRITICAL""",
+        type=int,
+        choices=range(1, 6),
+        default=2,
+    )
+    return parser.parse_args(args=arg_list)
+
+
+###############################################################################
+# Main function
+###############################################################################
+
+
+def main(output: str, recordings: list[pathlib.Path], metric: str,
+         draw_map: bool, scale: int, jobs: int, log_level: int) -> int:
+    """Main function
+
+    Parameters
+    ----------
+    TODO
+    """
+    coloredlogs.install(
+        level=log_level * 10,
+        logger=LOG,
+        milliseconds=True,
+    )
+    if output == "metric":
+        try:
+            get_metric(metric)
+        except ValueError as error:
+            LOG.error(error)
+            return 1
+
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(replay, recording_path, output, metric, draw_map,
+                        scale): recording_path
+            for recording_path in recordings
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                LOG.info(f"Saved {future.result()}")
+            except (OSError, KeyError, ValueError) as error:
+                LOG.error(f"Could not replay {futures[future]}: {error}")
+                failed += 1
+    logging.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    import sys
+    args = parse_args()
+    sys.exit(main(**vars(args)))
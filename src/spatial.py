@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""This module contains spatial indexes over the environment grid.
+"""
+# Standard library
+from __future__ import annotations
+import functools
+# Packages
+import numpy as np
+# Custom
+from swarm_state import SwarmState
+
+
+@functools.lru_cache(maxsize=None)
+def diamond_offsets(radius: int) -> tuple[np.ndarray]:
+    """Get the cell offsets covered by a diamond body.
+
+    Parameters
+    ----------
+    radius : int
+        Body radius, the diamond covers Manhattan distance ``radius - 1``.
+
+    Returns
+    -------
+    tuple[np.ndarray]
+        Row offsets and column offsets, read-only.
+    """
+    offsets = [(i, j) for i in range(-radius + 1, radius)
+               for j in range(-radius + 1, radius)
+               if abs(i) + abs(j) <= radius - 1]
+    d_row, d_col = np.array(offsets, dtype=int).reshape(-1, 2).T.copy()
+    d_row.flags.writeable = False
+    d_col.flags.writeable = False
+    return d_row, d_col
+
+
+def footprint_cells(rows: np.ndarray, cols: np.ndarray,
+                    radius: int) -> tuple[np.ndarray]:
+    """Get the cells covered by diamond bodies of one radius.
+
+    Parameters
+    ----------
+    rows, cols : np.ndarray[int]
+        Body centres in the form (A, ), or one centre.
+    radius : int
+        Body radius of every body.
+
+    Returns
+    -------
+    tuple[np.ndarray]
+        Rows and columns of the cells in the form (A, C), or (C, ) for one
+        centre, in the order of diamond_offsets.
+    """
+    d_row, d_col = diamond_offsets(int(radius))
+    return np.add.outer(rows, d_row), np.add.outer(cols, d_col)
+
+
+def footprint_groups(state: SwarmState, index: np.ndarray = None):
+    """Split agents into groups sharing a body radius.
+
+    Parameters
+    ----------
+    state : SwarmState
+        Swarm of the agents.
+    index : np.ndarray[int]
+        Agents to split, every alive agent by default.
+
+    Yields
+    ------
+    tuple
+        Body radius and the indices of the agents with that radius.
+    """
+    if index is None:
+        index = np.flatnonzero(state.alive)
+    radii = state.body_radius[index]
+    for radius in np.unique(radii):
+        yield int(radius), index[radii == radius]
+
+
+def scatter_footprints(grid: np.ndarray, state: SwarmState,
+                       values: np.ndarray, index: np.ndarray = None) -> None:
+    """Write a value of each agent into every cell of its footprint.
+
+    There is one fancy-indexed write per body radius. Footprints must not
+    overlap.
+
+    Parameters
+    ----------
+    grid : np.ndarray
+        Grid of the environment in the form (rows, cols, ...), modified in
+        place.
+    state : SwarmState
+        Swarm of the agents.
+    values : np.ndarray
+        Value of every agent of the state in the form (N, ...).
+    index : np.ndarray[int]
+        Agents to write, every alive agent by default.
+    """
+    for radius, members in footprint_groups(state, index):
+        rows, cols = footprint_cells(state.rows[members],
+                                     state.cols[members], radius)
+        grid[rows, cols] = values[members, None]
+
+
+def gather_footprints(grid: np.ndarray,
+                      state: SwarmState,
+                      index: np.ndarray = None,
+                      origin: tuple[int] = (0, 0)):
+    """Read the footprint cells of each agent from a grid.
+
+    There is one fancy-indexed read per body radius.
+
+    Parameters
+    ----------
+    grid : np.ndarray
+        Grid of the environment in the form (rows, cols, ...).
+    state : SwarmState
+        Swarm of the agents.
+    index : np.ndarray[int]
+        Agents to read, every alive agent by default.
+    origin : tuple[int]
+        Environment cell of ``grid[0, 0]`` when the grid is a window of the
+        environment.
+
+    Yields
+    ------
+    tuple
+        Body radius, the indices of the agents with that radius and their
+        cells in the form (A, C, ...), in the order of diamond_offsets.
+    """
+    for radius, members in footprint_groups(state, index):
+        rows, cols = footprint_cells(state.rows[members] - origin[0],
+                                     state.cols[members] - origin[1], radius)
+        yield radius, members, grid[rows, cols]
+
+
+def sense_filter(found: np.ndarray, rows: np.ndarray, cols: np.ndarray,
+                 sense_radius: np.ndarray, alive: np.ndarray, row: int,
+                 col: int, exclude: int) -> np.ndarray:
+    """Keep the candidate agents that sense a cell.
+
+    Parameters
+    ----------
+    found : np.ndarray[int]
+        Candidate agent indices, usually from SpatialHash.candidates.
+    rows, cols, sense_radius, alive : np.ndarray
+        Fields of every agent.
+    row, col : int
+        Query cell.
+    exclude : int
+        Agent index to leave out.
+
+    Returns
+    -------
+    np.ndarray[int]
+        Alive candidates closer than their sense radius, in candidate order.
+    """
+    dist = np.abs(rows[found] - row) + np.abs(cols[found] - col)
+    return found[(dist < sense_radius[found]) & alive[found]
+                 & (found != exclude)]
+
+
+class SpatialHash:
+    """Uniform bucket grid over the environment for radius queries.
+
+    The environment is divided into square buckets of ``bucket_size``
+    cells. Each bucket lists the agents whose centre lies in it, so a radius
+    query only visits the buckets overlapping the query diamond.
+
+    Parameters
+    ----------
+    state : SwarmState
+        Swarm whose agents are indexed.
+    env_size : tuple[int]
+        Size of the environment (rows, cols).
+    bucket_size : int
+        Side of each bucket in cells, usually the sense radius.
+    """
+    def __init__(self, state: SwarmState, env_size: tuple[int],
+                 bucket_size: int):
+        self._state = state
+        self._bucket_size = max(int(bucket_size), 1)
+        self._shape = (
+            -(-env_size[0] // self._bucket_size),
+            -(-env_size[1] // self._bucket_size),
+        )
+        self._buckets = [[list() for _ in range(self._shape[1])]
+                         for _ in range(self._shape[0])]
+
+    @property
+    def bucket_size(self) -> int:
+        """int: Side of each bucket in cells"""
+        return self._bucket_size
+
+    def _bucket(self, row: int, col: int) -> list[int]:
+        """Get the bucket holding a cell."""
+        return self._buckets[row // self._bucket_size][col //
+                                                       self._bucket_size]
+
+    def insert(self, index: int) -> None:
+        """Add an agent at its current position."""
+        row, col = self._state.positions[index]
+        self._bucket(row, col).append(index)
+
+    def remove(self, index: int) -> None:
+        """Remove an agent from the bucket of its current position."""
+        row, col = self._state.positions[index]
+        self._bucket(row, col).remove(index)
+
+    def move(self, index: int, old_position: np.ndarray,
+             new_position: np.ndarray) -> None:
+        """Update the index after an agent moved.
+
+        Parameters
+        ----------
+        index : int
+            Agent index in the SwarmState.
+        old_position, new_position : np.ndarray[int]
+            Position before and after the move.
+        """
+        old_bucket = self._bucket(*old_position)
+        new_bucket = self._bucket(*new_position)
+        if old_bucket is not new_bucket:
+            old_bucket.remove(index)
+            new_bucket.append(index)
+
+    def rebuild(self, index: np.ndarray = None) -> None:
+        """Rebuild every bucket from the SwarmState positions.
+
+        Parameters
+        ----------
+        index : np.ndarray[int]
+            Agents to add, every agent by default.
+        """
+        for bucket_row in self._buckets:
+            for bucket in bucket_row:
+                bucket.clear()
+        if index is None:
+            index = np.arange(len(self._state))
+        for agent in index.tolist():
+            self.insert(agent)
+
+    def candidates(self, row: int, col: int, radius: int) -> np.ndarray:
+        """Get every agent in the buckets overlapping a query diamond.
+
+        Returns
+        -------
+        np.ndarray[int]
+            Agent indices, a superset of the agents within ``radius``.
+        """
+        size = self._bucket_size
+        row_low = max((row - radius) // size, 0)
+        row_high = min((row + radius) // size, self._shape[0] - 1)
+        col_low = max((col - radius) // size, 0)
+        col_high = min((col + radius) // size, self._shape[1] - 1)
+        found = list()
+        for bucket_row in self._buckets[row_low:row_high + 1]:
+            for bucket in bucket_row[col_low:col_high + 1]:
+                found.extend(bucket)
+        return np.array(found, dtype=int)
+
+    def within(self, row: int, col: int, radius: int) -> np.ndarray:
+        """Get every alive agent within a Manhattan radius of a cell.
+
+        Parameters
+        ----------
+        row, col : int
+            Query cell.
+        radius : int
+            Inclusive Manhattan radius.
+
+        Returns
+        -------
+        np.ndarray[int]
+            Agent indices in no particular order.
+        """
+        found = self.candidates(row, col, radius)
+        state = self._state
+        dist = (np.abs(state.rows[found] - row) +
+                np.abs(state.cols[found] - col))
+        return found[(dist <= radius) & state.alive[found]]
+
+
+class OccupancyGrid:
+    """Raster of the agent covering each cell of the environment.
+
+    Every agent is stamped with its diamond footprint, so a collision check
+    only reads the cells a candidate body would cover.
+
+    Parameters
+    ----------
+    state : SwarmState
+        Swarm whose agents are stamped.
+    env_size : tuple[int]
+        Size of the environment (rows, cols).
+    """
+    # Value of cells not covered by any agent
+    EMPTY = -1
+
+    def __init__(self, state: SwarmState, env_size: tuple[int]):
+        self._state = state
+        self._grid = np.full(shape=env_size, fill_value=self.EMPTY,
+                             dtype=int)
+
+    @property
+    def grid(self) -> np.ndarray:
+        """np.ndarray[int]: Agent index covering each cell, EMPTY for none"""
+        return self._grid
+
+    def stamp(self, index: int) -> None:
+        """Stamp an agent at its current position."""
+        row, col = self._state.positions[index]
+        self._grid[footprint_cells(row, col,
+                                   self._state.body_radius[index])] = index
+
+    def erase(self, index: int) -> None:
+        """Un-stamp an agent from its current position."""
+        row, col = self._state.positions[index]
+        self._grid[footprint_cells(
+            row, col, self._state.body_radius[index])] = self.EMPTY
+
+    def move(self, index: int, old_position: np.ndarray,
+             new_position: np.ndarray) -> None:
+        """Un-stamp an agent from its old position and stamp it again."""
+        radius = self._state.body_radius[index]
+        self._grid[footprint_cells(*old_position, radius)] = self.EMPTY
+        self._grid[footprint_cells(*new_position, radius)] = index
+
+    def rebuild(self, index: np.ndarray = None) -> None:
+        """Restamp agents from the SwarmState positions.
+
+        Parameters
+        ----------
+        index : np.ndarray[int]
+            Agents to stamp, every agent by default.
+        """
+        self._grid[...] = self.EMPTY
+        every = np.arange(len(self._state))
+        scatter_footprints(self._grid, self._state, every,
+                           every if index is None else index)
+
+    def is_free(self, row: int, col: int, radius: int,
+                ignore: int = EMPTY) -> bool:
+        """Check whether a body fits at a position.
+
+        The footprint must already be inside the grid.
+
+        Parameters
+        ----------
+        row, col : int
+            Candidate centre.
+        radius : int
+            Candidate body radius.
+        ignore : int
+            Agent index allowed to overlap, usually the moving agent.
+        """
+        cells = self._grid[footprint_cells(row, col, radius)]
+        return bool(np.all((cells == self.EMPTY) | (cells == ignore)))
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""This module contains the multi-process solver of the full-grid model.
+
+StripSolver keeps the thermal map and the per-cell fields in shared memory
+and splits the grid into horizontal strips, one per worker process. Every
+step, each worker reads its strip plus a one cell halo from the neighbouring
+strips and writes its new temperatures into the other half of a double
+buffered map. Two barriers bracket the step, so no worker reads a halo that
+is being written. The explicit step of a cell only depends on its halo, so
+the result is the same to the last bit as thermal.grid_step on the whole
+grid.
+"""
+# Standard library
+from __future__ import annotations
+import multiprocessing
+import threading
+import time
+import weakref
+# Packages
+import numpy as np
+# Custom
+from swarm_state import SwarmState
+import thermal
+
+# Slots of the control array shared with the workers
+_COMMAND, _BUFFER, _TIME_STEP = range(3)
+# Command telling the workers to exit, 0 runs a step
+_STOP = 1
+
+
+def _view(buffer, shape: tuple[int], dtype: type) -> np.ndarray:
+    """Get the array stored in a shared buffer."""
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def _raw_array(context, dtype: type, size: int):
+    """Allocate a shared buffer of ``size`` values of ``dtype``."""
+    return context.RawArray(np.ctypeslib.as_ctypes_type(dtype), size)
+
+
+def _strip_worker(buffers: tuple, dtypes: tuple[str], shape: tuple[int],
+                  bounds: tuple[int], constants: tuple[float],
+                  barrier: threading.Barrier, control, timings,
+                  worker: int) -> None:
+    """Advance one strip of the grid every time the solver steps.
+
+    Parameters
+    ----------
+    buffers : tuple[multiprocessing.RawArray]
+        Shared double buffered map, then the shared fields.
+    dtypes : tuple[str]
+        Data type of each buffer.
+    shape : tuple[int]
+        Shape of the grid.
+    bounds : tuple[int]
+        First and last row + 1 of the strip.
+    constants : tuple[float]
+        Grid size, ambient temperature and air conductivity.
+    barrier : threading.Barrier
+        Barrier of the solver and every worker.
+    control, timings : multiprocessing.RawArray
+        Control slots and per worker timing slots.
+    worker : int
+        Index of the worker.
+    """
+    maps = _view(buffers[0], (2, ) + shape, dtypes[0])
+    low, high = bounds
+    # Rows of the strip and its halo
+    block = slice(max(low - 1, 0), min(high + 1, shape[0]))
+    inner = slice(low - block.start, high - block.start)
+    block_fields = thermal.GridFields(*(
+        _view(buffer, shape, dtype)[block]
+        for buffer, dtype in zip(buffers[1:], dtypes[1:])))
+    grid_size, ambient_temp, air_conductivity = constants
+    slots = slice(worker * 3, worker * 3 + 3)
+    try:
+        # Ready
+        barrier.wait()
+        while True:
+            barrier.wait()
+            if control[_COMMAND] == _STOP:
+                break
+            start = time.perf_counter()
+            current = int(control[_BUFFER])
+            new = thermal.grid_step(maps[current, block], block_fields,
+                                    grid_size, control[_TIME_STEP],
+                                    ambient_temp, air_conductivity)
+            maps[1 - current, low:high] = new[inner]
+            done = time.perf_counter()
+            barrier.wait()
+            compute, wait, steps = timings[slots]
+            timings[slots] = (compute + done - start,
+                              wait + time.perf_counter() - done, steps + 1)
+    except threading.BrokenBarrierError:
+        pass
+    finally:
+        # Wake the solver and the other workers if this one failed
+        barrier.abort()
+
+
+def _shutdown(processes: list, barrier: threading.Barrier, control) -> None:
+    """Stop the workers."""
+    control[_COMMAND] = _STOP
+    try:
+        barrier.wait(timeout=10)
+    except threading.BrokenBarrierError:
+        pass
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+
+
+class StripSolver:
+    """Explicit full-grid model split into strips over worker processes.
+
+    The fields persist between epochs. Only the cells covered by the
+    penguins are refilled and restamped by this process, the workers only
+    read the fields.
+
+    Parameters
+    ----------
+    env_size : tuple[int]
+        Size of the environment (rows, cols).
+    workers : int
+        Number of worker processes, at most the number of rows.
+    grid_size : float
+        Size of each cell in m.
+    air_conductivity : float
+        Thermal conductivity of air.
+    ambient_temp : float
+        Ambient air temperature.
+    initial_temp : float
+        Initial air temperature.
+    dtype : type
+        Floating point type of the fields, the map is float64.
+    """
+    def __init__(
+        self,
+        env_size: tuple[int],
+        workers: int,
+        grid_size: float,
+        air_conductivity: float,
+        ambient_temp: float,
+        initial_temp: float,
+        dtype: type = float,
+    ):
+        self._env_size = tuple(env_size)
+        self._grid_size = grid_size
+        self._air_conductivity = air_conductivity
+        self._ambient_temp = ambient_temp
+        context = multiprocessing.get_context("spawn")
+        cells = self._env_size[0] * self._env_size[1]
+        buffers = [_raw_array(context, float, 2 * cells)]
+        self._maps = _view(buffers[0], (2, ) + self._env_size, float)
+        self._maps[0] = initial_temp
+        self._current = 0
+        fields = list()
+        for field in thermal.air_fields(self._env_size, grid_size,
+                                        air_conductivity, dtype):
+            buffers.append(_raw_array(context, field.dtype, cells))
+            fields.append(_view(buffers[-1], self._env_size, field.dtype))
+            fields[-1][...] = field
+        self._fields = thermal.GridFields(*fields)
+        # Flat indices of the cells stamped by the last epoch
+        self._stamped = np.zeros(shape=0, dtype=int)
+        self._bounds = np.linspace(0, self._env_size[0],
+                                   workers + 1).round().astype(int)
+
+        self._barrier = context.Barrier(workers + 1)
+        self._control = context.RawArray("d", 3)
+        self._timings = context.RawArray("d", 3 * workers)
+        self._processes = [
+            context.Process(
+                target=_strip_worker,
+                args=(
+                    tuple(buffers),
+                    tuple(array.dtype.name for array in (self._maps, ) +
+                          self._fields),
+                    self._env_size,
+                    tuple(self._bounds[worker:worker + 2].tolist()),
+                    (grid_size, ambient_temp, air_conductivity),
+                    self._barrier,
+                    self._control,
+                    self._timings,
+                    worker,
+                ),
+                daemon=True,
+            ) for worker in range(workers)
+        ]
+        for process in self._processes:
+            process.start()
+        self._close = weakref.finalize(self, _shutdown, self._processes,
+                                       self._barrier, self._control)
+        try:
+            self._barrier.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeError("A thermal worker did not start") from None
+        self._steps = 0
+        self._step_seconds = 0.0
+
+    @property
+    def thermal_map(self) -> np.ndarray:
+        """np.ndarray[float]: Temperature of each cell, a view"""
+        return self._maps[self._current]
+
+    def step(self, state: SwarmState, time_step_size: float) -> None:
+        """Rasterize the swarm, advance every strip and gather.
+
+        Agents whose core temperature leaves the safe range are killed, see
+        thermal.gather_body_temps.
+
+        Parameters
+        ----------
+        state : SwarmState
+            Swarm to advance.
+        time_step_size : float
+            Time step in s.
+
+        Raises
+        ------
+        RuntimeError
+            If a worker stopped.
+        """
+        thermal_map = self.thermal_map
+        # Cells vacated by a penguin are refilled with ambient air
+        thermal.clear_cells(self._fields, self._stamped, self._grid_size,
+                            self._air_conductivity)
+        stamped = thermal.stamp_agents(self._fields, state, thermal_map,
+                                       self._grid_size)
+        thermal_map.flat[np.setdiff1d(self._stamped,
+                                      stamped)] = self._ambient_temp
+        self._stamped = stamped
+        start = time.perf_counter()
+        self._control[_TIME_STEP] = time_step_size
+        self._control[_BUFFER] = self._current
+        try:
+            self._barrier.wait()
+            self._barrier.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeError("A thermal worker stopped") from None
+        self._step_seconds += time.perf_counter() - start
+        self._steps += 1
+        self._current = 1 - self._current
+        thermal.gather_body_temps(state, self.thermal_map)
+
+    def timings(self) -> list[dict]:
+        """Get the time of each worker per step.
+
+        Returns
+        -------
+        list[dict]
+            For each worker, its rows, the ms per step spent computing and
+            waiting at the barrier for the other strips, and the portion of
+            the cells it computed that were halo cells.
+        """
+        report = list()
+        for worker, (low, high) in enumerate(
+                zip(self._bounds[:-1], self._bounds[1:])):
+            compute, wait, steps = self._timings[worker * 3:worker * 3 + 3]
+            computed = min(high + 1, self._env_size[0]) - max(low - 1, 0)
+            report.append({
+                "rows": (int(low), int(high)),
+                "compute_ms": compute * 1E3 / max(steps, 1),
+                "wait_ms": wait * 1E3 / max(steps, 1),
+                "halo_portion": float(1 - (high - low) / computed),
+            })
+        return report
+
+    @property
+    def step_ms(self) -> float:
+        """float: Wall time of the parallel part of a step in ms"""
+        return self._step_seconds * 1E3 / max(self._steps, 1)
+
+    def close(self) -> None:
+        """Stop the workers, the arrays stay readable."""
+        self._close()
+
+    def snapshot(self) -> dict:
+        """Copy the map, the fields and the stamped cells for a checkpoint."""
+        return {
+            "map": self.thermal_map.copy(),
+            "material": self._fields.material.copy(),
+            "agent_id": self._fields.agent_id.copy(),
+            "half_res": self._fields.half_res.copy(),
+            "insulation_res": self._fields.insulation_res.copy(),
+            "heat_capacity": self._fields.heat_capacity.copy(),
+            "source": self._fields.source.copy(),
+            "stamped": self._stamped.copy(),
+        }
+
+    def restore(self, arrays: dict) -> None:
+        """Replace the map, the fields and the stamped cells with a snapshot.
+
+        Earlier thermal_map views become stale.
+        """
+        self._current = 0
+        self._maps[0] = arrays["map"]
+        for name in ("material", "agent_id", "half_res", "insulation_res",
+                     "heat_capacity", "source"):
+            getattr(self._fields, name)[...] = arrays[name]
+        self._stamped = arrays["stamped"].astype(int)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""This module contains the SwarmState struct-of-arrays container.
+
+Every per-agent quantity lives in one contiguous NumPy array so the
+Environment can operate on the whole swarm at once. Agent objects are thin
+views that hold a reference to a SwarmState and a row index into it.
+"""
+# Standard library
+from __future__ import annotations
+# Packages
+import numpy as np
+
+# Scalar per-agent fields and their dtypes
+FIELDS = {
+    "body_radius": int,
+    "sense_radius": int,
+    "low_death_threshold": float,
+    "high_death_threshold": float,
+    "low_move_threshold": float,
+    "high_move_threshold": float,
+    "internal_conductivity": float,
+    "external_conductivity": float,
+    "insulation_thickness": float,
+    "density": float,
+    "movement_policy": object,
+    "movement_speed": int,
+    "metabolism": float,
+    "alive": bool,
+}
+
+
+def _field(name: str) -> property:
+    """Build a read-only property exposing the live slice of a field."""
+    def getter(self) -> np.ndarray:
+        return self._data[name][:self._count]
+
+    return property(getter, doc=f"np.ndarray: Per-agent {name}.")
+
+
+class SwarmState:
+    """Struct-of-arrays storage for a swarm of agents.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of agents to preallocate storage for. Storage grows by
+        doubling when it runs out.
+
+    Notes
+    -----
+    Body temperatures are stored as one ``(capacity, size, size)`` block,
+    where ``size = 2 * max(body_radius) - 1``. Agents with a smaller radius
+    are centred in their slot, so the core temperature of every agent is
+    always at ``[:, center, center]``.
+    """
+    def __init__(self, capacity: int = 1):
+        self._count = 0
+        self._capacity = max(int(capacity), 1)
+        self._max_radius = 1
+        self._positions = np.zeros(shape=(self._capacity, 2), dtype=int)
+        self._data = {
+            name: np.zeros(shape=self._capacity, dtype=dtype)
+            for name, dtype in FIELDS.items()
+        }
+        self._body_temp = np.zeros(shape=(self._capacity, 1, 1), dtype=float)
+
+    def __len__(self) -> int:
+        return self._count
+
+    body_radius = _field("body_radius")
+    sense_radius = _field("sense_radius")
+    low_death_threshold = _field("low_death_threshold")
+    high_death_threshold = _field("high_death_threshold")
+    low_move_threshold = _field("low_move_threshold")
+    high_move_threshold = _field("high_move_threshold")
+    internal_conductivity = _field("internal_conductivity")
+    external_conductivity = _field("external_conductivity")
+    insulation_thickness = _field("insulation_thickness")
+    density = _field("density")
+    movement_policy = _field("movement_policy")
+    movement_speed = _field("movement_speed")
+    metabolism = _field("metabolism")
+    alive = _field("alive")
+
+    @property
+    def positions(self) -> np.ndarray:
+        """np.ndarray[int]: Agent centres in the form (N, 2) of (row, col)"""
+        return self._positions[:self._count]
+
+    @property
+    def rows(self) -> np.ndarray:
+        """np.ndarray[int]: Row of each agent centre"""
+        return self._positions[:self._count, 0]
+
+    @property
+    def cols(self) -> np.ndarray:
+        """np.ndarray[int]: Column of each agent centre"""
+        return self._positions[:self._count, 1]
+
+    @property
+    def body_temp(self) -> np.ndarray:
+        """np.ndarray[float]: Padded body temperature blocks (N, size, size)"""
+        return self._body_temp[:self._count]
+
+    @property
+    def center(self) -> int:
+        """int: Index of the core cell inside each body temperature block"""
+        return self._max_radius - 1
+
+    @property
+    def core_temp(self) -> np.ndarray:
+        """np.ndarray[float]: Core temperature of each agent (writable view)"""
+        return self._body_temp[:self._count, self.center, self.center]
+
+    def body_slice(self, index: int) -> np.ndarray:
+        """Get the (2r-1, 2r-1) body temperature view of one agent."""
+        radius = self._data["body_radius"][index]
+        low = self.center - radius + 1
+        high = self.center + radius
+        return self._body_temp[index, low:high, low:high]
+
+    def append(
+        self,
+        row: int,
+        col: int,
+        body_temp: float,
+        **fields,
+    ) -> int:
+        """Append an agent and return its index.
+
+        Parameters
+        ----------
+        row, col : int
+            Position of the agent centre.
+        body_temp : float or np.ndarray[float]
+            Initial body temperature, either a scalar or a (2r-1, 2r-1) block.
+        **fields
+            One value for each entry of ``FIELDS`` except ``alive``.
+        """
+        if self._count == self._capacity:
+            self._grow(2 * self._capacity)
+        index = self._count
+        self._count += 1
+        self._positions[index] = (row, col)
+        for name in FIELDS:
+            self._data[name][index] = fields.get(name, True)
+        self.reserve_radius(fields["body_radius"])
+        self._body_temp[index] = 0.0
+        self.body_slice(index)[...] = body_temp
+        return index
+
+    def adopt(self, agent) -> int:
+        """Copy an agent into this state and rebind it as a view.
+
+        Parameters
+        ----------
+        agent : Agent
+            Agent currently bound to another SwarmState.
+
+        Returns
+        -------
+        int
+            Index of the agent in this state.
+        """
+        state, old = agent.state, agent.index
+        fields = {name: state._data[name][old] for name in FIELDS}
+        index = self.append(
+            row=state._positions[old, 0],
+            col=state._positions[old, 1],
+            body_temp=state.body_slice(old),
+            **fields,
+        )
+        agent.bind(self, index)
+        return index
+
+    def reserve_radius(self, radius: int) -> None:
+        """Make the body temperature blocks big enough for a radius."""
+        radius = int(radius)
+        if radius <= self._max_radius:
+            return
+        pad = radius - self._max_radius
+        self._body_temp = np.pad(self._body_temp,
+                                 ((0, 0), (pad, pad), (pad, pad)))
+        self._max_radius = radius
+
+    def kill_out_of_range(self) -> np.ndarray:
+        """Kill every agent whose core temperature left its safe range.
+
+        Returns
+        -------
+        np.ndarray[bool]
+            Mask of the agents that died in this call.
+        """
+        core = self.core_temp
+        dying = ((core > self.high_death_threshold)
+                 | (core < self.low_death_threshold)) & self.alive
+        self.alive[dying] = False
+        return dying
+
+    def snapshot(self) -> dict[str, np.ndarray]:
+        """Copy the live rows of every array for a checkpoint.
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            Arrays accepted by restore, without object dtypes.
+        """
+        arrays = {
+            "positions": self.positions.copy(),
+            "body_temp": self.body_temp.copy(),
+            "max_radius": np.array(self._max_radius),
+        }
+        for name in FIELDS:
+            arrays[name] = self._data[name][:self._count].copy()
+        arrays["movement_policy"] = arrays["movement_policy"].astype(str)
+        return arrays
+
+    def restore(self, arrays: dict[str, np.ndarray]) -> None:
+        """Replace every agent with the arrays of a snapshot.
+
+        Agents bound to this state keep pointing at their row index.
+        """
+        self._count = len(arrays["positions"])
+        self._capacity = self._count
+        self._max_radius = int(arrays["max_radius"])
+        self._positions = np.array(arrays["positions"], dtype=int)
+        self._data = {
+            name: np.array(arrays[name]).astype(dtype)
+            for name, dtype in FIELDS.items()
+        }
+        self._body_temp = np.array(arrays["body_temp"], dtype=float)
+        if self._capacity == 0:
+            self._grow(1)
+
+    def _grow(self, capacity: int) -> None:
+        """Reallocate every array to a new capacity."""
+        extra = capacity - self._capacity
+        self._positions = np.concatenate(
+            (self._positions, np.zeros((extra, 2), dtype=int)))
+        for name, array in self._data.items():
+            self._data[name] = np.concatenate(
+                (array, np.zeros(extra, dtype=array.dtype)))
+        self._body_temp = np.concatenate(
+            (self._body_temp,
+             np.zeros((extra, ) + self._body_temp.shape[1:], dtype=float)))
+        self._capacity = capacity
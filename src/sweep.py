@@ -0,0 +1,225 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""This module runs the config_gen parameter grid in a process pool.
+
+Every combination of the grid is simulated in memory, without writing the
+auto_*.ini files. Each job is seeded from its own stream spawned from the
+sweep seed, so a sweep is reproducible and any single job can be rerun with
+``main.py --seed``.
+"""
+# Standard library
+import argparse
+import concurrent.futures
+import configparser
+import csv
+import json
+import logging
+import os
+import pathlib
+import time
+# Packages
+import coloredlogs
+import numpy as np
+# Custom
+import config_gen
+import main as simulator
+
+###############################################################################
+# Constant definitions
+###############################################################################
+
+LOG = logging.getLogger("penguin_swarm.sweep")
+
+# Per-job summary written next to the job's plots
+JOB_SUMMARY = "summary.json"
+# Combined summary written in the image dir
+SWEEP_SUMMARY = "sweep_summary.csv"
+
+###############################################################################
+# Function definitions
+###############################################################################
+
+
+def parse_args(arg_list: list[str] = None):
+    """Parse the arguments
+
+    Parameters
+    ----------
+    arg_list : list[str]
+    """
+    parser = argparse.ArgumentParser(
+        description="Run the penguin swarm parameter sweep in parallel",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument(
+        "-t",
+        "--template",
+        help="Config providing every option that is not swept",
+        type=pathlib.Path,
+        default=config_gen.TEMPLATE_CFG,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of worker processes, defaults to the number of cores",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        help="Seed of the sweep, each job gets a stream spawned from it",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "-ll",
+        "--log_level",
+        help="""Set the logging level:
+        1 = DEBUG
+        2 = INFO
+        3 = WARNING
+        4 = ERROR
+        5 = CRITICAL""",
+        type=int,
+        choices=range(1, 6),
+        default=3,
+    )
+    return parser.parse_args(args=arg_list)
+
+
+def job_seeds(seed: int, count: int) -> list[int]:
+    """Spawn independent seeds for the jobs of a sweep
+
+    Parameters
+    ----------
+    seed : int
+        Seed of the sweep
+    count : int
+        Number of jobs
+
+    Returns
+    -------
+    list[int]
+        One 32 bit seed per job, accepted by main.seed_rngs
+    """
+    children = np.random.SeedSequence(seed).spawn(count)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+
+def run_job(stem: str, sections: dict, log_level: int, seed: int) -> dict:
+    """Simulate one config of the sweep in a worker process
+
+    Parameters
+    ----------
+    stem : str
+        Name of the job, used for its image dir
+    sections : dict
+        Config as nested dictionaries, since ConfigParser is not picklable
+    log_level : int
+        Minimum logging level
+    seed : int
+        Seed of the global random and NumPy generators of this job
+
+    Returns
+    -------
+    dict
+        Summary of the run, also written to JOB_SUMMARY in its image dir
+    """
+    config = configparser.ConfigParser()
+    config.read_dict(sections)
+    simulator.seed_rngs(seed)
+    image_dir = simulator.prepare_image_dir(config, stem)
+    start = time.perf_counter()
+    env = simulator.build_simulation(config, image_dir, log_level)
+    env.run()
+    summary = {
+        "stem": stem,
+        "seed": seed,
+        **env.summary(),
+        "wall_time": time.perf_counter() - start,
+    }
+    with open(image_dir.joinpath(JOB_SUMMARY), "w") as summary_file:
+        json.dump(summary, summary_file, indent=4)
+    return summary
+
+
+###############################################################################
+# Main function
+###############################################################################
+
+
+def main(template: pathlib.Path, jobs: int, seed: int, log_level: int) -> int:
+    """Main function
+
+    Parameters
+    ----------
+    template : pathlib.Path
+        Config providing every option that is not swept
+    jobs : int
+        Number of worker processes
+    seed : int
+        Seed of the sweep
+    log_level : int
+        Minimum logging level
+    """
+    coloredlogs.install(
+        level=log_level * 10,
+        logger=LOG,
+        milliseconds=True,
+    )
+
+    configs = list(config_gen.generate_configs(template.resolve()))
+    if not configs:
+        LOG.error("Could not read config file")
+        return 1
+    for stem, config in configs:
+        if not simulator.validate_config(config):
+            LOG.error(f"Invalid config {stem}")
+            return 1
+
+    LOG.info(f"Running {len(configs)} configs on {jobs} workers")
+    start = time.perf_counter()
+    summaries = dict()
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(run_job, stem,
+                        {name: dict(config[name])
+                         for name in config.sections()}, log_level,
+                        job_seed): stem
+            for (stem, config), job_seed in zip(
+                configs, job_seeds(seed, len(configs)))
+        }
+        for future in concurrent.futures.as_completed(futures):
+            stem = futures[future]
+            try:
+                summaries[stem] = future.result()
+            except Exception as error:
+                LOG.error(f"Job {stem} failed: {error!r}")
+                failed += 1
+                continue
+            LOG.info(f"Finished {stem} in "
+                     f"{summaries[stem]['wall_time']:.1f} s")
+
+    # Rows follow the grid order, not the completion order
+    rows = [summaries[stem] for stem, _ in configs if stem in summaries]
+    if rows:
+        image_dir = simulator.PROJ_DIR.joinpath(
+            configs[0][1]["paths"]["image_dir"])
+        csv_path = image_dir.joinpath(SWEEP_SUMMARY)
+        with open(csv_path, "w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        LOG.info(f"Sweep summary saved in:\n{csv_path}")
+    LOG.info(f"Done {len(rows)}/{len(configs)} configs in "
+             f"{time.perf_counter() - start:.1f} s.")
+    logging.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    import sys
+    args = parse_args()
+    sys.exit(main(**vars(args)))
@@ -0,0 +1,1278 @@
+# -*- coding: utf-8 -*-
+"""This module contains the array kernels of the thermal models.
+
+The kernels operate on the arrays of a SwarmState and never touch Agent
+objects, so their cost is dominated by NumPy arithmetic instead of Python
+attribute dispatch.
+"""
+# Standard library
+from __future__ import annotations
+from typing import Callable, NamedTuple
+import functools
+# Packages
+import numpy as np
+# Custom
+from spatial import (diamond_offsets, footprint_cells, footprint_groups,
+                     gather_footprints)
+from swarm_state import SwarmState
+
+# Specific heat of a penguin body in J/(kg*K)
+PENGUIN_SPECIFIC_HEAT = 3E3
+# Depth of each cell in m, the model is a thin 2D slab
+CELL_DEPTH = 1.1
+
+
+def _pair_conductance(rows: np.ndarray, cols: np.ndarray,
+                      radius: np.ndarray, insulation_res: np.ndarray,
+                      air_res_per_m: float, grid_size: float, start: int,
+                      stop: int) -> np.ndarray:
+    """Get the conductance from every agent to the agents of a block.
+
+    See population_heat_flow for the parameters.
+
+    Returns
+    -------
+    np.ndarray[float]
+        Conductance in W/K in the form (..., stop - start, N), 0 between an
+        agent and itself.
+    """
+    block = slice(start, stop)
+    # Gap between bodies in m
+    dist = (np.abs(rows[..., block, None] - rows[..., None, :]) +
+            np.abs(cols[..., block, None] - cols[..., None, :]) -
+            radius[..., block, None] - radius[..., None, :] + 1) * grid_size
+    heat_res = (insulation_res[..., block, None] +
+                insulation_res[..., None, :] + dist * air_res_per_m)
+    # No self exchange
+    heat_res[..., np.arange(stop - start), np.arange(start, stop)] = np.inf
+    return np.reciprocal(heat_res, out=heat_res)
+
+
+def population_heat_flow(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    radius: np.ndarray,
+    core: np.ndarray,
+    insulation_res: np.ndarray,
+    air_res_per_m: float,
+    grid_size: float,
+    chunk_size: int = 0,
+) -> np.ndarray:
+    """Compute the heat every agent receives from all other agents.
+
+    Every array may carry leading batch dimensions, for example one per
+    replicate of an ensemble. Agents only exchange heat with the agents of
+    the same batch entry.
+
+    Parameters
+    ----------
+    rows, cols : np.ndarray[int]
+        Agent centres in the form (..., N).
+    radius : np.ndarray[int]
+        Agent body radii.
+    core : np.ndarray[float]
+        Agent core temperatures.
+    insulation_res : np.ndarray[float]
+        Thermal resistance of the insulation of each agent in K/W.
+    air_res_per_m : float
+        Thermal resistance of air per metre of separation in K/(W*m).
+    grid_size : float
+        Size of each cell in m.
+    chunk_size : int
+        Number of receiving agents per block. The pairwise matrices are
+        ``chunk_size x N`` instead of ``N x N``. 0 processes everything in
+        one block.
+
+    Returns
+    -------
+    np.ndarray[float]
+        Net heat flow into each agent in W.
+    """
+    count = core.shape[-1]
+    chunk_size = count if chunk_size <= 0 else chunk_size
+    heat_flow = np.empty(shape=core.shape, dtype=float)
+    for start in range(0, count, chunk_size):
+        stop = min(start + chunk_size, count)
+        block = slice(start, stop)
+        conductance = _pair_conductance(rows, cols, radius, insulation_res,
+                                        air_res_per_m, grid_size, start, stop)
+        heat_flow[..., block] = (
+            np.matmul(conductance, core[..., None])[..., 0] -
+            conductance.sum(axis=-1) * core[..., block])
+    return heat_flow
+
+
+def _near_pairs(rows: np.ndarray, cols: np.ndarray,
+                cutoff: int) -> tuple[np.ndarray]:
+    """Find every ordered pair of agents closer than a Manhattan cutoff.
+
+    Agents are binned into square cells of side ``cutoff`` and only the
+    3 x 3 block of cells around each agent is searched.
+
+    Returns
+    -------
+    tuple[np.ndarray]
+        Receiving and sending agent index of every pair.
+    """
+    count = len(rows)
+    bin_rows = rows // cutoff
+    bin_cols = cols // cutoff
+    width = int(bin_cols.max()) + 3 if count else 1
+    key = (bin_rows + 1) * width + bin_cols + 1
+    order = np.argsort(key, kind="stable")
+    sorted_key = key[order]
+    receivers, senders = list(), list()
+    for d_row in (-1, 0, 1):
+        for d_col in (-1, 0, 1):
+            other = key + d_row * width + d_col
+            low = np.searchsorted(sorted_key, other, side="left")
+            high = np.searchsorted(sorted_key, other, side="right")
+            counts = high - low
+            receiver = np.repeat(np.arange(count), counts)
+            # Position of each pair inside its receiver's run of senders
+            run = np.arange(len(receiver)) - np.repeat(
+                np.cumsum(counts) - counts, counts)
+            receivers.append(receiver)
+            senders.append(order[np.repeat(low, counts) + run])
+    receiver = np.concatenate(receivers)
+    sender = np.concatenate(senders)
+    dist = (np.abs(rows[receiver] - rows[sender]) +
+            np.abs(cols[receiver] - cols[sender]))
+    keep = (dist < cutoff) & (receiver != sender)
+    return receiver[keep], sender[keep]
+
+
+@functools.lru_cache(maxsize=4)
+def _mesh_kernel_fft(
+    mesh_shape: tuple[int],
+    cell_size: int,
+    cutoff: int,
+    insulation_res: float,
+    radius: float,
+    air_res_per_m: float,
+    grid_size: float,
+) -> np.ndarray:
+    """FFT of the far-field conductance kernel on the zero padded mesh."""
+    pad_shape = (2 * mesh_shape[0], 2 * mesh_shape[1])
+    d_row = np.fft.fftfreq(pad_shape[0], 1 / pad_shape[0])[:, None]
+    d_col = np.fft.fftfreq(pad_shape[1], 1 / pad_shape[1])[None, :]
+    dist = cell_size * (np.abs(d_row) + np.abs(d_col))
+    # Flat core inside the cutoff, the near field is summed exactly
+    dist = np.maximum(dist, cutoff)
+    kernel = 1 / (2 * insulation_res +
+                  (dist - 2 * radius + 1) * grid_size * air_res_per_m)
+    return np.fft.rfft2(kernel)
+
+
+def population_heat_flow_pm(
+    rows: np.ndarray,
+    cols: np.ndarray,
+    radius: np.ndarray,
+    core: np.ndarray,
+    insulation_res: np.ndarray,
+    air_res_per_m: float,
+    grid_size: float,
+    env_size: tuple[int],
+    cell_size: int = 8,
+    cutoff: int = 32,
+) -> np.ndarray:
+    """Approximate population_heat_flow with a particle-mesh method.
+
+    The pair conductance ``G(d)`` is split into a far part
+    ``G(max(d, cutoff))`` and a near part ``G(d) - G(cutoff)`` that is zero
+    beyond the cutoff. The far part is applied to every pair by depositing
+    the agents on a coarse mesh and convolving with the kernel via FFT. The
+    near part is summed exactly over the pairs closer than the cutoff.
+
+    The far field uses the mean insulation and body radius of the swarm, so
+    the approximation is exact for uniform swarms up to the positions of
+    the agents inside their mesh cells.
+
+    Parameters
+    ----------
+    rows, cols, radius, core, insulation_res, air_res_per_m, grid_size
+        See population_heat_flow.
+    env_size : tuple[int]
+        Size of the environment (rows, cols).
+    cell_size : int
+        Side of each mesh cell in tiles.
+    cutoff : int
+        Manhattan distance in tiles below which pairs are summed exactly.
+        It should be at least twice ``cell_size``.
+
+    Returns
+    -------
+    np.ndarray[float]
+        Net heat flow into each agent in W.
+    """
+    mesh_shape = (-(-env_size[0] // cell_size), -(-env_size[1] // cell_size))
+    pad_shape = (2 * mesh_shape[0], 2 * mesh_shape[1])
+    mean_res = float(np.mean(insulation_res))
+    mean_radius = float(np.mean(radius))
+    kernel = _mesh_kernel_fft(mesh_shape, cell_size, cutoff, mean_res,
+                              mean_radius, air_res_per_m, grid_size)
+    # Nearest grid point deposit of temperature and agent count
+    cell_rows = rows // cell_size
+    cell_cols = cols // cell_size
+    temp_mesh = np.zeros(shape=pad_shape, dtype=float)
+    count_mesh = np.zeros(shape=pad_shape, dtype=float)
+    np.add.at(temp_mesh, (cell_rows, cell_cols), core)
+    np.add.at(count_mesh, (cell_rows, cell_cols), 1.0)
+    temp_field = np.fft.irfft2(np.fft.rfft2(temp_mesh) * kernel, pad_shape)
+    count_field = np.fft.irfft2(np.fft.rfft2(count_mesh) * kernel, pad_shape)
+    heat_flow = (temp_field[cell_rows, cell_cols] -
+                 core * count_field[cell_rows, cell_cols])
+    # Exact near field minus the flat core the mesh already applied
+    receiver, sender = _near_pairs(rows, cols, cutoff)
+    dist = (np.abs(rows[receiver] - rows[sender]) +
+            np.abs(cols[receiver] - cols[sender]) - radius[receiver] -
+            radius[sender] + 1) * grid_size
+    exact = 1 / (insulation_res[receiver] + insulation_res[sender] +
+                 dist * air_res_per_m)
+    flat = 1 / (2 * mean_res +
+                (cutoff - 2 * mean_radius + 1) * grid_size * air_res_per_m)
+    np.add.at(heat_flow, receiver,
+              (exact - flat) * (core[sender] - core[receiver]))
+    return heat_flow
+
+
+def heat_flow_error(approximate: np.ndarray, exact: np.ndarray) -> float:
+    """Maximum error of an approximate heat flow relative to the exact one.
+
+    The error is normalised by the largest exact heat flow magnitude.
+    """
+    scale = np.max(np.abs(exact)) if len(exact) else 0.0
+    if scale == 0.0:
+        return 0.0
+    return float(np.max(np.abs(approximate - exact)) / scale)
+
+
+def simple_thermal_step(
+    state: SwarmState,
+    grid_size: float,
+    time_step_size: float,
+    ambient_temp: float,
+    air_conductivity: float,
+    pair_kernel: Callable = population_heat_flow,
+    index: np.ndarray = slice(None),
+    core: np.ndarray = None,
+) -> np.ndarray:
+    """Advance the lumped thermal model by one time step.
+
+    Each agent is a single thermal mass. It gains heat from metabolism,
+    loses heat to the ambient air and exchanges heat with every other agent.
+
+    Parameters
+    ----------
+    state : SwarmState or EnsembleState
+        Swarm to advance, the arrays of an EnsembleState carry a leading
+        replicate dimension. It is not modified.
+    grid_size : float
+        Size of each cell in m.
+    time_step_size : float
+        Time step in s.
+    ambient_temp : float
+        Ambient air temperature.
+    air_conductivity : float
+        Thermal conductivity of air.
+    pair_kernel : Callable
+        Population heat flow kernel taking the arguments of
+        population_heat_flow up to ``grid_size``, for example
+        population_heat_flow_pm with its extra arguments bound.
+    index : np.ndarray[int] or slice
+        Agents to advance, the others are left out of the exchange. Every
+        agent by default.
+    core : np.ndarray[float]
+        Core temperatures of the selected agents to advance instead of
+        those of the state, for example between sub-steps.
+
+    Returns
+    -------
+    np.ndarray[float]
+        New core temperature of each selected agent.
+    """
+    area = grid_size * CELL_DEPTH
+    volume = pow(grid_size, 2) * CELL_DEPTH
+    if core is None:
+        core = state.core_temp[..., index]
+    insulation_res = state.insulation_thickness[..., index] / (
+        state.external_conductivity[..., index] * area)
+    q_meta = state.metabolism[..., index] * volume
+    q_env = state.internal_conductivity[..., index] * area * (ambient_temp -
+                                                               core)
+    q_pop = pair_kernel(
+        state.rows[..., index],
+        state.cols[..., index],
+        state.body_radius[..., index],
+        core,
+        insulation_res,
+        1 / (air_conductivity * area),
+        grid_size,
+    )
+    heat = (q_meta + q_env + q_pop) * time_step_size
+    return core + heat / (state.density[..., index] * volume *
+                          PENGUIN_SPECIFIC_HEAT)
+
+
+class ThermalModes(NamedTuple):
+    """Eigenmodes of the lumped thermal model with the agents held still.
+
+    With fixed positions simple_thermal_step is the affine map
+    ``T' = M T + c``, so after k steps
+    ``T_k = fixed_point + modes @ (decay**k * (projection @ (T_0 -
+    fixed_point)))``. M is similar to a symmetric matrix through the heat
+    capacities, so its eigenvalues are real.
+
+    Attributes
+    ----------
+    fixed_point : np.ndarray[float]
+        Core temperatures the model converges to.
+    decay : np.ndarray[float]
+        Eigenvalue of each mode, the factor it is multiplied by each step.
+    modes : np.ndarray[float]
+        Core temperatures of each mode in the form (N, modes).
+    projection : np.ndarray[float]
+        Inverse of modes in the form (modes, N).
+    """
+    fixed_point: np.ndarray
+    decay: np.ndarray
+    modes: np.ndarray
+    projection: np.ndarray
+
+
+def simple_thermal_modes(
+    state: SwarmState,
+    grid_size: float,
+    time_step_size: float,
+    ambient_temp: float,
+    air_conductivity: float,
+    index: np.ndarray = slice(None),
+) -> ThermalModes:
+    """Decompose simple_thermal_step with the exact pairwise exchange.
+
+    See simple_thermal_step for the parameters. The cost is one symmetric
+    eigendecomposition of an N x N matrix.
+
+    Raises
+    ------
+    ValueError
+        If a mode grows, because the time step is above the stability limit
+        of the explicit step.
+    """
+    area = grid_size * CELL_DEPTH
+    volume = pow(grid_size, 2) * CELL_DEPTH
+    insulation_res = state.insulation_thickness[index] / (
+        state.external_conductivity[index] * area)
+    rows = state.rows[index]
+    conductance = _pair_conductance(rows, state.cols[index],
+                                    state.body_radius[index], insulation_res,
+                                    1 / (air_conductivity * area), grid_size,
+                                    0, len(rows))
+    env_conductance = state.internal_conductivity[index] * area
+    # Heat flow into each agent is laplacian @ T + source
+    laplacian = conductance
+    laplacian[np.diag_indices_from(laplacian)] = -(conductance.sum(axis=1) +
+                                                    env_conductance)
+    source = state.metabolism[index] * volume + env_conductance * ambient_temp
+    fixed_point = np.linalg.solve(laplacian, -source)
+    # M = I + D @ laplacian with D the time step over the heat capacities
+    scale = np.sqrt(time_step_size /
+                    (state.density[index] * volume * PENGUIN_SPECIFIC_HEAT))
+    decay, vectors = np.linalg.eigh(scale[:, None] * laplacian *
+                                    scale[None, :])
+    decay += 1
+    if np.any(np.abs(decay) >= 1):
+        raise ValueError("the explicit thermal step is unstable at this "
+                         "time step")
+    return ThermalModes(fixed_point, decay, scale[:, None] * vectors,
+                        vectors.T / scale[None, :])
+
+
+def evolve_simple_thermal(thermal_modes: ThermalModes, core: np.ndarray,
+                          steps: np.ndarray) -> np.ndarray:
+    """Get the core temperatures after a number of steps without moving.
+
+    Parameters
+    ----------
+    thermal_modes : ThermalModes
+        Modes returned by simple_thermal_modes.
+    core : np.ndarray[float]
+        Core temperatures of the agents of the modes.
+    steps : np.ndarray[int]
+        Numbers of steps to advance.
+
+    Returns
+    -------
+    np.ndarray[float]
+        Core temperatures in the form (steps, N).
+    """
+    weights = thermal_modes.projection @ (core - thermal_modes.fixed_point)
+    return thermal_modes.fixed_point + (
+        np.power(thermal_modes.decay, np.asarray(steps)[:, None]) *
+        weights) @ thermal_modes.modes.T
+
+
+###############################################################################
+# Full-grid model
+###############################################################################
+
+# Material map codes
+AIR = 0
+CORE = 1
+INTERNAL = 2
+EXTERNAL = 3
+# Density and specific heat of air in kg/m^3 and J/(kg*K)
+AIR_DENSITY = 1.657
+AIR_SPECIFIC_HEAT = 0.716E3
+
+
+class GridFields(NamedTuple):
+    """Per-cell fields of the full-grid model, rasterized once per epoch.
+
+    Attributes
+    ----------
+    material : np.ndarray[int]
+        Material code of each cell.
+    agent_id : np.ndarray[int]
+        Index of the agent covering each cell, -1 for air.
+    half_res : np.ndarray[float]
+        Resistance from the cell centre to its faces in K/W.
+    insulation_res : np.ndarray[float]
+        Resistance of the insulation layer of external cells in K/W.
+    heat_capacity : np.ndarray[float]
+        Heat capacity of each cell in J/K.
+    source : np.ndarray[float]
+        Metabolic heat generated in each cell in W.
+    """
+    material: np.ndarray
+    agent_id: np.ndarray
+    half_res: np.ndarray
+    insulation_res: np.ndarray
+    heat_capacity: np.ndarray
+    source: np.ndarray
+
+
+@functools.lru_cache(maxsize=None)
+def _footprint(radius: int) -> tuple[np.ndarray]:
+    """Get the cell offsets and material codes of a diamond body.
+
+    Returns
+    -------
+    tuple[np.ndarray]
+        Row offsets, column offsets and material code of every cell,
+        read-only.
+    """
+    d_row, d_col = diamond_offsets(radius)
+    material = np.full(shape=len(d_row), fill_value=INTERNAL, dtype=int)
+    # Only the tips of the diamond are insulated
+    material[(np.abs(d_row) == radius - 1) |
+             (np.abs(d_col) == radius - 1)] = EXTERNAL
+    material[(d_row == 0) & (d_col == 0)] = CORE
+    material.flags.writeable = False
+    return d_row, d_col, material
+
+
+def _footprint_cells(state: SwarmState):
+    """Yield the footprint cells of every alive agent, grouped by radius.
+
+    Yields
+    ------
+    tuple[np.ndarray]
+        Agent indices (A, 1), cell rows (A, C), cell columns (A, C), body
+        block rows (C,), body block columns (C,) and materials (C,).
+    """
+    center = state.center
+    for radius, index in footprint_groups(state):
+        d_row, d_col, material = _footprint(radius)
+        rows, cols = footprint_cells(state.rows[index], state.cols[index],
+                                     radius)
+        yield (
+            index[:, None],
+            rows,
+            cols,
+            center + d_row,
+            center + d_col,
+            material,
+        )
+
+
+def rasterize(
+    state: SwarmState,
+    thermal_map: np.ndarray,
+    grid_size: float,
+    air_conductivity: float,
+    origin: tuple[int] = (0, 0),
+    dtype: type = float,
+) -> GridFields:
+    """Rasterize the swarm onto the grid.
+
+    The body temperature of every alive agent is written into
+    ``thermal_map`` and the per-cell material fields are built.
+
+    Parameters
+    ----------
+    state : SwarmState
+        Swarm to rasterize.
+    thermal_map : np.ndarray[float]
+        Temperature of each cell, modified in place.
+    grid_size : float
+        Size of each cell in m.
+    air_conductivity : float
+        Thermal conductivity of air.
+    origin : tuple[int]
+        Environment cell of ``thermal_map[0, 0]`` when the map is a window
+        of the environment. Every alive agent must be inside the window.
+    dtype : type
+        Floating point type of the fields, see air_fields.
+
+    Returns
+    -------
+    GridFields
+        Per-cell fields for grid_heat_exchange.
+    """
+    fields = air_fields(thermal_map.shape, grid_size, air_conductivity,
+                        dtype)
+    stamp_agents(fields, state, thermal_map, grid_size, origin)
+    return fields
+
+
+def air_fields(shape: tuple[int], grid_size: float, air_conductivity: float,
+               dtype: type = float) -> GridFields:
+    """Build the fields of a grid filled with air, see rasterize.
+
+    The material codes are stored as uint8 and the agent indices as int32,
+    the other fields as ``dtype``.
+    """
+    area = grid_size * CELL_DEPTH
+    volume = pow(grid_size, 2) * CELL_DEPTH
+    return GridFields(
+        np.zeros(shape=shape, dtype=np.uint8),
+        np.full(shape=shape, fill_value=-1, dtype=np.int32),
+        np.full(shape=shape,
+                fill_value=1 / (air_conductivity * area),
+                dtype=dtype),
+        np.zeros(shape=shape, dtype=dtype),
+        np.full(shape=shape,
+                fill_value=(AIR_DENSITY * volume * AIR_SPECIFIC_HEAT),
+                dtype=dtype),
+        np.zeros(shape=shape, dtype=dtype),
+    )
+
+
+def clear_cells(fields: GridFields, cells: np.ndarray, grid_size: float,
+                air_conductivity: float) -> None:
+    """Refill cells of the fields with air.
+
+    Parameters
+    ----------
+    fields : GridFields
+        Fields modified in place.
+    cells : np.ndarray[int]
+        Flat indices of the cells.
+    grid_size, air_conductivity
+        See air_fields.
+    """
+    area = grid_size * CELL_DEPTH
+    volume = pow(grid_size, 2) * CELL_DEPTH
+    fields.material.flat[cells] = AIR
+    fields.agent_id.flat[cells] = -1
+    fields.half_res.flat[cells] = 1 / (air_conductivity * area)
+    fields.insulation_res.flat[cells] = 0.0
+    fields.heat_capacity.flat[cells] = (AIR_DENSITY * volume *
+                                        AIR_SPECIFIC_HEAT)
+    fields.source.flat[cells] = 0.0
+
+
+def stamp_agents(
+    fields: GridFields,
+    state: SwarmState,
+    thermal_map: np.ndarray,
+    grid_size: float,
+    origin: tuple[int] = (0, 0),
+) -> np.ndarray:
+    """Stamp the footprint of every alive agent into the fields.
+
+    The body temperatures are written into ``thermal_map``. See rasterize
+    for the parameters.
+
+    Returns
+    -------
+    np.ndarray[int]
+        Flat indices of the stamped cells.
+    """
+    area = grid_size * CELL_DEPTH
+    volume = pow(grid_size, 2) * CELL_DEPTH
+    material, agent_id, half_res, insulation_res, heat_capacity, source = (
+        fields)
+    stamped = list()
+    for index, rows, cols, b_rows, b_cols, mat in _footprint_cells(state):
+        rows, cols = rows - origin[0], cols - origin[1]
+        material[rows, cols] = mat
+        agent_id[rows, cols] = index
+        half_res[rows, cols] = (grid_size / 2) / (
+            state.internal_conductivity[index] * area)
+        insulation_res[rows, cols] = np.where(
+            mat == EXTERNAL,
+            state.insulation_thickness[index] /
+            (state.external_conductivity[index] * area),
+            0.0,
+        )
+        heat_capacity[rows, cols] = (state.density[index] * volume *
+                                     PENGUIN_SPECIFIC_HEAT)
+        source[rows, cols] = np.where(mat == CORE,
+                                      state.metabolism[index] * volume, 0.0)
+        thermal_map[rows, cols] = state.body_temp[index, b_rows, b_cols]
+        stamped.append(np.ravel_multi_index((rows, cols),
+                                            thermal_map.shape).ravel())
+    return np.concatenate(stamped) if stamped else np.zeros(0, dtype=int)
+
+
+def _face_conductance(fields: GridFields, axis: int) -> np.ndarray:
+    """Conductance of every face between neighbouring cells along an axis.
+
+    The fields may carry leading batch dimensions, for example one per tile.
+    Axis 0 is then the second to last axis and axis 1 the last.
+
+    Returns
+    -------
+    np.ndarray[float]
+        Conductance between cell ``k`` and ``k + 1`` along ``axis``.
+    """
+    def low(array):
+        return array[..., :-1, :] if axis == 0 else array[..., :-1]
+
+    def high(array):
+        return array[..., 1:, :] if axis == 0 else array[..., 1:]
+
+    material = fields.material
+    # Insulation only applies where an external cell faces air or another
+    # external cell
+    open_face = (material == AIR) | (material == EXTERNAL)
+    res = low(fields.half_res) + high(fields.half_res)
+    res = res + np.where(
+        (low(material) == EXTERNAL) & high(open_face),
+        low(fields.insulation_res), 0.0)
+    res = res + np.where(
+        (high(material) == EXTERNAL) & low(open_face),
+        high(fields.insulation_res), 0.0)
+    return 1 / res
+
+
+class GridOperator(NamedTuple):
+    """Linear heat flow operator of the full-grid model.
+
+    The heat flow into the cells is ``source + sink * (ambient - T)`` plus
+    the flux through every face, so it is linear in the temperature ``T``.
+
+    Attributes
+    ----------
+    vertical : np.ndarray[float]
+        Conductance between cell (i, j) and (i + 1, j) in W/K.
+    horizontal : np.ndarray[float]
+        Conductance between cell (i, j) and (i, j + 1) in W/K.
+    sink : np.ndarray[float]
+        Conductance from each cell to the ambient air in W/K.
+    load : np.ndarray[float]
+        Temperature independent heat flow into each cell in W.
+    """
+    vertical: np.ndarray
+    horizontal: np.ndarray
+    sink: np.ndarray
+    load: np.ndarray
+
+
+def grid_operator(
+    fields: GridFields,
+    grid_size: float,
+    ambient_temp: float,
+    air_conductivity: float,
+) -> GridOperator:
+    """Build the heat flow operator for the current rasterization.
+
+    Parameters
+    ----------
+    fields : GridFields
+        Per-cell fields from rasterize.
+    grid_size : float
+        Size of each cell in m.
+    ambient_temp : float
+        Ambient air temperature.
+    air_conductivity : float
+        Thermal conductivity of air.
+
+    Returns
+    -------
+    GridOperator
+        Operator for apply_operator and the integrators.
+    """
+    # Air cells relax toward the ambient temperature
+    sink = np.where(fields.material == AIR,
+                    air_conductivity * 4 * grid_size * CELL_DEPTH,
+                    0.0).astype(fields.half_res.dtype, copy=False)
+    return GridOperator(
+        _face_conductance(fields, 0),
+        _face_conductance(fields, 1),
+        sink,
+        fields.source + sink * ambient_temp,
+    )
+
+
+def _face_flux(operator: GridOperator, thermal_map: np.ndarray,
+               axis: int) -> np.ndarray:
+    """Net heat flow into each cell through the faces along one axis."""
+    heat = np.zeros_like(thermal_map)
+    if axis == 0:
+        flux = operator.vertical * np.diff(thermal_map, axis=0)
+        heat[:-1] += flux
+        heat[1:] -= flux
+    else:
+        flux = operator.horizontal * np.diff(thermal_map, axis=1)
+        heat[:, :-1] += flux
+        heat[:, 1:] -= flux
+    return heat
+
+
+def apply_operator(operator: GridOperator,
+                   thermal_map: np.ndarray) -> np.ndarray:
+    """Compute the net heat flow into every cell in W."""
+    return (operator.load - operator.sink * thermal_map +
+            _face_flux(operator, thermal_map, 0) +
+            _face_flux(operator, thermal_map, 1))
+
+
+def grid_heat_exchange(
+    thermal_map: np.ndarray,
+    fields: GridFields,
+    grid_size: float,
+    ambient_temp: float,
+    air_conductivity: float,
+) -> np.ndarray:
+    """Compute the net heat flow into every cell of the grid.
+
+    Parameters
+    ----------
+    thermal_map : np.ndarray[float]
+        Temperature of each cell.
+    fields : GridFields
+        Per-cell fields from rasterize.
+    grid_size : float
+        Size of each cell in m.
+    ambient_temp : float
+        Ambient air temperature.
+    air_conductivity : float
+        Thermal conductivity of air.
+
+    Returns
+    -------
+    np.ndarray[float]
+        Heat flow into each cell in W.
+    """
+    operator = grid_operator(fields, grid_size, ambient_temp,
+                             air_conductivity)
+    return apply_operator(operator, thermal_map)
+
+
+def block_heat_exchange(
+    temps: np.ndarray,
+    fields: GridFields,
+    grid_size: float,
+    ambient_temp: float,
+    air_conductivity: float,
+) -> tuple[np.ndarray, tuple[np.ndarray]]:
+    """Compute the net heat flow into the inner cells of halo blocks.
+
+    Each block is a tile of the grid with a one cell halo on every side.
+    The heat flow into an inner cell matches grid_heat_exchange over the
+    whole grid.
+
+    Parameters
+    ----------
+    temps : np.ndarray[float]
+        Temperature of the cells of each block in the form (K, n + 2, m + 2).
+    fields : GridFields
+        Fields of the same cells. Only ``material``, ``half_res``,
+        ``insulation_res`` and ``source`` are read, ``source`` of the inner
+        cells only in the form (K, n, m).
+    grid_size : float
+        Size of each cell in m.
+    ambient_temp : float
+        Ambient air temperature.
+    air_conductivity : float
+        Thermal conductivity of air.
+
+    Returns
+    -------
+    np.ndarray[float]
+        Heat flow into each inner cell in W in the form (K, n, m).
+    tuple[np.ndarray]
+        Heat flow into the halo cells of the top, bottom, left and right
+        sides in W, without the corners.
+    """
+    inner = (slice(None), slice(1, -1), slice(1, -1))
+    vertical = _face_conductance(fields, 0)[:, :, 1:-1]
+    horizontal = _face_conductance(fields, 1)[:, 1:-1, :]
+    vertical_flux = vertical * np.diff(temps[:, :, 1:-1], axis=1)
+    horizontal_flux = horizontal * np.diff(temps[:, 1:-1, :], axis=2)
+    # Air cells relax toward the ambient temperature
+    sink = np.where(fields.material[inner] == AIR,
+                    air_conductivity * 4 * grid_size * CELL_DEPTH,
+                    0.0).astype(fields.half_res.dtype, copy=False)
+    load = fields.source + sink * ambient_temp
+    heat = (load - sink * temps[inner] +
+            (vertical_flux[:, 1:] - vertical_flux[:, :-1]) +
+            (horizontal_flux[:, :, 1:] - horizontal_flux[:, :, :-1]))
+    return heat, (vertical_flux[:, 0], -vertical_flux[:, -1],
+                  horizontal_flux[:, :, 0], -horizontal_flux[:, :, -1])
+
+
+###############################################################################
+# Time integration of the full-grid model
+###############################################################################
+
+# Integrators selectable with the thermal_integrator option
+INTEGRATORS = ("explicit", "implicit", "adi")
+
+
+def explicit_time_step_limit(
+    grid_size: float,
+    air_conductivity: float,
+    internal_conductivity: float,
+    density: float,
+) -> float:
+    """Largest safe time step of the explicit integrator.
+
+    This is the positivity limit ``dt < C / sum(G)`` of each cell: below
+    it, every new temperature is a weighted mean of the old ones and the
+    ambient temperature with non-negative weights, so no cell overshoots
+    its neighbours. It is half the Gershgorin stability limit
+    ``dt < 2 C / sum(G)``. The worst cells are either surrounded by air or
+    by penguin tissue. Faces between different materials have a lower
+    conductance.
+
+    Parameters
+    ----------
+    grid_size : float
+        Size of each cell in m.
+    air_conductivity : float
+        Thermal conductivity of air.
+    internal_conductivity : float
+        Thermal conductivity within the penguins.
+    density : float
+        Density of the penguins.
+
+    Returns
+    -------
+    float
+        Time step limit in s.
+    """
+    area = grid_size * CELL_DEPTH
+    volume = pow(grid_size, 2) * CELL_DEPTH
+    # Air: four faces plus the ambient sink
+    air_limit = (AIR_DENSITY * volume * AIR_SPECIFIC_HEAT) / (
+        4 * air_conductivity * area / 2 + 4 * air_conductivity * area)
+    # Tissue: four faces of two half cells each
+    tissue_limit = (density * volume * PENGUIN_SPECIFIC_HEAT) / (
+        4 * internal_conductivity * area / grid_size)
+    return min(air_limit, tissue_limit)
+
+
+def _solve_tridiagonal(lower: np.ndarray, diag: np.ndarray,
+                       upper: np.ndarray, rhs: np.ndarray) -> np.ndarray:
+    """Solve independent tridiagonal systems along axis 0.
+
+    Every column of ``rhs`` is its own system. ``lower[k]`` couples row k to
+    row k - 1 and ``upper[k]`` couples row k to row k + 1, both have one
+    row less than ``diag``.
+    """
+    count = diag.shape[0]
+    c_prime = np.empty_like(upper)
+    d_prime = np.empty_like(rhs)
+    c_prime[0] = upper[0] / diag[0]
+    d_prime[0] = rhs[0] / diag[0]
+    for k in range(1, count):
+        denom = diag[k] - lower[k - 1] * c_prime[k - 1]
+        if k < count - 1:
+            c_prime[k] = upper[k] / denom
+        d_prime[k] = (rhs[k] - lower[k - 1] * d_prime[k - 1]) / denom
+    solution = np.empty_like(rhs)
+    solution[-1] = d_prime[-1]
+    for k in range(count - 2, -1, -1):
+        solution[k] = d_prime[k] - c_prime[k] * solution[k + 1]
+    return solution
+
+
+def _adi_sweep(conductance: np.ndarray, weight: np.ndarray,
+               rhs: np.ndarray) -> np.ndarray:
+    """Solve ``(weight + K) T = rhs`` for the 1D conduction along axis 0."""
+    diag = weight.copy()
+    diag[:-1] += conductance
+    diag[1:] += conductance
+    return _solve_tridiagonal(-conductance, diag, -conductance, rhs)
+
+
+def _step_adi(operator: GridOperator, capacity: np.ndarray,
+              thermal_map: np.ndarray, time_step: float) -> np.ndarray:
+    """Peaceman-Rachford alternating direction implicit step."""
+    weight = 2 * capacity / time_step
+    half_sink = operator.sink / 2
+    # Implicit along the rows, explicit along the columns
+    rhs = ((weight - half_sink) * thermal_map +
+           _face_flux(operator, thermal_map, 0) + operator.load)
+    half_step = _adi_sweep(operator.horizontal.T, (weight + half_sink).T,
+                           rhs.T).T
+    # Implicit along the columns, explicit along the rows
+    rhs = ((weight - half_sink) * half_step +
+           _face_flux(operator, half_step, 1) + operator.load)
+    return _adi_sweep(operator.vertical, weight + half_sink, rhs)
+
+
+def _step_implicit(
+    operator: GridOperator,
+    capacity: np.ndarray,
+    thermal_map: np.ndarray,
+    time_step: float,
+    tolerance: float = 1E-10,
+    max_iterations: int = 1000,
+) -> np.ndarray:
+    """Backward Euler step solved with preconditioned conjugate gradients.
+
+    The system ``(C / dt + K) T = C / dt * T0 + load`` is symmetric positive
+    definite, so Jacobi preconditioned CG converges without forming the
+    sparse matrix.
+    """
+    weight = capacity / time_step + operator.sink
+
+    def matvec(values):
+        return (weight * values - _face_flux(operator, values, 0) -
+                _face_flux(operator, values, 1))
+
+    diag = _operator_diagonal(operator, weight)
+    rhs = capacity / time_step * thermal_map + operator.load
+    return _conjugate_gradient(matvec, diag, rhs, thermal_map, tolerance,
+                               max_iterations)
+
+
+def _operator_diagonal(operator: GridOperator,
+                       weight: np.ndarray) -> np.ndarray:
+    """Add the face conductances of every cell to a copy of its weight."""
+    diag = weight.copy()
+    diag[:-1] += operator.vertical
+    diag[1:] += operator.vertical
+    diag[:, :-1] += operator.horizontal
+    diag[:, 1:] += operator.horizontal
+    return diag
+
+
+def _conjugate_gradient(
+    matvec: Callable,
+    diag: np.ndarray,
+    rhs: np.ndarray,
+    guess: np.ndarray,
+    tolerance: float,
+    max_iterations: int,
+) -> np.ndarray:
+    """Solve a symmetric positive definite system with Jacobi PCG."""
+    solution = guess.copy()
+    residual = rhs - matvec(solution)
+    precond = residual / diag
+    direction = precond.copy()
+    rz_old = np.vdot(residual, precond)
+    limit = tolerance * np.linalg.norm(rhs)
+    for _ in range(max_iterations):
+        if np.linalg.norm(residual) <= limit:
+            break
+        a_dir = matvec(direction)
+        alpha = rz_old / np.vdot(direction, a_dir)
+        solution += alpha * direction
+        residual -= alpha * a_dir
+        precond = residual / diag
+        rz_new = np.vdot(residual, precond)
+        direction = precond + (rz_new / rz_old) * direction
+        rz_old = rz_new
+    return solution
+
+
+def grid_step(
+    thermal_map: np.ndarray,
+    fields: GridFields,
+    grid_size: float,
+    time_step_size: float,
+    ambient_temp: float,
+    air_conductivity: float,
+    integrator: str = "explicit",
+    heat_flow: Callable = apply_operator,
+) -> np.ndarray:
+    """Advance the full-grid model by one time step.
+
+    Parameters
+    ----------
+    thermal_map : np.ndarray[float]
+        Temperature of each cell.
+    fields : GridFields
+        Per-cell fields from rasterize.
+    grid_size : float
+        Size of each cell in m.
+    time_step_size : float
+        Time step in s.
+    ambient_temp : float
+        Ambient air temperature.
+    air_conductivity : float
+        Thermal conductivity of air.
+    integrator : str
+        One of INTEGRATORS. "explicit" is forward Euler and is only stable
+        below explicit_time_step_limit. "implicit" is backward Euler and
+        "adi" is Peaceman-Rachford ADI, both are stable at any time step.
+        ADI is cheaper per step but stiff air cells ring at very large
+        steps, where "implicit" damps them.
+    heat_flow : Callable
+        Stencil of the explicit integrator, apply_operator or a backend
+        version of it.
+
+    Returns
+    -------
+    np.ndarray[float]
+        New temperature of each cell.
+    """
+    operator = grid_operator(fields, grid_size, ambient_temp,
+                             air_conductivity)
+    return advance_grid(operator, fields.heat_capacity, thermal_map,
+                        time_step_size, integrator, heat_flow)
+
+
+def advance_grid(
+    operator: GridOperator,
+    heat_capacity: np.ndarray,
+    thermal_map: np.ndarray,
+    time_step_size: float,
+    integrator: str = "explicit",
+    heat_flow: Callable = apply_operator,
+) -> np.ndarray:
+    """Advance the full-grid model by one step of a prebuilt operator.
+
+    See grid_step, which builds the operator from the rasterized fields.
+    Sub-steps of one epoch share the operator.
+    """
+    if integrator != "explicit":
+        # The solvers combine the coefficients before they multiply the
+        # temperatures, so they run in the type of the map
+        operator = GridOperator(*(
+            array.astype(thermal_map.dtype, copy=False)
+            for array in operator))
+        heat_capacity = heat_capacity.astype(thermal_map.dtype, copy=False)
+    if integrator == "implicit":
+        return _step_implicit(operator, heat_capacity, thermal_map,
+                              time_step_size)
+    if integrator == "adi":
+        return _step_adi(operator, heat_capacity, thermal_map,
+                         time_step_size)
+    heat_exchange = heat_flow(operator, thermal_map)
+    return thermal_map + ((heat_exchange / heat_capacity) * time_step_size)
+
+###############################################################################
+# Two-level grid, see refinement.TwoLevelGrid
+###############################################################################
+
+# Integrators of the two-level grid, ADI sweeps cannot cross the interface
+TWO_LEVEL_INTEGRATORS = ("explicit", "implicit")
+
+
+class TwoLevelOperator(NamedTuple):
+    """Linear heat flow operator of a fine window inside a coarse grid.
+
+    The temperatures of both levels are packed in one vector, the fine
+    cells first. Every face between the window and a coarse cell outside it
+    carries the same flux into the fine cell as out of the coarse cell, so
+    heat is conserved across the interface.
+
+    Attributes
+    ----------
+    fine, coarse : GridOperator
+        Operators of each level on its own. The coarse cells under the
+        window have no faces, sink or load.
+    fine_index, coarse_index : np.ndarray[int]
+        Flat index of the fine and the coarse cell of each interface face.
+    conductance : np.ndarray[float]
+        Conductance of each interface face in W/K.
+    """
+    fine: GridOperator
+    coarse: GridOperator
+    fine_index: np.ndarray
+    coarse_index: np.ndarray
+    conductance: np.ndarray
+
+
+def _two_level_split(operator: TwoLevelOperator,
+                     values: np.ndarray) -> tuple[np.ndarray]:
+    """Unpack the fine and coarse temperatures of a packed vector."""
+    fine_shape = operator.fine.sink.shape
+    fine_size = operator.fine.sink.size
+    return (values[:fine_size].reshape(fine_shape),
+            values[fine_size:].reshape(operator.coarse.sink.shape))
+
+
+def _two_level_pack(fine: np.ndarray, coarse: np.ndarray) -> np.ndarray:
+    """Pack fine and coarse cell values into one vector."""
+    return np.concatenate((fine.ravel(), coarse.ravel()))
+
+
+def _two_level_flux(operator: TwoLevelOperator,
+                    values: np.ndarray) -> np.ndarray:
+    """Net heat flow into every cell through faces, packed."""
+    fine, coarse = _two_level_split(operator, values)
+    flux = operator.conductance * (coarse.ravel()[operator.coarse_index] -
+                                   fine.ravel()[operator.fine_index])
+    return _two_level_pack(
+        _face_flux(operator.fine, fine, 0) +
+        _face_flux(operator.fine, fine, 1) + np.bincount(
+            operator.fine_index, flux, fine.size).reshape(fine.shape),
+        _face_flux(operator.coarse, coarse, 0) +
+        _face_flux(operator.coarse, coarse, 1) - np.bincount(
+            operator.coarse_index, flux, coarse.size).reshape(coarse.shape),
+    )
+
+
+def advance_two_level(
+    operator: TwoLevelOperator,
+    heat_capacity: np.ndarray,
+    values: np.ndarray,
+    time_step_size: float,
+    integrator: str = "explicit",
+    tolerance: float = 1E-10,
+    max_iterations: int = 1000,
+) -> np.ndarray:
+    """Advance a two-level grid by one time step.
+
+    Parameters
+    ----------
+    operator : TwoLevelOperator
+        Operator of both levels and their interface.
+    heat_capacity : np.ndarray[float]
+        Heat capacity of every cell in J/K, packed.
+    values : np.ndarray[float]
+        Temperature of every cell, packed.
+    time_step_size : float
+        Time step in s.
+    integrator : str
+        One of TWO_LEVEL_INTEGRATORS, see grid_step.
+    tolerance, max_iterations
+        Convergence of the implicit solve.
+
+    Returns
+    -------
+    np.ndarray[float]
+        New temperature of every cell, packed.
+    """
+    sink = _two_level_pack(operator.fine.sink, operator.coarse.sink)
+    load = _two_level_pack(operator.fine.load, operator.coarse.load)
+    if integrator == "explicit":
+        heat_exchange = (load - sink * values +
+                         _two_level_flux(operator, values))
+        return values + ((heat_exchange / heat_capacity) * time_step_size)
+    weight = heat_capacity / time_step_size + sink
+
+    def matvec(packed):
+        return weight * packed - _two_level_flux(operator, packed)
+
+    diag = _two_level_pack(
+        _operator_diagonal(operator.fine, np.zeros_like(operator.fine.sink)),
+        _operator_diagonal(operator.coarse,
+                           np.zeros_like(operator.coarse.sink)))
+    diag = weight + diag + np.bincount(
+        np.concatenate((operator.fine_index,
+                        operator.coarse_index + operator.fine.sink.size)),
+        np.tile(operator.conductance, 2), len(values))
+    rhs = heat_capacity / time_step_size * values + load
+    return _conjugate_gradient(matvec, diag, rhs, values, tolerance,
+                               max_iterations)
+
+###############################################################################
+
+# Bounds of the factor between successive adaptive sub-steps
+SUBSTEP_SAFETY = 0.9
+SUBSTEP_MIN_FACTOR = 0.2
+SUBSTEP_MAX_FACTOR = 2.0
+# Shortest sub-step relative to the duration, accepted whatever its error
+SUBSTEP_MIN_FRACTION = 1E-6
+
+
+def integrate_adaptive(
+    step: Callable,
+    values: np.ndarray,
+    duration: float,
+    tolerance: float,
+    first_step: float = None,
+    max_step: float = np.inf,
+) -> tuple[np.ndarray, float, int, int]:
+    """Integrate a first-order step function in adaptive sub-steps.
+
+    Each sub-step is taken once whole and once as two halves. Their largest
+    difference estimates the local error of the halves, which are kept when
+    it is within the tolerance. The local error of a first-order step grows
+    with the square of its length, which sizes the next sub-step.
+
+    Parameters
+    ----------
+    step : Callable
+        ``step(values, h)`` advancing the values by ``h`` seconds.
+    values : np.ndarray[float]
+        Temperatures at the start of the duration.
+    duration : float
+        Time to integrate in s.
+    tolerance : float
+        Largest accepted local error of a sub-step in degrees C.
+    first_step : float
+        Trial length of the first sub-step in s, the duration by default.
+    max_step : float
+        Longest sub-step in s, for example a stability limit.
+
+    Returns
+    -------
+    values : np.ndarray[float]
+        Temperatures at the end of the duration.
+    next_step : float
+        Trial length of the next sub-step, to carry into the next call.
+    accepted, rejected : int
+        Number of accepted and rejected sub-steps.
+    """
+    h = min(first_step or duration, max_step)
+    min_step = duration * SUBSTEP_MIN_FRACTION
+    elapsed = 0.0
+    accepted = rejected = 0
+    while duration - elapsed > min_step:
+        h_now = min(h, duration - elapsed)
+        whole = step(values, h_now)
+        half = step(step(values, h_now / 2), h_now / 2)
+        error = float(np.max(np.abs(half - whole), initial=0.0))
+        if error > 0:
+            factor = SUBSTEP_SAFETY * float(np.sqrt(tolerance / error))
+        else:
+            factor = SUBSTEP_MAX_FACTOR
+        factor = min(max(factor, SUBSTEP_MIN_FACTOR), SUBSTEP_MAX_FACTOR)
+        if error <= tolerance or h_now <= min_step:
+            values = half
+            elapsed += h_now
+            accepted += 1
+            # A sub-step cut short by the end of the duration says nothing
+            # against the trial length
+            if h_now == h or factor < 1:
+                h = min(h_now * factor, max_step)
+        else:
+            rejected += 1
+            h = h_now * factor
+    return values, h, accepted, rejected
+
+
+def gather_body_temps(state: SwarmState, thermal_map: np.ndarray,
+                      origin: tuple[int] = (0, 0)) -> None:
+    """Copy the temperature of each footprint cell into the body blocks.
+
+    Agents whose core temperature leaves the safe range are killed. See
+    rasterize for ``origin``.
+    """
+    center = state.center
+    for radius, index, temps in gather_footprints(thermal_map, state,
+                                                  origin=origin):
+        d_row, d_col, _ = _footprint(radius)
+        state.body_temp[index[:, None], center + d_row,
+                        center + d_col] = temps
+    state.kill_out_of_range()